@@ -1,15 +1,43 @@
+import io
 import os
+import re
+import csv
+import sys
 import json
+import hashlib
+import time
+import heapq
+import queue
+import random
+import itertools
+import sqlite3
 import asyncio
+import logging
+import logging.handlers
+import threading
+import traceback
+import contextvars
+import urllib.request
 import aiohttp
-from datetime import datetime, timedelta, timezone
+from aiohttp import web
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from functools import lru_cache
+from datetime import date, datetime, timedelta, timezone
 from typing import Optional
 
 import pytz
+import numpy as np
 import discord
 from discord.ext import commands
 from discord import ui, ButtonStyle, Embed
 
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
 # Cargar variables de entorno
 try:
     from dotenv import load_dotenv
@@ -23,8 +51,25 @@ except ImportError:
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN") or "MTQwMzk1NjMwNDY5OTE5NTQ1Mw.GFGDK0.zf1SnzlJeuvGkZ3rsUlOAv2_RpONgAIY9stMW0"
 GOOGLE_SHEETS_WEBHOOK_URL = os.getenv("GOOGLE_SHEETS_WEBHOOK_URL") or "https://script.google.com/macros/s/AKfycbwjIgRW_6YPsJGE-twOXjEGJKzd5byyPF0JTl4DHeDEU-2TDSLVGQYlTppzUXOx5fAR/exec"
 
-# Para hosting: obtener PORT del entorno
+# Para hosting: obtener PORT del entorno (ahí se sirven /healthz, /readyz y /metrics)
 PORT = int(os.getenv("PORT", 5000))
+METRICAS_ACTIVAS = os.getenv("METRICAS_ACTIVAS", "1") == "1"
+METRICAS_HOST = os.getenv("METRICAS_HOST", "0.0.0.0")
+
+# Salud: /readyz falla con el outbox sobre la marca de agua o el circuito abierto más
+# de N minutos; /healthz falla si el gateway lleva más de N minutos desconectado
+SALUD_OUTBOX_MAX: int = int(os.getenv("SALUD_OUTBOX_MAX", "1000"))
+SALUD_CIRCUITO_MAX_MIN: float = float(os.getenv("SALUD_CIRCUITO_MAX_MIN", "10"))
+SALUD_GATEWAY_MAX_MIN: float = float(os.getenv("SALUD_GATEWAY_MAX_MIN", "15"))
+
+# Vigilancia del event loop: con más de LOOP_UMBRAL_S sin volver se vuelca al log la
+# pila del código que lo bloquea. LOOP_DEBUG=1 activa el modo debug de asyncio, que
+# avisa de cada callback que tarde más de LOOP_LENTO_S (tiene costo: solo para diagnóstico)
+LOOP_UMBRAL_S: float = float(os.getenv("LOOP_UMBRAL_S", "0.5"))
+LOOP_DEBUG = os.getenv("LOOP_DEBUG", "0") == "1"
+LOOP_LENTO_S: float = float(os.getenv("LOOP_LENTO_S", "0.1"))
+# Ventana del gauge de retraso máximo del loop (no se reinicia al leerlo)
+LOOP_VENTANA_MAX_S: float = float(os.getenv("LOOP_VENTANA_MAX_S", "60"))
 
 if not DISCORD_TOKEN:
     raise SystemExit(
@@ -32,81 +77,180 @@ if not DISCORD_TOKEN:
         "Define la variable de entorno DISCORD_TOKEN"
     )
 
+# =========================
+# LOGGING (JSON, FUERA DEL EVENT LOOP)
+# =========================
+# LOG_NIVELES permite ajustar por módulo, p. ej.: "asistencia.validacion=DEBUG,discord=WARNING"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_NIVELES = os.getenv("LOG_NIVELES", "")
+LOG_FORMATO = os.getenv("LOG_FORMATO", "json").lower()
+
+# Trazas por interacción: JSONL rotado (y OTLP/HTTP opcional, p. ej. http://localhost:4318/v1/traces)
+TRAZAS_ACTIVAS = os.getenv("TRAZAS_ACTIVAS", "1") == "1"
+TRAZAS_PATH = os.getenv("TRAZAS_PATH", "trazas.jsonl")
+TRAZAS_MAX_MB: float = float(os.getenv("TRAZAS_MAX_MB", "10"))
+TRAZAS_ARCHIVOS: int = int(os.getenv("TRAZAS_ARCHIVOS", "5"))
+TRAZAS_OTLP_URL = os.getenv("TRAZAS_OTLP_URL", "")
+
+log = logging.getLogger("asistencia")
+log_validacion = logging.getLogger("asistencia.validacion")
+log_sheets = logging.getLogger("asistencia.sheets")
+
+class FormateadorJSON(logging.Formatter):
+    """Un objeto JSON por línea con los campos estructurados del evento"""
+
+    CAMPOS = ("user_id", "usuario", "action", "team", "latencia_ms", "evento_id", "traza_id")
+
+    def format(self, record: logging.LogRecord) -> str:
+        datos = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for campo in self.CAMPOS:
+            valor = getattr(record, campo, None)
+            if valor is not None:
+                datos[campo] = valor
+        if record.exc_info:
+            datos["exc"] = self.formatException(record.exc_info)
+        return json.dumps(datos, ensure_ascii=False)
+
+class _QueueHandlerDiferido(logging.handlers.QueueHandler):
+    """Encola el registro sin formatear: el QueueListener lo formatea en su propio hilo"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # El contexto de la traza solo existe en el hilo que loguea
+        if getattr(record, "traza_id", None) is None:
+            traza = _traza_actual.get()
+            record.traza_id = traza.traza_id if traza else None
+        return record
+
+def configurar_logging() -> logging.handlers.QueueListener:
+    """Dirige todo el logging a una cola que escribe stdout desde un hilo aparte"""
+    salida = logging.StreamHandler(sys.stdout)
+    if LOG_FORMATO == "json":
+        salida.setFormatter(FormateadorJSON())
+    else:
+        salida.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    
+    cola = queue.SimpleQueue()
+    raiz = logging.getLogger()
+    raiz.handlers = [_QueueHandlerDiferido(cola)]
+    raiz.setLevel(LOG_LEVEL)
+    
+    for ajuste in filter(None, (p.strip() for p in LOG_NIVELES.split(","))):
+        nombre, _, nivel = ajuste.partition("=")
+        logging.getLogger(nombre.strip()).setLevel(nivel.strip().upper())
+    
+    listener = logging.handlers.QueueListener(cola, salida)
+    listener.start()
+    return listener
+
 if not GOOGLE_SHEETS_WEBHOOK_URL:
-    print("⚠️  GOOGLE_SHEETS_WEBHOOK_URL no configurado. Los eventos no se guardarán en Google Sheets.")
+    log.warning("GOOGLE_SHEETS_WEBHOOK_URL no configurado. Los eventos no se guardarán en Google Sheets.")
 
 LOG_CHANNEL_ID: int = int(os.getenv("DISCORD_LOG_CHANNEL_ID", "0"))
 TZ_ARGENTINA = pytz.timezone("America/Argentina/Buenos_Aires")
 
-# Variable global para trackear breaks
-breaks_activos = {}
+# Pool de conexiones hacia el webhook de Google Sheets
+SHEETS_MAX_CONEXIONES: int = int(os.getenv("SHEETS_MAX_CONEXIONES", "10"))
+SHEETS_KEEPALIVE_S: float = float(os.getenv("SHEETS_KEEPALIVE_S", "60"))
+SHEETS_DNS_TTL_S: int = int(os.getenv("SHEETS_DNS_TTL_S", "300"))
+SHEETS_TIMEOUT_S: float = float(os.getenv("SHEETS_TIMEOUT_S", "30"))
+
+# Outbox local: los eventos se guardan en disco antes de enviarse a Sheets
+ASISTENCIA_DB_PATH = os.getenv("ASISTENCIA_DB_PATH", "asistencia.db")
+OUTBOX_WORKERS: int = int(os.getenv("OUTBOX_WORKERS", "2"))
+OUTBOX_MAX_INTENTOS: int = int(os.getenv("OUTBOX_MAX_INTENTOS", "5"))
+OUTBOX_REINTENTO_S: float = float(os.getenv("OUTBOX_REINTENTO_S", "5"))
+OUTBOX_REINTENTO_MAX_S: float = float(os.getenv("OUTBOX_REINTENTO_MAX_S", "300"))
+
+# Historial local de eventos (base propia: su escritor no compite con el outbox)
+EVENTOS_DB_PATH = os.getenv("EVENTOS_DB_PATH", "eventos.db")
+EVENTOS_LOTE_MAX: int = int(os.getenv("EVENTOS_LOTE_MAX", "500"))
+# Días del historial que el reproceso recalcula por tanda (cada tanda es un checkpoint)
+REPROCESO_DIAS_TANDA: int = int(os.getenv("REPROCESO_DIAS_TANDA", "7"))
+# Reenviar las correcciones a Sheets solo si el Apps Script desplegado implementa
+# "reemplaza" (ver CONTRATO DE LOTES); el actual agrega una fila por POST y cada
+# corrección quedaría duplicada. Con "0" se corrige el historial local y el CSV.
+REPROCESO_ENVIAR_SHEETS = os.getenv("REPROCESO_ENVIAR_SHEETS", "0") == "1"
+
+# Circuit breaker del webhook y timeout adaptativo (p99 observado × factor)
+CIRCUITO_UMBRAL_FALLOS: int = int(os.getenv("CIRCUITO_UMBRAL_FALLOS", "5"))
+CIRCUITO_ABIERTO_S: float = float(os.getenv("CIRCUITO_ABIERTO_S", "30"))
+CIRCUITO_ABIERTO_MAX_S: float = float(os.getenv("CIRCUITO_ABIERTO_MAX_S", "300"))
+SHEETS_TIMEOUT_MIN_S: float = float(os.getenv("SHEETS_TIMEOUT_MIN_S", "5"))
+SHEETS_TIMEOUT_FACTOR_P99: float = float(os.getenv("SHEETS_TIMEOUT_FACTOR_P99", "2"))
+
+# Micro-lotes hacia Apps Script. Por defecto 1: un evento por POST, el contrato que
+# entiende el script desplegado. Subirlo solo con un script que implemente el
+# contrato de lotes (ver enviar_lote_a_sheets)
+SHEETS_LOTE_MAX: int = int(os.getenv("SHEETS_LOTE_MAX", "1"))
+SHEETS_LOTE_VENTANA_S: float = float(os.getenv("SHEETS_LOTE_VENTANA_S", "0.25"))
+SHEETS_CONFIRMACION_S: float = float(os.getenv("SHEETS_CONFIRMACION_S", "5"))
+
+# Timeout de cada llamada a Discord que corre en paralelo (DM, canal de logs)
+DISCORD_TIMEOUT_S: float = float(os.getenv("DISCORD_TIMEOUT_S", "10"))
+
+# Segundos que quedan visibles las respuestas efímeras antes de borrarse
+LIMPIEZA_RESPUESTA_S: float = float(os.getenv("LIMPIEZA_RESPUESTA_S", "8"))
+
+# Sesiones de asistencia: margen tras el fin del turno antes de descartar una sesión
+# abierta, y vida máxima de una sesión sin horario conocido
+SESION_GRACIA_H: float = float(os.getenv("SESION_GRACIA_H", "4"))
+SESION_MAX_H: float = float(os.getenv("SESION_MAX_H", "16"))
+
+# Diario de sesiones (una línea por transición) y su foto compactada
+SESIONES_DIARIO_PATH = os.getenv("SESIONES_DIARIO_PATH", "sesiones.jsonl")
+SESIONES_COMPACTAR_CADA: int = int(os.getenv("SESIONES_COMPACTAR_CADA", "2000"))
+
+# Recordatorios proactivos (login faltante, break largo, logout faltante)
+RECORDATORIOS_ACTIVOS = os.getenv("RECORDATORIOS_ACTIVOS", "1") == "1"
+
+# Caché de identidad por miembro (user.id → horario/equipo resuelto)
+IDENTIDAD_CACHE_MAX: int = int(os.getenv("IDENTIDAD_CACHE_MAX", "5000"))
+
+# Roster externo recargable en caliente (JSON o TOML); si no existe se usa el integrado
+ROSTER_PATH = os.getenv("ROSTER_PATH", "horarios.json")
+ROSTER_REVISION_S: float = float(os.getenv("ROSTER_REVISION_S", "30"))
+
+# Marca para "horario no resuelto todavía" (None significa "sin horario")
+_SIN_RESOLVER = object()
 
 # =========================
 # FUNCIÓN PARA CALCULAR FECHA DE JORNADA LABORAL
 # =========================
-def calcular_fecha_jornada(usuario: str, timestamp: datetime) -> str:
+def calcular_fecha_jornada(usuario: str, timestamp: datetime, horario=_SIN_RESOLVER) -> str:
     """Calcula la fecha de jornada laboral considerando turnos nocturnos"""
-    horario = HORARIOS_USUARIOS.get(usuario.lower().strip())
-    
-    if not horario:
-        # Buscar por nombre base si no se encuentra exacto
-        usuario_lower = usuario.lower().strip()
-        for key, value in HORARIOS_USUARIOS.items():
-            nombre_base = key.split(' ')[0]  # mauricio, antonio, etc.
-            if nombre_base in usuario_lower:
-                horario = value
-                break
+    if horario is _SIN_RESOLVER:
+        # Nombre exacto o nombre base (sin la búsqueda por palabras sueltas)
+        roster = roster_actual()
+        horario = roster.horario_en(roster.indice.buscar(usuario, usar_palabras=False), timestamp)
     
     if not horario:
         # Si no tiene horario definido, usar fecha actual
         return timestamp.strftime("%d/%m/%Y")
+    if horario.get("fecha_jornada"):
+        # El calendario ya sabe en qué día empezó el turno del evento
+        return horario["fecha_jornada"]
     
-    hora_evento = timestamp.hour
-    minuto_evento = timestamp.minute
-    hora_inicio = int(horario["inicio"].split(':')[0])
-    minuto_inicio = int(horario["inicio"].split(':')[1])
-    hora_fin = int(horario["fin"].split(':')[0])
-    minuto_fin = int(horario["fin"].split(':')[1])
-    
-    # Convertir a minutos desde medianoche para comparación precisa
-    minutos_evento = hora_evento * 60 + minuto_evento
-    minutos_inicio = hora_inicio * 60 + minuto_inicio
-    minutos_fin = hora_fin * 60 + minuto_fin
-    
-    print(f"🕐 Análisis jornada: {usuario} - Evento: {hora_evento:02d}:{minuto_evento:02d} - Horario: {horario['inicio']}-{horario['fin']}")
-    print(f"🕐 Minutos - Evento: {minutos_evento}, Inicio: {minutos_inicio}, Fin: {minutos_fin}")
-    
-    # Determinar si es turno nocturno (cruza medianoche)
-    es_turno_nocturno = minutos_inicio > minutos_fin
-    
-    if es_turno_nocturno:
-        print("🌙 Turno nocturno detectado")
-        
-        if minutos_evento >= minutos_inicio:
-            # Está en la parte nocturna del mismo día (ej: 22:30, 23:30)
-            fecha_jornada = timestamp.strftime("%d/%m/%Y")
-            print(f"✅ Parte nocturna - misma fecha: {fecha_jornada}")
-            return fecha_jornada
-        elif minutos_evento <= minutos_fin:
-            # Está en la parte matutina del día siguiente (ej: 00:47, 06:15)
-            # La jornada corresponde al día anterior
-            fecha_anterior = timestamp - timedelta(days=1)
-            fecha_jornada = fecha_anterior.strftime("%d/%m/%Y")
-            print(f"✅ Parte matutina - día anterior: {fecha_jornada}")
-            return fecha_jornada
-        else:
-            # Fuera del horario laboral
-            print("⚠️ Fuera de horario laboral nocturno")
-            return timestamp.strftime("%d/%m/%Y")
-    else:
-        # Turno diurno normal - usar fecha actual
-        fecha_jornada = timestamp.strftime("%d/%m/%Y")
-        print(f"☀️ Turno diurno - fecha actual: {fecha_jornada}")
-        return fecha_jornada
+    # Desplazamiento de jornada precalculado (0 o -1 día) para este minuto
+    minuto = timestamp.hour * 60 + timestamp.minute
+    desplazamiento = tablas_horario(horario["inicio"], horario["fin"]).jornada[minuto]
+    log_validacion.debug(
+        "Análisis jornada: %s - Evento: %02d:%02d - Horario: %s-%s - Desplazamiento: %d",
+        usuario, timestamp.hour, timestamp.minute, horario["inicio"], horario["fin"], desplazamiento
+    )
+    if desplazamiento:
+        # Parte matutina de un turno nocturno: la jornada corresponde al día anterior
+        return (timestamp + timedelta(days=desplazamiento)).strftime("%d/%m/%Y")
+    return timestamp.strftime("%d/%m/%Y")
 
 # =========================
 # HORARIOS DE USUARIOS CON EQUIPOS - ACTUALIZADO CON NOMBRES DE COLORES
 # =========================
+# Roster integrado: se usa solo si no existe el archivo ROSTER_PATH
 HORARIOS_USUARIOS = {
     # TEAM 1 - BlackTeam
     "mauricio t1": {"inicio": "13:00", "fin": "21:00", "team": "T1"},
@@ -135,55 +279,208 @@ HORARIOS_USUARIOS = {
     "kyle blueteam": {"inicio": "05:00", "fin": "13:00", "team": "T3"}
 }
 
+# =========================
+# ÍNDICE COMPILADO DEL ROSTER
+# =========================
+class IndiceRoster:
+    """Resuelve un apodo a su clave del roster en una sola pasada (autómata Aho-Corasick).
+    
+    Respeta la misma precedencia que la búsqueda lineal original:
+    1. Clave exacta.
+    2. Primera clave (en orden del roster) cuyo nombre base aparece en el apodo.
+    3. Primera clave con alguna palabra que aparece en el apodo.
+    """
+
+    _SIN_COINCIDENCIA = float("inf")
+
+    def __init__(self, horarios: dict):
+        self.claves = list(horarios)
+        self._exactas = set(self.claves)
+        
+        # Cada patrón guarda la menor posición de clave que lo usa, por etapa
+        prioridad_base = {}
+        prioridad_palabra = {}
+        for idx, clave in enumerate(self.claves):
+            palabras = clave.split()
+            if not palabras:
+                continue
+            prioridad_base.setdefault(palabras[0], idx)
+            for palabra in palabras:
+                prioridad_palabra.setdefault(palabra, idx)
+        
+        # Trie de todos los patrones
+        self._transiciones = [{}]
+        self._mejor_base = [self._SIN_COINCIDENCIA]
+        self._mejor_palabra = [self._SIN_COINCIDENCIA]
+        for patron in set(prioridad_base) | set(prioridad_palabra):
+            nodo = 0
+            for caracter in patron:
+                siguiente = self._transiciones[nodo].get(caracter)
+                if siguiente is None:
+                    siguiente = len(self._transiciones)
+                    self._transiciones[nodo][caracter] = siguiente
+                    self._transiciones.append({})
+                    self._mejor_base.append(self._SIN_COINCIDENCIA)
+                    self._mejor_palabra.append(self._SIN_COINCIDENCIA)
+                nodo = siguiente
+            self._mejor_base[nodo] = prioridad_base.get(patron, self._SIN_COINCIDENCIA)
+            self._mejor_palabra[nodo] = prioridad_palabra.get(patron, self._SIN_COINCIDENCIA)
+        
+        # Enlaces de fallo (BFS); cada nodo hereda la mejor prioridad de su sufijo
+        self._fallo = [0] * len(self._transiciones)
+        cola = list(self._transiciones[0].values())
+        for nodo in cola:
+            for caracter, hijo in self._transiciones[nodo].items():
+                cola.append(hijo)
+                f = self._fallo[nodo]
+                while f and caracter not in self._transiciones[f]:
+                    f = self._fallo[f]
+                destino = self._transiciones[f].get(caracter, 0)
+                self._fallo[hijo] = destino if destino != hijo else 0
+                self._mejor_base[hijo] = min(self._mejor_base[hijo], self._mejor_base[self._fallo[hijo]])
+                self._mejor_palabra[hijo] = min(self._mejor_palabra[hijo], self._mejor_palabra[self._fallo[hijo]])
+
+    def buscar(self, nombre_usuario: str, usar_palabras: bool = True) -> Optional[str]:
+        """Devuelve la clave del roster que corresponde al apodo, o None"""
+        nombre_lower = nombre_usuario.lower().strip()
+        if nombre_lower in self._exactas:
+            return nombre_lower
+        
+        transiciones = self._transiciones
+        fallo = self._fallo
+        mejor_base = self._mejor_base
+        mejor_palabra = self._mejor_palabra
+        base = palabra = self._SIN_COINCIDENCIA
+        nodo = 0
+        for caracter in nombre_lower:
+            while nodo and caracter not in transiciones[nodo]:
+                nodo = fallo[nodo]
+            nodo = transiciones[nodo].get(caracter, 0)
+            if mejor_base[nodo] < base:
+                base = mejor_base[nodo]
+            if mejor_palabra[nodo] < palabra:
+                palabra = mejor_palabra[nodo]
+        
+        if base != self._SIN_COINCIDENCIA:
+            return self.claves[base]
+        if usar_palabras and palabra != self._SIN_COINCIDENCIA:
+            return self.claves[palabra]
+        return None
+
 def obtener_nombre_usuario(user: discord.Member) -> str:
     """Obtiene el nombre del usuario (nickname del servidor o display_name)"""
     if hasattr(user, 'nick') and user.nick:
         return user.nick.lower()
     return user.display_name.lower()
 
-def obtener_info_usuario(nombre_usuario: str) -> dict:
+def obtener_info_usuario(nombre_usuario: str, roster=None) -> dict:
     """Obtiene el horario y equipo asignado al usuario - MEJORADO para nombres de colores"""
-    nombre_lower = nombre_usuario.lower().strip()
-    
-    # Buscar por nombre exacto
-    if nombre_lower in HORARIOS_USUARIOS:
-        info = HORARIOS_USUARIOS[nombre_lower].copy()
-        info["nombre_completo"] = nombre_lower
-        return info
-    
-    # Buscar por contenido parcial (nombre + team/color)
-    for usuario_key, info in HORARIOS_USUARIOS.items():
-        # Extraer solo el nombre base (sin t1/t2/t3/blackteam/redteam/blueteam)
-        nombre_base = usuario_key.split()[0]  # mauricio, antonio, hosman, etc.
-        
-        # Si el nombre del usuario contiene el nombre base
-        if nombre_base in nombre_lower:
-            info_copy = info.copy()
-            info_copy["nombre_completo"] = usuario_key
-            return info_copy
-    
-    # Buscar por palabras individuales
-    for usuario_key, info in HORARIOS_USUARIOS.items():
-        if any(palabra in nombre_lower for palabra in usuario_key.split()):
-            info_copy = info.copy()
-            info_copy["nombre_completo"] = usuario_key
-            return info_copy
+    roster = roster or roster_actual()
+    # Exacto → nombre base (mauricio, antonio...) → palabras sueltas (t1, redteam...)
+    usuario_key = roster.indice.buscar(nombre_usuario)
+    if not usuario_key:
+        return None
     
-    return None
+    info_copy = roster.horarios[usuario_key].copy()
+    info_copy["nombre_completo"] = usuario_key
+    return info_copy
 
-def obtener_horario_usuario(nombre_usuario: str) -> dict:
-    """Obtiene solo el horario asignado al usuario (compatibilidad)"""
-    info = obtener_info_usuario(nombre_usuario)
-    if info:
-        return {"inicio": info["inicio"], "fin": info["fin"]}
+def obtener_horario_usuario(nombre_usuario: str, momento: Optional[datetime] = None) -> dict:
+    """Obtiene solo el horario asignado al usuario (el del calendario si se indica el momento)"""
+    roster = roster_actual()
+    if momento is not None:
+        horario = roster.horario_en(roster.indice.buscar(nombre_usuario), momento)
+    else:
+        horario = obtener_info_usuario(nombre_usuario, roster)
+    if horario:
+        return {"inicio": horario["inicio"], "fin": horario["fin"]}
     return None
 
+# =========================
+# CACHÉ DE IDENTIDAD POR MIEMBRO
+# =========================
+class IdentidadUsuario:
+    """Resultado de resolver el apodo de un miembro contra una versión del roster"""
+    __slots__ = ("nombre", "version", "roster", "clave", "clave_jornada", "info", "team", "horario", "horario_jornada")
+
+    def __init__(self, nombre: str, roster=None):
+        roster = roster or roster_actual()
+        self.nombre = nombre
+        self.version = roster.version
+        self.roster = roster
+        self.clave = roster.indice.buscar(nombre)
+        self.info = obtener_info_usuario(nombre, roster)
+        self.team = self.info["team"] if self.info else "SIN_EQUIPO"
+        self.horario = {"inicio": self.info["inicio"], "fin": self.info["fin"]} if self.info else None
+        # calcular_fecha_jornada no usa la búsqueda por palabras sueltas
+        self.clave_jornada = roster.indice.buscar(nombre, usar_palabras=False)
+        self.horario_jornada = roster.horarios[self.clave_jornada] if self.clave_jornada else None
+
+    def horario_en(self, momento: datetime) -> Optional[dict]:
+        """Horario para validar un evento en ese momento (fijo o según el calendario)"""
+        if self.clave in self.roster.calendarios:
+            return self.roster.horario_en(self.clave, momento)
+        return self.horario
+
+    def horario_jornada_en(self, momento: datetime) -> Optional[dict]:
+        if self.clave_jornada in self.roster.calendarios:
+            return self.roster.horario_en(self.clave_jornada, momento)
+        return self.horario_jornada
+
+class CacheIdentidad:
+    """Caché LRU user.id → IdentidadUsuario; se invalida cuando cambia el apodo"""
+
+    def __init__(self, max_entradas: int):
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def resolver(self, user: discord.abc.User) -> IdentidadUsuario:
+        identidad = self._datos.get(user.id)
+        if identidad is not None:
+            self._datos.move_to_end(user.id)
+            self.hits += 1
+            return identidad
+        
+        self.misses += 1
+        nombre = obtener_nombre_usuario(user) if hasattr(user, 'nick') else str(user)
+        identidad = IdentidadUsuario(nombre)
+        self._datos[user.id] = identidad
+        if len(self._datos) > self.max_entradas:
+            self._datos.popitem(last=False)
+        return identidad
+
+    def invalidar(self, user_id: int):
+        self._datos.pop(user_id, None)
+
+    def limpiar(self):
+        self._datos.clear()
+
+    def precargar(self, miembros) -> int:
+        """Resuelve de antemano a los miembros (hasta llenar la caché)"""
+        cargados = 0
+        for miembro in miembros:
+            if len(self._datos) >= self.max_entradas:
+                break
+            if miembro.bot or miembro.id in self._datos:
+                continue
+            self._datos[miembro.id] = IdentidadUsuario(obtener_nombre_usuario(miembro))
+            cargados += 1
+        return cargados
+
+    def resumen_stats(self) -> str:
+        total = self.hits + self.misses
+        tasa = (self.hits / total * 100) if total else 0.0
+        return (
+            f"Entradas: `{len(self._datos)}/{self.max_entradas}`\n"
+            f"Hits: `{self.hits}` │ Misses: `{self.misses}` ({tasa:.0f}% hits)"
+        )
+
+cache_identidad = CacheIdentidad(IDENTIDAD_CACHE_MAX)
+
 def calcular_horas_jornada(inicio_str: str, fin_str: str) -> float:
     """Calcula las horas de la jornada laboral"""
-    def hora_a_minutos(hora_str: str) -> int:
-        hora, minuto = map(int, hora_str.split(':'))
-        return hora * 60 + minuto
-    
     inicio_mins = hora_a_minutos(inicio_str)
     fin_mins = hora_a_minutos(fin_str)
     
@@ -192,944 +489,3393 @@ def calcular_horas_jornada(inicio_str: str, fin_str: str) -> float:
     else:  # Turno diurno
         return (fin_mins - inicio_mins) / 60
 
+BREAK_MAX_MIN = 40  # 30 + 10 de tolerancia
+
 def validar_break_tiempo(hora_break: datetime, hora_logout_break: datetime) -> tuple:
     """Valida si el tiempo de break fue excedido - TOLERANCIA 40 MIN TOTAL"""
     tiempo_break = (hora_logout_break - hora_break).total_seconds() / 60  # minutos
     
-    if tiempo_break > 40:  # Más de 40 minutos (30 + 10 tolerancia)
+    if tiempo_break > BREAK_MAX_MIN:  # Más de 40 minutos (30 + 10 tolerancia)
         return False, f"- BREAK EXCEDIDO ({int(tiempo_break)} min)"
     else:
         return True, ""
 
-def validar_login(usuario_nombre: str, hora_actual: datetime) -> tuple:
-    """Valida si el login está dentro del horario permitido - TOLERANCIA 10 MIN"""
-    horario = obtener_horario_usuario(usuario_nombre)
-    if not horario:
-        return True, ""  # Si no tiene horario asignado, permitir
-    
-    # Obtener hora actual en minutos desde medianoche
-    hora_actual_mins = hora_actual.hour * 60 + hora_actual.minute
-    
-    # Convertir horarios a minutos
-    def hora_a_minutos(hora_str: str) -> int:
-        hora, minuto = map(int, hora_str.split(':'))
-        return hora * 60 + minuto
-    
-    hora_inicio_mins = hora_a_minutos(horario["inicio"])
-    
-    print(f"🔍 Validando login: {usuario_nombre}")
-    print(f"📅 Hora actual: {hora_actual.strftime('%H:%M')} ({hora_actual_mins} mins)")
-    print(f"⏰ Horario inicio: {horario['inicio']} ({hora_inicio_mins} mins)")
-    
-    # TOLERANCIA: SOLO 10 MINUTOS (antes y después)
-    # 10 min antes = TEMPRANO ✅
-    # Hora exacta hasta 10 min después = A TIEMPO ✅  
-    # Más de 10 min después = TARDE ❌
-    
-    # Calcular diferencia considerando turnos nocturnos
-    diferencia_mins = 0
+# =========================
+# TABLAS DE VEREDICTOS POR MINUTO (1440 POR HORARIO)
+# =========================
+# Cada horario se compila una sola vez en tablas indexadas por hora*60+minuto;
+# validar un evento pasa a ser un acceso por índice en vez de parsear "HH:MM"
+# y recorrer los casos de turno nocturno en cada clic.
+MINUTOS_DIA = 24 * 60
+FUERA_DE_HORARIO = -32768  # Marca en la tabla de login (fuera del rango de diferencias)
+LOGOUT_OK, LOGOUT_MUY_TEMPRANO, LOGOUT_FUERA_DE_TIEMPO = 0, 1, 2
+TOLERANCIA_LOGIN_MIN = 10
+TOLERANCIA_LOGOUT_MIN = 10
+
+def hora_a_minutos(hora_str: str) -> int:
+    hora, minuto = map(int, hora_str.split(':'))
+    return hora * 60 + minuto
+
+def _diferencia_login(hora_inicio_mins: int, hora_actual_mins: int) -> int:
+    """Minutos desde el inicio del turno (negativo = antes) o FUERA_DE_HORARIO"""
     if hora_inicio_mins > 12 * 60:  # Turno nocturno (inicia después del mediodía)
         # EJEMPLO LUIS: 22:30 (1350 mins)
         if hora_actual_mins >= hora_inicio_mins:
             # Mismo día: 22:30, 22:45, 23:00, etc.
-            diferencia_mins = hora_actual_mins - hora_inicio_mins
+            return hora_actual_mins - hora_inicio_mins
         elif hora_actual_mins < 12 * 60:  # Próximo día (00:00-11:59)
             # Día siguiente: 01:36 = ya pasaron (24*60 - 1350) + 96 = 186 minutos = 3h 6min
-            diferencia_mins = (24 * 60 - hora_inicio_mins) + hora_actual_mins
-        else:
-            # Entre mediodía y hora de inicio = FUERA DE HORARIO
-            print("⚠️ Login FUERA DE HORARIO LABORAL")
-            return False, "- FUERA DE HORARIO"
-    else:
-        # Turno diurno normal
-        diferencia_mins = hora_actual_mins - hora_inicio_mins
-    
-    print(f"📊 Diferencia: {diferencia_mins} minutos ({diferencia_mins/60:.1f} horas)")
-    
-    # Evaluar según diferencia - TOLERANCIA 10 MIN
-    if diferencia_mins < -10:
-        print("⚠️ Login MUY TEMPRANO")
-        return False, "- MUY TEMPRANO"
-    elif -10 <= diferencia_mins <= 0:
-        print("✅ Login temprano (permitido)")
-        return True, ""
-    elif 0 < diferencia_mins <= 10:
-        print("✅ Login a tiempo")
-        return True, ""
-    else:
-        horas_tarde = diferencia_mins / 60
-        print(f"⚠️ Login TARDE ({horas_tarde:.1f} horas)")
-        return False, f"- TARDE ({horas_tarde:.1f}h)"
+            return (MINUTOS_DIA - hora_inicio_mins) + hora_actual_mins
+        # Entre mediodía y hora de inicio = FUERA DE HORARIO
+        return FUERA_DE_HORARIO
+    # Turno diurno normal
+    return hora_actual_mins - hora_inicio_mins
 
-def validar_logout(usuario_nombre: str, hora_actual: datetime, tiene_login: bool) -> tuple:
-    """Valida el logout - TOLERANCIA 10 MIN"""
-    horario = obtener_horario_usuario(usuario_nombre)
-    if not horario:
-        return True, ""
-    
-    if not tiene_login:
-        return True, "- NO MARCO INICIO"
-    
-    # Obtener hora actual en minutos
-    hora_actual_mins = hora_actual.hour * 60 + hora_actual.minute
-    
-    def hora_a_minutos(hora_str: str) -> int:
-        hora, minuto = map(int, hora_str.split(':'))
-        return hora * 60 + minuto
-    
-    hora_fin_mins = hora_a_minutos(horario["fin"])
-    hora_inicio_mins = hora_a_minutos(horario["inicio"])
-    
-    print(f"🔍 Validando logout: {usuario_nombre}")
-    print(f"📅 Hora actual: {hora_actual.strftime('%H:%M')} ({hora_actual_mins} mins)")
-    print(f"⏰ Horario fin: {horario['fin']} ({hora_fin_mins} mins)")
-    
-    # TOLERANCIA: SOLO 10 MINUTOS después del horario de salida
-    tolerancia_logout = 10
-    
-    # Calcular diferencia considerando turnos nocturnos
-    diferencia_mins = 0
+def _codigo_logout(hora_inicio_mins: int, hora_fin_mins: int, hora_actual_mins: int) -> int:
     if hora_inicio_mins > hora_fin_mins:  # Turno nocturno
         # EJEMPLO LUIS: 22:30 - 06:30
-        if hora_actual_mins <= 12 * 60:  # Parte matutina (00:00-11:59)
-            # Logout en la mañana del día siguiente
-            diferencia_mins = hora_actual_mins - hora_fin_mins
-        else:
+        if hora_actual_mins > 12 * 60:
             # Logout el mismo día (muy temprano)
-            print("⚠️ Logout MUY TEMPRANO (mismo día)")
-            return False, "- MUY TEMPRANO"
+            return LOGOUT_MUY_TEMPRANO
+        # Logout en la mañana del día siguiente
+        diferencia_mins = hora_actual_mins - hora_fin_mins
     else:
         # Turno diurno normal
         diferencia_mins = hora_actual_mins - hora_fin_mins
-    
-    print(f"📊 Diferencia: {diferencia_mins} minutos")
-    
-    # Evaluar según diferencia - TOLERANCIA 10 MIN
-    if diferencia_mins <= 0:
-        print("✅ Logout a tiempo")
-        return True, ""
-    elif diferencia_mins <= tolerancia_logout:
-        print("✅ Logout dentro de tolerancia")
-        return True, ""
-    else:
-        print("⚠️ Logout FUERA DE TIEMPO")
-        return False, "- FUERA DE TIEMPO"
+    return LOGOUT_OK if diferencia_mins <= TOLERANCIA_LOGOUT_MIN else LOGOUT_FUERA_DE_TIEMPO
+
+def _desplazamiento_jornada(hora_inicio_mins: int, hora_fin_mins: int, hora_actual_mins: int) -> int:
+    """-1 si el evento pertenece a la jornada del día anterior, 0 si no"""
+    es_turno_nocturno = hora_inicio_mins > hora_fin_mins
+    if es_turno_nocturno and hora_actual_mins < hora_inicio_mins and hora_actual_mins <= hora_fin_mins:
+        # Parte matutina del día siguiente (ej: 00:47, 06:15)
+        return -1
+    return 0
+
+class TablasHorario:
+    """Veredictos precalculados de un horario para los 1440 minutos del día"""
+    __slots__ = ("inicio", "fin", "login", "logout", "jornada")
+
+    def __init__(self, inicio: str, fin: str):
+        self.inicio = inicio
+        self.fin = fin
+        inicio_mins = hora_a_minutos(inicio)
+        fin_mins = hora_a_minutos(fin)
+        minutos = range(MINUTOS_DIA)
+        self.login = array('h', (_diferencia_login(inicio_mins, m) for m in minutos))
+        self.logout = bytes(_codigo_logout(inicio_mins, fin_mins, m) for m in minutos)
+        self.jornada = array('b', (_desplazamiento_jornada(inicio_mins, fin_mins, m) for m in minutos))
+
+@lru_cache(maxsize=None)
+def tablas_horario(inicio: str, fin: str) -> TablasHorario:
+    """Tablas compiladas de un par inicio/fin (compartidas entre alias con el mismo horario)"""
+    return TablasHorario(inicio, fin)
+
+def compilar_tablas_roster(horarios: dict) -> int:
+    """Precompila las tablas de todos los horarios del roster. Devuelve cuántas hay"""
+    for info in horarios.values():
+        tablas_horario(info["inicio"], info["fin"])
+    return tablas_horario.cache_info().currsize
 
 # =========================
-# FUNCIÓN PARA GOOGLE SHEETS
+# CALENDARIO DE TURNOS (ROTACIONES, EXCEPCIONES Y TURNOS PARTIDOS)
 # =========================
-async def actualizar_registro_usuario(
-    user: discord.abc.User,
-    action: str,
-    guild: Optional[discord.Guild],
-    channel: Optional[discord.abc.GuildChannel],
-    modelos_data: Optional[list] = None,
-    validacion_msg: Optional[str] = None
-):
-    """Actualiza o crea el registro del usuario en Google Sheets"""
-    if not GOOGLE_SHEETS_WEBHOOK_URL:
-        print("⚠️  No se puede enviar a Google Sheets: URL no configurada")
-        return False
-    
+# Campos opcionales de cada alias en el archivo de roster:
+#     "semana": {"lun": ["13:00-21:00"], "sab": ["09:00-13:00", "17:00-21:00"], "dom": []}
+#     "rotacion": {"desde": "2026-10-05", "semanas": [{...semana A...}, {...semana B...}]}
+#     "excepciones": [{"desde": "2026-12-24", "hasta": "2026-12-25", "turnos": []}]
+# Un día que no figura usa inicio/fin del alias y una lista vacía es franco.
+# Cada semana se indexa como intervalos ordenados en minutos de la semana (con las
+# semanas vecinas pegadas a los costados para los turnos que cruzan el domingo) y
+# las excepciones como rangos de fechas ordenados: las dos búsquedas son bisect.
+# El calendario solo elige el par inicio/fin del turno al que pertenece el evento;
+# los veredictos siguen saliendo de tablas_horario().
+MINUTOS_SEMANA = 7 * MINUTOS_DIA
+DIAS_SEMANA = ("lun", "mar", "mie", "jue", "vie", "sab", "dom")
+CAMPOS_CALENDARIO = ("semana", "rotacion", "excepciones")
+_PATRON_HORA = re.compile(r"^([01]\d|2[0-3]):[0-5]\d$")
+_SIN_ACENTOS = str.maketrans("áéíóú", "aeiou")
+
+def _parsear_turno(texto) -> tuple:
+    """'22:00-06:00' → (1320, '22:00', '06:00')"""
+    partes = [p.strip() for p in str(texto).split("-")]
+    if len(partes) != 2 or not all(_PATRON_HORA.match(p) for p in partes):
+        raise ValueError(f"turno '{texto}' inválido (formato HH:MM-HH:MM)")
+    if partes[0] == partes[1]:
+        raise ValueError(f"turno '{texto}' sin duración")
+    return hora_a_minutos(partes[0]), partes[0], partes[1]
+
+def _parsear_fecha(texto) -> date:
     try:
-        # Obtener timestamp en zona horaria Argentina
-        timestamp_argentina = datetime.now(TZ_ARGENTINA)
-        
-        # Obtener nombre del usuario (nickname o display_name)
-        usuario_nombre = obtener_nombre_usuario(user) if hasattr(user, 'nick') else str(user)
-        
-        # Obtener información del equipo
-        info_usuario = obtener_info_usuario(usuario_nombre)
-        team = info_usuario["team"] if info_usuario else "SIN_EQUIPO"
-        
-        # Calcular fecha de jornada laboral para turnos nocturnos
-        fecha_jornada = calcular_fecha_jornada(usuario_nombre, timestamp_argentina)
-        
-        data = {
-            "timestamp": timestamp_argentina.isoformat(),
-            "usuario": usuario_nombre,
-            "action": action,
-            "team": team,
-            "fecha_jornada": fecha_jornada,
-            "validacion": validacion_msg or ""
-        }
+        return datetime.strptime(str(texto), "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError(f"fecha '{texto}' inválida (formato AAAA-MM-DD)") from None
+
+def _turnos_del_dia(valor) -> tuple:
+    if not isinstance(valor, list):
+        raise ValueError("cada día debe ser una lista de turnos")
+    return tuple(sorted(_parsear_turno(t) for t in valor))
+
+def _duracion_turno(inicio_mins: int, fin: str) -> int:
+    return (hora_a_minutos(fin) - inicio_mins) % MINUTOS_DIA
+
+def _turno_mas_cercano(comienzos: list, intervalos: list, minuto: int):
+    """Intervalo que contiene al minuto o, si cae entre dos turnos, el más cercano"""
+    i = bisect_right(comienzos, minuto) - 1
+    anterior = intervalos[i] if i >= 0 else None
+    siguiente = intervalos[i + 1] if i + 1 < len(intervalos) else None
+    if anterior and (not siguiente or minuto - anterior[1] <= siguiente[0] - minuto):
+        return anterior
+    return siguiente
+
+class CalendarioTurnos:
+    """Turnos de un alias que cambian según el día de la semana, la rotación o la fecha"""
+    __slots__ = ("semanas", "indices", "rotacion_desde", "exc_desde", "exc_hasta", "exc_turnos")
+
+    def __init__(self, info: dict):
+        base = ((hora_a_minutos(info["inicio"]), info["inicio"], info["fin"]),)
+        rotacion = info.get("rotacion")
+        if rotacion:
+            if not isinstance(rotacion, dict) or not isinstance(rotacion.get("semanas"), list) or not rotacion["semanas"]:
+                raise ValueError("'rotacion' necesita 'desde' y una lista 'semanas'")
+            patrones = rotacion["semanas"]
+            desde = _parsear_fecha(rotacion.get("desde"))
+            self.rotacion_desde = desde - timedelta(days=desde.weekday())  # Lunes de esa semana
+        else:
+            patrones = [info.get("semana") or {}]
+            self.rotacion_desde = None
         
-        # Agregar datos de modelos si es logout
-        if action == "logout" and modelos_data:
-            data.update({
-                "modelos_data": modelos_data,
-                "cantidad_modelos": len(modelos_data)
-            })
+        self.semanas = [self._compilar_semana(patron, base) for patron in patrones]
+        n = len(self.semanas)
+        self.indices = [
+            self._indexar_semana(self.semanas[(k - 1) % n], self.semanas[k], self.semanas[(k + 1) % n])
+            for k in range(n)
+        ]
         
-        print(f"🔍 Actualizando registro: {usuario_nombre} - {action} - Team: {team}")
-        if modelos_data:
-            print(f"📊 Modelos: {len(modelos_data)} modelos registrados")
+        excepciones = []
+        for exc in info.get("excepciones") or []:
+            if not isinstance(exc, dict):
+                raise ValueError("cada excepción debe tener desde/hasta/turnos")
+            desde = _parsear_fecha(exc.get("desde"))
+            hasta = _parsear_fecha(exc.get("hasta", exc.get("desde")))
+            if hasta < desde:
+                raise ValueError(f"excepción {desde} termina antes de empezar")
+            excepciones.append((desde.toordinal(), hasta.toordinal(), _turnos_del_dia(exc.get("turnos", []))))
+        excepciones.sort()
+        for a, b in zip(excepciones, excepciones[1:]):
+            if b[0] <= a[1]:
+                raise ValueError(f"excepciones superpuestas el {date.fromordinal(b[0])}")
+        self.exc_desde = [e[0] for e in excepciones]
+        self.exc_hasta = [e[1] for e in excepciones]
+        self.exc_turnos = [e[2] for e in excepciones]
+
+    @staticmethod
+    def _compilar_semana(patron, base: tuple) -> tuple:
+        if not isinstance(patron, dict):
+            raise ValueError("cada semana debe ser un objeto con días (lun..dom)")
+        dias = {}
+        for dia, turnos in patron.items():
+            clave = str(dia).lower().strip().translate(_SIN_ACENTOS)[:3]
+            if clave not in DIAS_SEMANA:
+                raise ValueError(f"día '{dia}' desconocido")
+            dias[clave] = _turnos_del_dia(turnos)
+        return tuple(dias.get(dia, base) for dia in DIAS_SEMANA)
+
+    @staticmethod
+    def _indexar_semana(anterior: tuple, semana: tuple, siguiente: tuple) -> tuple:
+        """(comienzos, intervalos) en minutos desde el lunes 00:00 de la semana"""
+        intervalos = []
+        for desplazamiento, dias in ((-MINUTOS_SEMANA, anterior), (0, semana), (MINUTOS_SEMANA, siguiente)):
+            for d, turnos in enumerate(dias):
+                for inicio_mins, inicio, fin in turnos:
+                    comienzo = desplazamiento + d * MINUTOS_DIA + inicio_mins
+                    intervalos.append((comienzo, comienzo + _duracion_turno(inicio_mins, fin), inicio, fin))
+        intervalos.sort()
+        for a, b in zip(intervalos, intervalos[1:]):
+            if b[0] < a[1]:
+                raise ValueError(f"turnos superpuestos: {a[2]}-{a[3]} y {b[2]}-{b[3]}")
+        return [iv[0] for iv in intervalos], intervalos
+
+    def _semana_rotacion(self, fecha: date) -> int:
+        if self.rotacion_desde is None:
+            return 0
+        return ((fecha - self.rotacion_desde).days // 7) % len(self.semanas)
+
+    def turnos_fecha(self, fecha: date) -> tuple:
+        i = bisect_right(self.exc_desde, fecha.toordinal()) - 1
+        if i >= 0 and self.exc_hasta[i] >= fecha.toordinal():
+            return self.exc_turnos[i]
+        return self.semanas[self._semana_rotacion(fecha)][fecha.weekday()]
+
+    def pares(self) -> set:
+        """Todos los pares inicio/fin que puede devolver (para precompilar tablas)"""
+        dias = [t for semana in self.semanas for t in semana] + self.exc_turnos
+        return {(inicio, fin) for turnos in dias for _, inicio, fin in turnos}
+
+    def horario_en(self, momento: datetime) -> Optional[dict]:
+        """Turno al que pertenece el momento (o el más cercano del día anterior, actual o siguiente)"""
+        fecha = momento.date()
+        minuto = momento.hour * 60 + momento.minute
+        hoy = fecha.toordinal()
         
-        # Aumentar timeout a 30 segundos
-        timeout = aiohttp.ClientTimeout(total=30)
+        i = bisect_right(self.exc_desde, hoy + 1) - 1
+        if i >= 0 and self.exc_hasta[i] >= hoy - 1:
+            # Hay una excepción entre ayer y mañana: armar los candidatos de esos tres días
+            intervalos = []
+            for delta in (-1, 0, 1):
+                for inicio_mins, inicio, fin in self.turnos_fecha(fecha + timedelta(days=delta)):
+                    comienzo = delta * MINUTOS_DIA + inicio_mins
+                    intervalos.append((comienzo, comienzo + _duracion_turno(inicio_mins, fin), inicio, fin))
+            intervalos.sort()
+            elegido = _turno_mas_cercano([iv[0] for iv in intervalos], intervalos, minuto)
+            origen = fecha
+        else:
+            comienzos, intervalos = self.indices[self._semana_rotacion(fecha)]
+            elegido = _turno_mas_cercano(comienzos, intervalos, fecha.weekday() * MINUTOS_DIA + minuto)
+            origen = fecha - timedelta(days=fecha.weekday())
         
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            # Intentar hasta 2 veces
-            for intento in range(2):
+        if not elegido:
+            return None
+        dia_turno = origen + timedelta(days=elegido[0] // MINUTOS_DIA)
+        if abs((dia_turno - fecha).days) > 1:
+            return None  # Franco: el turno más cercano es de otro día
+        return {"inicio": elegido[2], "fin": elegido[3], "fecha_jornada": dia_turno.strftime("%d/%m/%Y")}
+
+# =========================
+# ROSTER ACTIVO (ARCHIVO EXTERNO RECARGABLE)
+# =========================
+# Formato del archivo (JSON; en TOML la misma estructura):
+#     {"version": "2026-10-01", "horarios": {"mauricio t1": {"inicio": "13:00", "fin": "21:00", "team": "T1"}, ...}}
+# Al detectar un cambio se valida y compila en segundo plano, y se reemplaza la
+# referencia global de una sola vez. Cada interacción resuelve su IdentidadUsuario
+# al empezar y sigue usando esa versión aunque el roster cambie a mitad del flujo.
+
+class RosterActivo:
+    """Una versión del roster con sus estructuras de búsqueda compiladas"""
+    __slots__ = ("horarios", "indice", "calendarios", "version", "origen", "cargado", "mtime")
+
+    def __init__(self, horarios: dict, version: str, origen: str, mtime: Optional[float] = None):
+        self.horarios = horarios
+        self.indice = IndiceRoster(horarios)
+        self.calendarios = {}
+        for clave, info in horarios.items():
+            if any(campo in info for campo in CAMPOS_CALENDARIO):
                 try:
-                    async with session.post(
-                        GOOGLE_SHEETS_WEBHOOK_URL,
-                        json=data,
-                        headers={'Content-Type': 'application/json'}
-                    ) as response:
-                        
-                        if response.status == 200:
-                            result = await response.json()
-                            if result.get("result") == "success":
-                                print(f"✅ Registro actualizado: {usuario_nombre} - {action} - {team}")
-                                return True
-                            else:
-                                print(f"❌ Error en Google Sheets: {result.get('error', 'Unknown error')}")
-                                return False
-                        else:
-                            print(f"❌ HTTP Error {response.status} enviando a Google Sheets")
-                            if intento == 0:  # Si es el primer intento, reintentar
-                                print("🔄 Reintentando en 2 segundos...")
-                                await asyncio.sleep(2)
-                                continue
-                            return False
-                            
-                except asyncio.TimeoutError:
-                    print(f"❌ Timeout enviando a Google Sheets (intento {intento + 1}/2)")
-                    if intento == 0:  # Si es el primer intento, reintentar
-                        print("🔄 Reintentando en 2 segundos...")
-                        await asyncio.sleep(2)
-                        continue
-                    return False
-                except Exception as e:
-                    print(f"❌ Error enviando a Google Sheets (intento {intento + 1}/2): {e}")
-                    if intento == 0:  # Si es el primer intento, reintentar
-                        print("🔄 Reintentando en 2 segundos...")
-                        await asyncio.sleep(2)
-                        continue
-                    return False
-                
-                # Si llegamos aquí, fue exitoso
-                break
-            
-            return False  # Si llegamos aquí, ambos intentos fallaron
-                    
-    except Exception as e:
-        print(f"❌ Error general enviando a Google Sheets: {e}")
-        return False
+                    self.calendarios[clave] = CalendarioTurnos(info)
+                except ValueError as e:
+                    raise ValueError(f"'{clave}': {e}") from None
+        self.version = version
+        self.origen = origen
+        self.mtime = mtime
+        self.cargado = datetime.now(TZ_ARGENTINA)
+        compilar_tablas_roster(horarios)
+        for calendario in self.calendarios.values():
+            for inicio, fin in calendario.pares():
+                tablas_horario(inicio, fin)
 
-def build_embed(user: discord.abc.User, event: str, where: Optional[discord.abc.GuildChannel], validacion_msg: str = "") -> Embed:
-    """Construye un embed para mostrar el evento registrado"""
-    ts = datetime.now(TZ_ARGENTINA).strftime("%d/%m/%Y %H:%M:%S")
+    def horario_en(self, clave: Optional[str], momento: datetime) -> Optional[dict]:
+        """Horario de un alias para un momento dado (según su calendario si lo tiene)"""
+        if not clave:
+            return None
+        calendario = self.calendarios.get(clave)
+        return calendario.horario_en(momento) if calendario else self.horarios[clave]
+
+    def turnos_del_dia(self, clave: str, fecha: date) -> list:
+        """Pares (inicio, fin) de los turnos que empiezan ese día"""
+        calendario = self.calendarios.get(clave)
+        if calendario:
+            return [(inicio, fin) for _, inicio, fin in calendario.turnos_fecha(fecha)]
+        return [(self.horarios[clave]["inicio"], self.horarios[clave]["fin"])]
+
+    def descripcion(self) -> str:
+        return f"`{self.version}` ({self.origen}, {len(self.horarios)} alias, cargado {self.cargado.strftime('%d/%m %H:%M')})"
+
+def validar_horarios(datos) -> dict:
+    """Valida y normaliza el contenido del archivo de roster (lanza ValueError)"""
+    if not isinstance(datos, dict) or not isinstance(datos.get("horarios"), dict):
+        raise ValueError("El archivo debe tener un objeto 'horarios'")
     
-    # Colores según validación
-    if validacion_msg:
-        if "TARDE" in validacion_msg:
-            color = discord.Color.orange()
-        elif "TEMPRANO" in validacion_msg:
-            color = discord.Color.yellow()
-        elif "NO MARCO" in validacion_msg:
-            color = discord.Color.purple()
-        elif "FUERA DE TIEMPO" in validacion_msg:
-            color = discord.Color.red()
-        elif "EXCEDIDO" in validacion_msg:
-            color = discord.Color.yellow()
-        else:
-            color = discord.Color.red()
-    else:
-        event_config = {
-            "Login": {"color": discord.Color.green()},
-            "Break": {"color": discord.Color.blue()},
-            "Logout Break": {"color": discord.Color.purple()}, 
-            "Logout": {"color": discord.Color.red()}
-        }
-        config = event_config.get(event, {"color": discord.Color.default()})
-        color = config["color"]
+    horarios = {}
+    for clave, info in datos["horarios"].items():
+        clave_normalizada = " ".join(str(clave).lower().split())
+        if not clave_normalizada:
+            raise ValueError("Hay un alias vacío")
+        if clave_normalizada in horarios:
+            raise ValueError(f"Alias duplicado: '{clave_normalizada}'")
+        if not isinstance(info, dict):
+            raise ValueError(f"'{clave}': se esperaba un objeto con inicio/fin/team")
+        for campo in ("inicio", "fin"):
+            if not _PATRON_HORA.match(str(info.get(campo, ""))):
+                raise ValueError(f"'{clave}': '{campo}' debe tener formato HH:MM")
+        if not str(info.get("team", "")).strip():
+            raise ValueError(f"'{clave}': falta 'team'")
+        horarios[clave_normalizada] = dict(info, team=str(info["team"]).strip())
     
-    embed = Embed(
-        title=f"📝 {event} Registrado {validacion_msg}",
-        description=f"**Horario Argentina** 🇦🇷",
-        color=color,
-        timestamp=datetime.now(timezone.utc)
-    )
+    if not horarios:
+        raise ValueError("El roster no tiene ningún alias")
+    return horarios
+
+def leer_roster(ruta: str) -> RosterActivo:
+    """Lee, valida y compila el roster desde disco (bloqueante: usar en un hilo)"""
+    with open(ruta, "rb") as f:
+        contenido = f.read()
+    mtime = os.path.getmtime(ruta)
     
-    # Obtener nombre del usuario
-    usuario_display = obtener_nombre_usuario(user) if hasattr(user, 'nick') else str(user)
+    if ruta.endswith(".toml"):
+        if tomllib is None:
+            raise ValueError("Leer TOML requiere Python 3.11+")
+        datos = tomllib.loads(contenido.decode("utf-8"))
+    else:
+        datos = json.loads(contenido)
     
-    embed.add_field(
-        name="👤 Usuario", 
-        value=f"{user.mention} (`{usuario_display}`)", 
-        inline=False
-    )
+    horarios = validar_horarios(datos)
+    huella = hashlib.sha1(contenido).hexdigest()[:8]
+    version = f"{datos['version']}-{huella}" if datos.get("version") else huella
+    return RosterActivo(horarios, version, os.path.basename(ruta), mtime)
+
+def _cargar_roster_inicial() -> RosterActivo:
+    if os.path.exists(ROSTER_PATH):
+        try:
+            return leer_roster(ROSTER_PATH)
+        except Exception as e:
+            log.error("Roster %s inválido, se usa el integrado: %s", ROSTER_PATH, e)
+    return RosterActivo(HORARIOS_USUARIOS, "integrado", "bot.py")
+
+_roster = _cargar_roster_inicial()
+
+def roster_actual() -> RosterActivo:
+    """Versión vigente del roster (la referencia se reemplaza de forma atómica)"""
+    return _roster
+
+def activar_roster(nuevo: RosterActivo):
+    global _roster
+    anterior = _roster
+    _roster = nuevo
+    # Las identidades en caché apuntan a la versión anterior
+    cache_identidad.limpiar()
+    log.info("Roster actualizado: %s → %s (%d alias)", anterior.version, nuevo.version, len(nuevo.horarios))
+
+async def recargar_roster(forzar: bool = False) -> bool:
+    """Recarga el archivo si cambió (o siempre con forzar). Devuelve True si hubo cambio"""
+    if not os.path.exists(ROSTER_PATH):
+        return False
+    if not forzar and os.path.getmtime(ROSTER_PATH) == roster_actual().mtime:
+        return False
+    nuevo = await asyncio.to_thread(leer_roster, ROSTER_PATH)
+    if nuevo.version == roster_actual().version:
+        roster_actual().mtime = nuevo.mtime
+        return False
+    activar_roster(nuevo)
+    recordatorios.replanificar()
+    return True
+
+async def vigilar_roster():
+    """Revisa periódicamente el mtime del archivo de roster"""
+    while True:
+        await asyncio.sleep(ROSTER_REVISION_S)
+        try:
+            await recargar_roster()
+        except Exception as e:
+            log.error("No se pudo recargar el roster (se mantiene %s): %s", roster_actual().version, e)
+
+def validar_login(usuario_nombre: str, hora_actual: datetime, horario=_SIN_RESOLVER) -> tuple:
+    """Valida si el login está dentro del horario permitido - TOLERANCIA 10 MIN"""
+    if horario is _SIN_RESOLVER:
+        horario = obtener_horario_usuario(usuario_nombre, hora_actual)
+    if not horario:
+        return True, ""  # Si no tiene horario asignado, permitir
     
-    embed.add_field(
-        name="⏰ Fecha/Hora (Argentina)", 
-        value=f"`{ts}`", 
-        inline=False
+    diferencia_mins = tablas_horario(horario["inicio"], horario["fin"]).login[hora_actual.hour * 60 + hora_actual.minute]
+    log_validacion.debug(
+        "Validando login: %s - Hora actual: %02d:%02d - Inicio: %s - Diferencia: %d",
+        usuario_nombre, hora_actual.hour, hora_actual.minute, horario["inicio"], diferencia_mins
     )
     
-    if validacion_msg:
-        embed.add_field(
-            name="⚠️ Observación",
-            value=f"`{validacion_msg}`",
-            inline=False
+    # TOLERANCIA: SOLO 10 MINUTOS (antes y después)
+    # 10 min antes = TEMPRANO ✅
+    # Hora exacta hasta 10 min después = A TIEMPO ✅  
+    # Más de 10 min después = TARDE ❌
+    if diferencia_mins == FUERA_DE_HORARIO:
+        return False, "- FUERA DE HORARIO"
+    if diferencia_mins < -TOLERANCIA_LOGIN_MIN:
+        return False, "- MUY TEMPRANO"
+    if diferencia_mins <= TOLERANCIA_LOGIN_MIN:
+        return True, ""
+    return False, f"- TARDE ({diferencia_mins / 60:.1f}h)"
+
+def validar_logout(usuario_nombre: str, hora_actual: datetime, tiene_login: bool, horario=_SIN_RESOLVER) -> tuple:
+    """Valida el logout - TOLERANCIA 10 MIN"""
+    if horario is _SIN_RESOLVER:
+        horario = obtener_horario_usuario(usuario_nombre, hora_actual)
+    if not horario:
+        return True, ""
+    
+    if not tiene_login:
+        return True, "- NO MARCO INICIO"
+    
+    codigo = tablas_horario(horario["inicio"], horario["fin"]).logout[hora_actual.hour * 60 + hora_actual.minute]
+    log_validacion.debug(
+        "Validando logout: %s - Hora actual: %02d:%02d - Fin: %s - Código: %d",
+        usuario_nombre, hora_actual.hour, hora_actual.minute, horario["fin"], codigo
+    )
+    
+    if codigo == LOGOUT_MUY_TEMPRANO:
+        return False, "- MUY TEMPRANO"
+    if codigo == LOGOUT_FUERA_DE_TIEMPO:
+        return False, "- FUERA DE TIEMPO"
+    return True, ""
+
+# =========================
+# SESIONES DE ASISTENCIA (MÁQUINA DE ESTADOS)
+# =========================
+# Orden esperado: Login → Break → Logout Break → ... → Logout. Un clic fuera de
+# orden se registra igual (nunca se pierde un evento), pero se marca en la
+# validación. Solo se guardan los usuarios con un turno o un break abierto.
+SIN_TURNO, EN_TURNO, EN_BREAK = 0, 1, 2
+NOMBRES_ESTADO = ("sin turno", "en turno", "en break")
+
+# (estado actual, acción) → (estado siguiente, marca si el clic está fuera de orden)
+TRANSICIONES = {
+    (SIN_TURNO, "login"): (EN_TURNO, ""),
+    (EN_TURNO, "login"): (EN_TURNO, "- FUERA DE ORDEN (ya tenía login)"),
+    (EN_BREAK, "login"): (EN_BREAK, "- FUERA DE ORDEN (está en break)"),
+    (SIN_TURNO, "break"): (EN_BREAK, "- FUERA DE ORDEN (sin login)"),
+    (EN_TURNO, "break"): (EN_BREAK, ""),
+    (EN_BREAK, "break"): (EN_BREAK, "- FUERA DE ORDEN (break ya iniciado)"),
+    (SIN_TURNO, "logout_break"): (SIN_TURNO, "- FUERA DE ORDEN (sin break)"),
+    (EN_TURNO, "logout_break"): (EN_TURNO, "- FUERA DE ORDEN (sin break)"),
+    (EN_BREAK, "logout_break"): (EN_TURNO, ""),
+    # Logout sin login ya lo marca validar_logout() con "NO MARCO INICIO"
+    (SIN_TURNO, "logout"): (SIN_TURNO, ""),
+    (EN_TURNO, "logout"): (SIN_TURNO, ""),
+    (EN_BREAK, "logout"): (SIN_TURNO, "- FUERA DE ORDEN (break sin cerrar)"),
+}
+
+def _a_epoch(momento: Optional[datetime]) -> Optional[float]:
+    return momento.timestamp() if momento is not None else None
+
+def _desde_epoch(valor: Optional[float]) -> Optional[datetime]:
+    return datetime.fromtimestamp(valor, TZ_ARGENTINA) if valor is not None else None
+
+class SesionAsistencia:
+    """Estado del turno en curso de un usuario"""
+    __slots__ = ("estado", "inicio_turno", "inicio_break", "minutos_break", "cantidad_breaks", "expira", "logout_pendiente")
+
+    def __init__(self, expira: float):
+        self.estado = SIN_TURNO
+        self.inicio_turno: Optional[datetime] = None
+        self.inicio_break: Optional[datetime] = None
+        self.minutos_break = 0
+        self.cantidad_breaks = 0
+        self.expira = expira
+        # Momento en que abrió el selector de logout sin enviar todavía el formulario
+        self.logout_pendiente: Optional[datetime] = None
+
+    def a_registro(self) -> list:
+        return [
+            self.estado, _a_epoch(self.inicio_turno), _a_epoch(self.inicio_break),
+            self.minutos_break, self.cantidad_breaks, self.expira, _a_epoch(self.logout_pendiente)
+        ]
+
+    @classmethod
+    def desde_registro(cls, registro: list) -> "SesionAsistencia":
+        estado, inicio_turno, inicio_break, minutos_break, cantidad_breaks, expira, logout_pendiente = registro
+        sesion = cls(expira)
+        sesion.estado = estado
+        sesion.inicio_turno = _desde_epoch(inicio_turno)
+        sesion.inicio_break = _desde_epoch(inicio_break)
+        sesion.minutos_break = minutos_break
+        sesion.cantidad_breaks = cantidad_breaks
+        sesion.logout_pendiente = _desde_epoch(logout_pendiente)
+        return sesion
+
+class DiarioSesiones:
+    """Persistencia de las sesiones: diario de solo-agregado más una foto compactada.
+    
+    Cada cambio agrega una línea con el registro completo del usuario (o su borrado),
+    así reaplicar una línea dos veces no cambia nada. Cada `compactar_cada` líneas
+    se escribe la foto de todas las sesiones (archivo temporal + os.replace) y se
+    vacía el diario. Al iniciar se carga la foto y se reaplica el diario encima.
+    El event loop solo encola: un hilo propio escribe en lotes lo acumulado.
+    """
+
+    def __init__(self, ruta: str, compactar_cada: int):
+        self.ruta = ruta
+        self.ruta_foto = os.path.splitext(ruta)[0] + ".snapshot.json"
+        self.compactar_cada = max(1, compactar_cada)
+        self.lineas = 0
+        self._archivo = None
+        # Líneas del diario (str) y fotos (dict); None es la marca de cierre
+        self._cola = queue.SimpleQueue()
+        self._hilo: Optional[threading.Thread] = None
+
+    def cargar(self) -> dict:
+        """Foto + diario → {user_id: registro}. Tolera una última línea cortada por un corte"""
+        registros = {}
+        if os.path.exists(self.ruta_foto):
+            with open(self.ruta_foto, encoding="utf-8") as f:
+                registros = {int(k): v for k, v in json.load(f).items()}
+        if os.path.exists(self.ruta):
+            with open(self.ruta, encoding="utf-8") as f:
+                for numero, linea in enumerate(f, 1):
+                    try:
+                        entrada = json.loads(linea)
+                    except ValueError:
+                        log.warning("Diario de sesiones: línea %d ilegible, se ignora", numero)
+                        continue
+                    if entrada.get("r") is None:
+                        registros.pop(entrada["u"], None)
+                    else:
+                        registros[entrada["u"]] = entrada["r"]
+                    self.lineas += 1
+        return registros
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._escritor, name="diario-sesiones", daemon=True)
+        self._hilo.start()
+
+    def registrar(self, user_id: int, registro: Optional[list]):
+        self._cola.put(json.dumps({"u": user_id, "r": registro}, separators=(",", ":")) + "\n")
+        self.lineas += 1
+
+    def compactar(self, registros: dict):
+        """Encola la foto completa: el hilo la escribe y empieza un diario nuevo"""
+        self._cola.put(registros)
+        self.lineas = 0
+
+    def _escritor(self):
+        fin = False
+        while not fin:
+            lote = [self._cola.get()]
+            while True:
+                try:
+                    lote.append(self._cola.get_nowait())
+                except queue.Empty:
+                    break
+            fin = None in lote
+            try:
+                self._escribir(lote)
+            except OSError as e:
+                log.error("No se pudo escribir el diario de sesiones: %s", e)
+
+    def _escribir(self, lote: list):
+        # La última foto deja sin efecto las líneas anteriores a ella
+        ultima = max((i for i, entrada in enumerate(lote) if isinstance(entrada, dict)), default=-1)
+        if ultima >= 0:
+            try:
+                self._escribir_foto(lote[ultima])
+            except OSError as e:
+                log.error("No se pudo compactar el diario de sesiones: %s", e)
+                ultima = -1
+        lineas = [entrada for entrada in lote[ultima + 1:] if isinstance(entrada, str)]
+        if lineas:
+            if self._archivo is None:
+                self._archivo = open(self.ruta, "a", encoding="utf-8")
+            self._archivo.write("".join(lineas))
+            self._archivo.flush()
+
+    def _escribir_foto(self, registros: dict):
+        """Escribe la foto completa de forma atómica y empieza un diario nuevo"""
+        temporal = self.ruta_foto + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump({str(k): v for k, v in registros.items()}, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, self.ruta_foto)
+        # Si se corta aquí, el diario viejo se reaplica sobre la foto nueva sin efecto
+        self._cerrar_archivo()
+        open(self.ruta, "w").close()
+
+    def _cerrar_archivo(self):
+        if self._archivo is not None:
+            self._archivo.close()
+            self._archivo = None
+
+    def cerrar(self):
+        """Espera a que el hilo escriba lo encolado y cierra el diario"""
+        if self._hilo is not None:
+            self._cola.put(None)
+            self._hilo.join()
+            self._hilo = None
+        self._cerrar_archivo()
+
+class SesionesAsistencia:
+    """Sesiones abiertas por user.id, con vencimiento ordenado en un heap"""
+
+    def __init__(self, gracia_h: float, max_h: float):
+        self.gracia = timedelta(hours=gracia_h)
+        self.maximo = timedelta(hours=max_h)
+        self._sesiones = {}
+        self._vencimientos = []
+        self.diario: Optional[DiarioSesiones] = None
+        self.stats = {"transiciones": 0, "fuera_de_orden": 0, "expiradas": 0}
+
+    def restaurar(self, diario: DiarioSesiones) -> int:
+        """Carga las sesiones guardadas y sigue registrando cada cambio en el diario"""
+        ahora = time.time()
+        for user_id, registro in diario.cargar().items():
+            sesion = SesionAsistencia.desde_registro(registro)
+            if sesion.expira > ahora:
+                self._sesiones[user_id] = sesion
+                heapq.heappush(self._vencimientos, (sesion.expira, user_id))
+        self.diario = diario
+        diario.iniciar()
+        # Arrancar con la foto al día y el diario vacío
+        self._compactar()
+        return len(self._sesiones)
+
+    def _guardar(self, user_id: int, sesion: Optional[SesionAsistencia]):
+        if self.diario is None:
+            return
+        self.diario.registrar(user_id, sesion.a_registro() if sesion is not None else None)
+        if self.diario.lineas >= self.diario.compactar_cada:
+            self._compactar()
+
+    def _compactar(self):
+        if self.diario is not None:
+            self.diario.compactar({uid: sesion.a_registro() for uid, sesion in self._sesiones.items()})
+
+    def cerrar(self):
+        """Deja la foto al día al apagar el bot"""
+        if self.diario is not None:
+            self._compactar()
+            self.diario.cerrar()
+
+    def _vencimiento(self, momento: datetime, horario: Optional[dict]) -> float:
+        """Fin del turno (más el margen) o la vida máxima, lo que ocurra primero"""
+        limite = momento + self.maximo
+        if horario:
+            minuto = momento.hour * 60 + momento.minute
+            resto = (hora_a_minutos(horario["fin"]) - minuto) % MINUTOS_DIA
+            limite = min(limite, momento + timedelta(minutes=resto) + self.gracia)
+        return limite.timestamp()
+
+    def purgar(self, ahora: Optional[float] = None) -> int:
+        """Descarta las sesiones cuyo turno ya terminó sin logout"""
+        ahora = time.time() if ahora is None else ahora
+        expiradas = 0
+        while self._vencimientos and self._vencimientos[0][0] <= ahora:
+            vence, user_id = heapq.heappop(self._vencimientos)
+            sesion = self._sesiones.get(user_id)
+            # Entradas viejas del heap (sesión cerrada o reabierta) se ignoran
+            if sesion is not None and sesion.expira == vence:
+                del self._sesiones[user_id]
+                self._guardar(user_id, None)
+                expiradas += 1
+        self.stats["expiradas"] += expiradas
+        return expiradas
+
+    def obtener(self, user_id: int) -> Optional[SesionAsistencia]:
+        sesion = self._sesiones.get(user_id)
+        if sesion is not None and sesion.expira <= time.time():
+            self.purgar()
+            return None
+        return sesion
+
+    def tiene_login(self, user_id: int) -> bool:
+        sesion = self.obtener(user_id)
+        return sesion is not None and sesion.inicio_turno is not None
+
+    def transicion(self, user_id: int, action: str, momento: datetime, horario: Optional[dict] = None) -> str:
+        """Aplica el evento a la sesión del usuario. Devuelve las marcas para la validación"""
+        self.purgar()
+        sesion = self._sesiones.get(user_id)
+        estado = sesion.estado if sesion else SIN_TURNO
+        siguiente, marca = TRANSICIONES[(estado, action)]
+        if action == "login" and estado == EN_TURNO and sesion.inicio_turno is None:
+            marca = ""  # Volvió de un break que empezó sin login: este es su primer login
+        marcas = [marca] if marca else []
+        
+        if sesion is None and siguiente != SIN_TURNO:
+            sesion = SesionAsistencia(self._vencimiento(momento, horario))
+            self._sesiones[user_id] = sesion
+            heapq.heappush(self._vencimientos, (sesion.expira, user_id))
+        
+        if sesion is not None:
+            if action == "login" and sesion.inicio_turno is None:
+                sesion.inicio_turno = momento
+            elif action == "break" and estado != EN_BREAK:
+                sesion.inicio_break = momento
+                sesion.cantidad_breaks += 1
+            elif estado == EN_BREAK and action in ("logout_break", "logout"):
+                _, msg_break = validar_break_tiempo(sesion.inicio_break, momento)
+                if msg_break:
+                    marcas.append(msg_break)
+                sesion.minutos_break += int((momento - sesion.inicio_break).total_seconds() // 60)
+                sesion.inicio_break = None
+            sesion.estado = siguiente
+            if siguiente == SIN_TURNO:
+                del self._sesiones[user_id]
+                self._guardar(user_id, None)
+            else:
+                self._guardar(user_id, sesion)
+        
+        self.stats["transiciones"] += 1
+        if marca:
+            self.stats["fuera_de_orden"] += 1
+            log_validacion.info("Clic fuera de orden: %s con estado '%s'", action, NOMBRES_ESTADO[estado], extra={"user_id": user_id, "action": action})
+        return " ".join(marcas)
+
+    def marcar_logout_pendiente(self, user_id: int, momento: datetime):
+        """El usuario abrió el selector de logout (se limpia al completar el logout)"""
+        sesion = self.obtener(user_id)
+        if sesion is not None:
+            sesion.logout_pendiente = momento
+            self._guardar(user_id, sesion)
+
+    def tomar_logouts_pendientes(self) -> list:
+        """(user_id, momento) de los selectores de logout abiertos antes de un reinicio; limpia la marca.
+        
+        El selector y el formulario no sobreviven al reinicio: ese logout no se va a completar.
+        """
+        self.purgar()
+        pendientes = []
+        for user_id, sesion in self._sesiones.items():
+            if sesion.logout_pendiente is not None:
+                pendientes.append((user_id, sesion.logout_pendiente))
+                sesion.logout_pendiente = None
+                self._guardar(user_id, sesion)
+        return pendientes
+
+    def activas(self) -> int:
+        return len(self._sesiones)
+
+    def abiertas(self) -> list:
+        """(user_id, sesión) de todas las sesiones abiertas"""
+        return list(self._sesiones.items())
+
+    def resumen(self) -> str:
+        self.purgar()
+        en_break = sum(1 for sesion in self._sesiones.values() if sesion.estado == EN_BREAK)
+        return (
+            f"En turno: `{len(self._sesiones) - en_break}` │ En break: `{en_break}`\n"
+            f"Fuera de orden: `{self.stats['fuera_de_orden']}` │ Expiradas: `{self.stats['expiradas']}`"
+        )
+
+sesiones = SesionesAsistencia(SESION_GRACIA_H, SESION_MAX_H)
+
+# =========================
+# CLIENTE HTTP COMPARTIDO PARA GOOGLE SHEETS
+# =========================
+class ClienteSheets:
+    """Sesión HTTP única del bot hacia el webhook (keep-alive, caché DNS y límite de conexiones)"""
+
+    def __init__(self, url: str, limite_conexiones: int, keepalive_s: float, dns_ttl_s: int, timeout_s: float):
+        self.url = url
+        self.limite_conexiones = limite_conexiones
+        self.keepalive_s = keepalive_s
+        self.dns_ttl_s = dns_ttl_s
+        self.timeout_s = timeout_s
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.stats = {"peticiones": 0, "conexiones_nuevas": 0, "conexiones_reusadas": 0}
+
+    async def _on_request_start(self, session, ctx, params):
+        self.stats["peticiones"] += 1
+
+    async def _on_conexion_nueva(self, session, ctx, params):
+        self.stats["conexiones_nuevas"] += 1
+
+    async def _on_conexion_reusada(self, session, ctx, params):
+        self.stats["conexiones_reusadas"] += 1
+
+    async def iniciar(self):
+        """Crea la sesión compartida (se llama desde setup_hook)"""
+        if self._session and not self._session.closed:
+            return
+        
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(self._on_request_start)
+        trace.on_connection_create_end.append(self._on_conexion_nueva)
+        trace.on_connection_reuseconn.append(self._on_conexion_reusada)
+        
+        connector = aiohttp.TCPConnector(
+            limit=self.limite_conexiones,
+            ttl_dns_cache=self.dns_ttl_s,
+            keepalive_timeout=self.keepalive_s
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout_s),
+            headers={'Content-Type': 'application/json'},
+            trace_configs=[trace]
+        )
+
+    async def cerrar(self):
+        """Cierra la sesión y libera las conexiones del pool"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def sesion(self) -> aiohttp.ClientSession:
+        """Devuelve la sesión compartida, creándola si todavía no existe"""
+        if not self._session or self._session.closed:
+            await self.iniciar()
+        return self._session
+
+    def resumen_stats(self) -> str:
+        """Resumen legible de uso del pool"""
+        nuevas = self.stats["conexiones_nuevas"]
+        reusadas = self.stats["conexiones_reusadas"]
+        total = nuevas + reusadas
+        tasa = (reusadas / total * 100) if total else 0.0
+        return (
+            f"Peticiones: `{self.stats['peticiones']}`\n"
+            f"Conexiones nuevas: `{nuevas}` │ reusadas: `{reusadas}` ({tasa:.0f}%)\n"
+            f"Límite del pool: `{self.limite_conexiones}`"
         )
+
+cliente_sheets = ClienteSheets(
+    GOOGLE_SHEETS_WEBHOOK_URL,
+    SHEETS_MAX_CONEXIONES,
+    SHEETS_KEEPALIVE_S,
+    SHEETS_DNS_TTL_S,
+    SHEETS_TIMEOUT_S
+)
+
+# =========================
+# CIRCUIT BREAKER DEL WEBHOOK
+# =========================
+class CircuitoSheets:
+    """Circuit breaker (cerrado / abierto / semiabierto) con timeout adaptativo.
     
-    if where and isinstance(where, discord.abc.GuildChannel):
-        embed.add_field(
-            name="📍 Ubicación", 
-            value=f"**{where.guild.name}** - #{where.name}", 
-            inline=False
+    - Cerrado: se envía normalmente; N fallos de transporte seguidos lo abren.
+    - Abierto: no se envía nada; los eventos quedan en el outbox sin esperar.
+    - Semiabierto: pasado el enfriamiento se deja pasar una sola prueba; si
+      funciona se cierra, si falla se vuelve a abrir con enfriamiento doble.
+    
+    El timeout de cada POST es el p99 de las latencias recientes × factor,
+    acotado entre SHEETS_TIMEOUT_MIN_S y SHEETS_TIMEOUT_S.
+    """
+
+    CERRADO = "cerrado"
+    ABIERTO = "abierto"
+    SEMIABIERTO = "semiabierto"
+
+    def __init__(self, umbral_fallos: int, abierto_s: float, abierto_max_s: float,
+                 timeout_min_s: float, timeout_max_s: float, factor_p99: float):
+        self.umbral_fallos = umbral_fallos
+        self.abierto_base_s = abierto_s
+        self.abierto_max_s = abierto_max_s
+        self.timeout_min_s = timeout_min_s
+        self.timeout_max_s = timeout_max_s
+        self.factor_p99 = factor_p99
+        self.estado = self.CERRADO
+        self.fallos_seguidos = 0
+        self.abierto_desde: Optional[float] = None
+        # Inicio de la caída actual: no se reinicia con cada prueba fallida del semiabierto
+        self.caido_desde: Optional[float] = None
+        self._enfriamiento_s = abierto_s
+        self._prueba_en_curso = False
+        self._latencias = deque(maxlen=200)
+        self.aperturas = 0
+
+    def _transicion(self, nuevo: str):
+        if nuevo != self.estado:
+            log_sheets.warning("Circuito de Google Sheets: %s → %s", self.estado, nuevo)
+            self.estado = nuevo
+
+    def espera_restante(self) -> float:
+        """Segundos hasta que el circuito acepte una prueba (0 si ya puede enviarse)"""
+        if self.estado != self.ABIERTO:
+            return 0.0
+        return max(0.0, self.abierto_desde + self._enfriamiento_s - time.monotonic())
+
+    def permitir(self) -> bool:
+        """¿Puede salir una petición ahora? En semiabierto solo una a la vez"""
+        if self.estado == self.ABIERTO:
+            if self.espera_restante() > 0:
+                return False
+            self._transicion(self.SEMIABIERTO)
+        if self.estado == self.SEMIABIERTO:
+            if self._prueba_en_curso:
+                return False
+            self._prueba_en_curso = True
+        return True
+
+    def liberar_prueba(self):
+        """Devuelve el turno de prueba del semiabierto si no llegó a usarse"""
+        self._prueba_en_curso = False
+
+    def abierto(self) -> bool:
+        return self.estado == self.ABIERTO and self.espera_restante() > 0
+
+    def segundos_abierto(self) -> float:
+        """Segundos sin servicio desde la apertura (incluye las pruebas fallidas del semiabierto)"""
+        if self.estado == self.CERRADO or self.caido_desde is None:
+            return 0.0
+        return time.monotonic() - self.caido_desde
+
+    def registrar_exito(self, latencia_s: float):
+        self._latencias.append(latencia_s)
+        self.fallos_seguidos = 0
+        self._prueba_en_curso = False
+        self._enfriamiento_s = self.abierto_base_s
+        self.abierto_desde = None
+        self.caido_desde = None
+        self._transicion(self.CERRADO)
+
+    def registrar_fallo(self):
+        self.fallos_seguidos += 1
+        if self.estado == self.SEMIABIERTO:
+            self._prueba_en_curso = False
+            self._enfriamiento_s = min(self._enfriamiento_s * 2, self.abierto_max_s)
+            self.abierto_desde = time.monotonic()
+            self.aperturas += 1
+            self._transicion(self.ABIERTO)
+        elif self.estado == self.CERRADO and self.fallos_seguidos >= self.umbral_fallos:
+            self.abierto_desde = self.caido_desde = time.monotonic()
+            self.aperturas += 1
+            self._transicion(self.ABIERTO)
+
+    def p99(self) -> Optional[float]:
+        if len(self._latencias) < 20:
+            return None
+        ordenadas = sorted(self._latencias)
+        return ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * 0.99))]
+
+    def timeout_actual(self) -> float:
+        p99 = self.p99()
+        if p99 is None:
+            return self.timeout_max_s
+        return min(self.timeout_max_s, max(self.timeout_min_s, p99 * self.factor_p99))
+
+    def resumen(self) -> str:
+        emoji = {self.CERRADO: "🟢", self.SEMIABIERTO: "🟡", self.ABIERTO: "🔴"}[self.estado]
+        p99 = self.p99()
+        texto = (
+            f"Estado: {emoji} `{self.estado}` │ Fallos seguidos: `{self.fallos_seguidos}`\n"
+            f"p99: `{f'{p99:.2f}s' if p99 is not None else 'sin datos'}` │ Timeout actual: `{self.timeout_actual():.1f}s`"
         )
+        if self.estado == self.ABIERTO:
+            texto += f"\nReintento en: `{self.espera_restante():.0f}s`"
+        return texto
+
+circuito_sheets = CircuitoSheets(
+    CIRCUITO_UMBRAL_FALLOS,
+    CIRCUITO_ABIERTO_S,
+    CIRCUITO_ABIERTO_MAX_S,
+    SHEETS_TIMEOUT_MIN_S,
+    SHEETS_TIMEOUT_S,
+    SHEETS_TIMEOUT_FACTOR_P99
+)
+
+# =========================
+# MÉTRICAS (FORMATO PROMETHEUS)
+# =========================
+# Contadores e histogramas en memoria, escritos a mano en el formato de texto de
+# Prometheus (sin dependencias). Los valores que ya existen en otros objetos
+# (profundidad del outbox, cachés, latencia del gateway) se leen al momento del
+# scrape con recolectores registrados más abajo.
+LIMITES_ACK_S = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0)
+LIMITES_WEBHOOK_S = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LIMITES_LOOP_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+def _etiquetas(etiquetas: dict) -> str:
+    """{"boton": "login"} → '{boton="login"}' (con los escapes del formato de texto)"""
+    if not etiquetas:
+        return ""
+    pares = []
+    for clave, valor in etiquetas.items():
+        valor = str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pares.append(f'{clave}="{valor}"')
+    return "{" + ",".join(pares) + "}"
+
+class HistogramaMetrica:
+    """Histograma acumulado por valor de etiqueta (buckets fijos, como los de Prometheus)"""
+
+    def __init__(self, nombre: str, ayuda: str, etiqueta: str, limites: tuple):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiqueta = etiqueta
+        self.limites = limites
+        self._series = {}
+
+    def observar(self, valor: float, etiqueta: str = ""):
+        serie = self._series.get(etiqueta)
+        if serie is None:
+            # [conteos por bucket..., suma, total]
+            serie = self._series[etiqueta] = [0] * len(self.limites) + [0.0, 0]
+        indice = bisect_right(self.limites, valor - 1e-12)
+        if indice < len(self.limites):
+            serie[indice] += 1
+        serie[-2] += valor
+        serie[-1] += 1
+
+    def exportar(self) -> list:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        for valor_etiqueta, serie in sorted(self._series.items()):
+            # Sin etiqueta (None) el histograma tiene una sola serie
+            base = {self.etiqueta: valor_etiqueta} if self.etiqueta else {}
+            acumulado = 0
+            for limite, cantidad in zip(self.limites, serie):
+                acumulado += cantidad
+                lineas.append(f"{self.nombre}_bucket{_etiquetas({**base, 'le': limite})} {acumulado}")
+            lineas.append(f"{self.nombre}_bucket{_etiquetas({**base, 'le': '+Inf'})} {serie[-1]}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(base)} {serie[-2]:.6f}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(base)} {serie[-1]}")
+        return lineas
+
+class MetricasBot:
+    """Registro de métricas del proceso: histogramas, contadores y recolectores al scrape"""
+
+    def __init__(self):
+        self.ack = HistogramaMetrica(
+            "asistencia_ack_segundos", "Tiempo hasta el acuse de la interacción, por botón", "boton", LIMITES_ACK_S
+        )
+        self.webhook = HistogramaMetrica(
+            "asistencia_webhook_segundos", "Latencia del POST al webhook de Sheets, por resultado", "resultado", LIMITES_WEBHOOK_S
+        )
+        self.loop = HistogramaMetrica(
+            "asistencia_loop_retraso_hist_segundos", "Retraso del event loop en cada medición", None, LIMITES_LOOP_S
+        )
+        # (nombre, etiquetas ordenadas) → valor
+        self._contadores = {}
+        self._ayudas = {}
+        self._recolectores = []
+
+    def contar(self, nombre: str, ayuda: str, cantidad: float = 1, **etiquetas):
+        self._ayudas[nombre] = ayuda
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        self._contadores[clave] = self._contadores.get(clave, 0) + cantidad
+
+    def recolector(self, funcion):
+        """Registra funcion() → [(nombre, tipo, ayuda, {etiquetas: valor} o valor)], leída en cada scrape"""
+        self._recolectores.append(funcion)
+        return funcion
+
+    def exportar(self) -> str:
+        lineas = self.ack.exportar() + self.webhook.exportar() + self.loop.exportar()
+        por_nombre = {}
+        for (nombre, etiquetas), valor in self._contadores.items():
+            por_nombre.setdefault(nombre, []).append((dict(etiquetas), valor))
+        for nombre in sorted(por_nombre):
+            lineas += [f"# HELP {nombre} {self._ayudas[nombre]}", f"# TYPE {nombre} counter"]
+            lineas += [f"{nombre}{_etiquetas(etiquetas)} {valor}" for etiquetas, valor in por_nombre[nombre]]
+        for funcion in self._recolectores:
+            try:
+                series = funcion()
+            except Exception as e:
+                log.warning("Falló el recolector de métricas %s: %r", funcion.__name__, e)
+                continue
+            for nombre, tipo, ayuda, valores in series:
+                lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} {tipo}"]
+                if isinstance(valores, dict):
+                    lineas += [f"{nombre}{_etiquetas(dict(etiquetas))} {valor}" for etiquetas, valor in valores.items()]
+                else:
+                    lineas.append(f"{nombre} {valores}")
+        return "\n".join(lineas) + "\n"
+
+metricas = MetricasBot()
+
+def contar_dm_fallido(motivo: str):
+    metricas.contar("asistencia_dm_fallidos_total", "DMs que no se pudieron entregar (se usó el canal o el mensaje efímero)", motivo=motivo)
+
+# =========================
+# TRAZAS POR INTERACCIÓN
+# =========================
+# Cada clic abre una traza (id de 128 bits, compatible con OTLP) y cada etapa un
+# tramo con su duración y las llamadas REST a Discord que hizo. El tramo actual
+# viaja en un contextvar, así los efectos que corren en paralelo (cada uno en su
+# tarea) cuelgan de la traza correcta sin pasarla por parámetro.
+# Al cerrar la traza se encola entera; un QueueListener la escribe en un hilo
+# aparte (JSONL rotado y, si hay TRAZAS_OTLP_URL, OTLP/HTTP JSON por lotes).
+_traza_actual: contextvars.ContextVar = contextvars.ContextVar("traza_actual", default=None)
+_tramo_actual: contextvars.ContextVar = contextvars.ContextVar("tramo_actual", default=None)
+
+class Tramo:
+    """Una etapa de la traza: nombre, inicio, duración, llamadas REST y atributos"""
+    __slots__ = ("traza", "span_id", "padre", "nombre", "atributos", "inicio_ns", "fin_ns", "rest", "_perf", "_token")
+
+    def __init__(self, traza: "Traza", nombre: str, padre: Optional[str], atributos: dict):
+        self.traza = traza
+        self.span_id = os.urandom(8).hex()
+        self.padre = padre
+        self.nombre = nombre
+        self.atributos = atributos
+        self.inicio_ns = 0
+        self.fin_ns = None
+        self.rest = 0
+
+    def __enter__(self):
+        self.inicio_ns = time.time_ns()
+        self._perf = time.perf_counter_ns()
+        self._token = _tramo_actual.set(self)
+        return self
+
+    def __exit__(self, tipo, error, tb):
+        self.fin_ns = self.inicio_ns + (time.perf_counter_ns() - self._perf)
+        if error is not None:
+            self.atributos["error"] = repr(error)
+        _tramo_actual.reset(self._token)
+        return False
+
+    def registro(self) -> dict:
+        return {
+            "traza_id": self.traza.traza_id,
+            "span_id": self.span_id,
+            "padre": self.padre,
+            "nombre": self.nombre,
+            "inicio": datetime.fromtimestamp(self.inicio_ns / 1e9, timezone.utc).isoformat(timespec="microseconds"),
+            "duracion_ms": round((self.fin_ns - self.inicio_ns) / 1e6, 3),
+            "rest": self.rest,
+            "atributos": self.atributos,
+        }
+
+class _TramoNulo:
+    """Tramo sin traza activa: no mide ni se exporta"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @property
+    def atributos(self) -> dict:
+        return {}
+
+_TRAMO_NULO = _TramoNulo()
+
+class Traza:
+    """Una interacción completa: el tramo raíz y los de cada etapa.
     
-    embed.set_footer(text="✅ Registro actualizado en Google Sheets")
-    return embed
+    Se usa con `with` o con iniciar()/cerrar() en el try/finally del handler
+    (siempre desde la misma tarea).
+    """
+    __slots__ = ("traza_id", "raiz", "tramos", "rest", "_token")
+
+    def __init__(self, nombre: str, **atributos):
+        self.traza_id = os.urandom(16).hex()
+        self.raiz = Tramo(self, nombre, None, atributos)
+        self.tramos = [self.raiz]
+        self.rest = 0
+
+    def iniciar(self) -> "Traza":
+        self._token = _traza_actual.set(self)
+        self.raiz.__enter__()
+        return self
+
+    def cerrar(self, error: Optional[BaseException] = None):
+        self.raiz.atributos["rest_total"] = self.rest
+        self.raiz.__exit__(type(error) if error else None, error, None)
+        _traza_actual.reset(self._token)
+        exportador_trazas.exportar(self)
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, tipo, error, tb):
+        self.cerrar(error)
+        return False
+
+def tramo(nombre: str, **atributos):
+    """Tramo hijo del tramo actual de la traza en curso (no hace nada fuera de una traza)"""
+    traza = _traza_actual.get()
+    if traza is None:
+        return _TRAMO_NULO
+    padre = _tramo_actual.get() or traza.raiz
+    nuevo = Tramo(traza, nombre, padre.span_id, atributos)
+    traza.tramos.append(nuevo)
+    return nuevo
+
+def contar_llamada_rest(origen: str):
+    """Suma una llamada REST a Discord al tramo y a la traza en curso (y a las métricas)"""
+    metricas.contar("asistencia_discord_rest_total", "Llamadas REST a Discord por origen", origen=origen)
+    actual = _tramo_actual.get()
+    if actual is not None:
+        actual.rest += 1
+        actual.traza.rest += 1
+
+def _contador_rest(original, origen: str):
+    async def request(*args, **kwargs):
+        contar_llamada_rest(origen)
+        return await original(*args, **kwargs)
+    request.__wrapped__ = original
+    return request
+
+def instrumentar_rest(http):
+    """Cuenta las llamadas REST: las del cliente del bot y las de las respuestas a interacciones.
+    
+    Las respuestas a interacciones (acuse, edición y borrado del mensaje efímero) no
+    pasan por bot.http sino por el adaptador de webhooks de discord.py.
+    """
+    if not hasattr(http.request, "__wrapped__"):
+        http.request = _contador_rest(http.request, "api")
+    try:
+        from discord.webhook.async_ import AsyncWebhookAdapter
+    except ImportError:
+        log.warning("No se encontró el adaptador de webhooks de discord.py: no se cuentan las respuestas a interacciones")
+        return
+    if not hasattr(AsyncWebhookAdapter.request, "__wrapped__"):
+        AsyncWebhookAdapter.request = _contador_rest(AsyncWebhookAdapter.request, "interaccion")
+
+class FormateadorTramos(logging.Formatter):
+    """Una línea JSON por tramo terminado de la traza"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        return "\n".join(
+            json.dumps(t.registro(), ensure_ascii=False, default=str) for t in record.traza.tramos if t.fin_ns is not None
+        )
+
+class ManejadorOTLP(logging.handlers.BufferingHandler):
+    """Envía las trazas en lotes a un colector OTLP/HTTP (JSON). Si falla, el lote se descarta"""
+
+    def __init__(self, url: str, capacidad: int = 50, intervalo_s: float = 5.0):
+        super().__init__(capacidad)
+        self.url = url
+        self.intervalo_s = intervalo_s
+        self._ultimo_envio = time.monotonic()
+
+    def shouldFlush(self, record: logging.LogRecord) -> bool:
+        return len(self.buffer) >= self.capacity or time.monotonic() - self._ultimo_envio >= self.intervalo_s
+
+    @staticmethod
+    def _atributo(clave: str, valor) -> dict:
+        if isinstance(valor, bool):
+            return {"key": clave, "value": {"boolValue": valor}}
+        if isinstance(valor, int):
+            return {"key": clave, "value": {"intValue": str(valor)}}
+        if isinstance(valor, float):
+            return {"key": clave, "value": {"doubleValue": valor}}
+        return {"key": clave, "value": {"stringValue": str(valor)}}
+
+    def _span(self, t: Tramo) -> dict:
+        span = {
+            "traceId": t.traza.traza_id,
+            "spanId": t.span_id,
+            "name": t.nombre,
+            "kind": 2 if t.padre is None else 1,  # SERVER para la raíz, INTERNAL para las etapas
+            "startTimeUnixNano": str(t.inicio_ns),
+            "endTimeUnixNano": str(t.fin_ns),
+            "attributes": [self._atributo(k, v) for k, v in t.atributos.items()] + [self._atributo("discord.rest", t.rest)],
+        }
+        if t.padre:
+            span["parentSpanId"] = t.padre
+        return span
+
+    def flush(self):
+        self.acquire()
+        try:
+            lote, self.buffer = self.buffer, []
+            self._ultimo_envio = time.monotonic()
+        finally:
+            self.release()
+        if not lote:
+            return
+        spans = [self._span(t) for record in lote for t in record.traza.tramos if t.fin_ns is not None]
+        cuerpo = {"resourceSpans": [{
+            "resource": {"attributes": [self._atributo("service.name", "bot-asistencia")]},
+            "scopeSpans": [{"scope": {"name": "asistencia"}, "spans": spans}],
+        }]}
+        peticion = urllib.request.Request(
+            self.url, data=json.dumps(cuerpo).encode("utf-8"), headers={"Content-Type": "application/json"}, method="POST"
+        )
+        try:
+            with urllib.request.urlopen(peticion, timeout=3) as respuesta:
+                respuesta.read()
+        except Exception as e:
+            log.debug("No se pudieron exportar %d tramos por OTLP: %r", len(spans), e)
+
+class ExportadorTrazas:
+    """Cola de trazas terminadas; un QueueListener las escribe fuera del event loop"""
+
+    def __init__(self, ruta: str, max_bytes: int, archivos: int, otlp_url: str):
+        self.ruta = ruta
+        self.max_bytes = max_bytes
+        self.archivos = archivos
+        self.otlp_url = otlp_url
+        self._cola = queue.SimpleQueue()
+        self._manejadores = []
+        self._listener: Optional[logging.handlers.QueueListener] = None
+
+    def exportar(self, traza: Traza):
+        if self._listener is not None:
+            self._cola.put(logging.makeLogRecord({"traza": traza}))
+
+    def iniciar(self):
+        archivo = logging.handlers.RotatingFileHandler(
+            self.ruta, maxBytes=self.max_bytes, backupCount=self.archivos, encoding="utf-8", delay=True
+        )
+        archivo.setFormatter(FormateadorTramos())
+        self._manejadores = [archivo]
+        if self.otlp_url:
+            self._manejadores.append(ManejadorOTLP(self.otlp_url))
+        self._listener = logging.handlers.QueueListener(self._cola, *self._manejadores)
+        self._listener.start()
+
+    def detener(self):
+        """Escribe lo que quede en la cola y cierra los archivos (y el último lote OTLP)"""
+        if self._listener is None:
+            return
+        self._listener.stop()
+        self._listener = None
+        for manejador in self._manejadores:
+            manejador.close()
+
+exportador_trazas = ExportadorTrazas(TRAZAS_PATH, int(TRAZAS_MAX_MB * 1024 * 1024), TRAZAS_ARCHIVOS, TRAZAS_OTLP_URL)
 
 # =========================
-# MODAL SELECTOR DE CANTIDAD (PASO 1)
+# FUNCIÓN PARA GOOGLE SHEETS
 # =========================
-class LogoutSelectorModal(ui.Modal):
-    def __init__(self, validacion_msg: str = ""):
-        super().__init__(title="LOGOUT - SELECCIONA CANTIDAD", timeout=300)
-        self.validacion_msg = validacion_msg
+async def _post_sheets(body) -> tuple:
+    """Hace el POST al webhook. Devuelve (respuesta_json, reintentable, error)"""
+    session = await cliente_sheets.sesion()
+    timeout = aiohttp.ClientTimeout(total=circuito_sheets.timeout_actual())
+    inicio = time.monotonic()
+    try:
+        async with session.post(GOOGLE_SHEETS_WEBHOOK_URL, json=body, timeout=timeout) as response:
+            if response.status != 200:
+                circuito_sheets.registrar_fallo()
+                metricas.webhook.observar(time.monotonic() - inicio, "http_error")
+                return None, True, f"HTTP {response.status}"
+            result = await response.json(content_type=None)
+    except asyncio.TimeoutError:
+        circuito_sheets.registrar_fallo()
+        metricas.webhook.observar(time.monotonic() - inicio, "timeout")
+        return None, True, "Timeout"
+    except Exception as e:
+        circuito_sheets.registrar_fallo()
+        metricas.webhook.observar(time.monotonic() - inicio, "error")
+        return None, True, str(e)
+    
+    circuito_sheets.registrar_exito(time.monotonic() - inicio)
+    metricas.webhook.observar(time.monotonic() - inicio, "ok")
+    return result, False, ""
 
-    cantidad_modelos = ui.TextInput(
-        label="¿Cuántos modelos trabajaste?",
-        placeholder="Escribe: 1, 2 o 3",
-        required=True,
-        max_length=1,
-        min_length=1
-    )
+async def enviar_a_sheets(data) -> tuple:
+    """Envía un único evento al webhook. Devuelve (ok, reintentable, error)"""
+    result, reintentable, error = await _post_sheets(data)
+    if result is None:
+        return False, reintentable, error
+    if result.get("result") == "success":
+        return True, False, ""
+    return False, False, result.get("error", "Unknown error")
 
-    async def on_submit(self, interaction: discord.Interaction):
+# -------------------------
+# CONTRATO DE LOTES CON APPS SCRIPT
+# -------------------------
+# Petición (un único POST por lote):
+#     {"batch": [{"id": 17, "timestamp": "...", "usuario": "...", "action": "login", ...}, ...]}
+#   Cada elemento es el mismo objeto que se enviaba de a uno, más "id" (único y
+#   estable entre reintentos). Si un lote se reintenta tras un timeout, Apps Script
+#   debe ignorar los "id" que ya escribió.
+#
+# Respuesta:
+#     {"result": "success", "results": [{"id": 17, "result": "success"},
+#                                       {"id": 18, "result": "error", "error": "..."}]}
+#   - Un "id" sin entrada en "results" se reintenta.
+#   - Una respuesta sin "results" es de un script que no conoce el contrato (el
+#     desplegado contesta {"result": "success"} a cualquier POST): no confirma
+#     nada, el outbox vuelve a un evento por POST y reenvía el lote de a uno.
+#
+# Correcciones (reproceso del historial): el elemento trae además
+#     "reemplaza": 17   (id con el que se envió el evento original; puede ser null)
+#   y Apps Script debe reescribir esa fila en vez de agregar una nueva (sin id,
+#   la fila se identifica por timestamp + usuario + action). Solo se envían con
+#   REPROCESO_ENVIAR_SHEETS=1: el script desplegado no lo implementa.
+async def enviar_lote_a_sheets(eventos: list) -> Optional[dict]:
+    """Envía [(id, data), ...] en un solo POST. Devuelve {id: (ok, reintentable, error)}.
+    
+    None si Apps Script no implementa el contrato de lotes (respuesta sin "results").
+    """
+    body = {"batch": [dict(data, id=evento_id) for evento_id, data in eventos]}
+    result, reintentable, error = await _post_sheets(body)
+    if result is None:
+        return {evento_id: (False, reintentable, error) for evento_id, _ in eventos}
+    
+    resultados_lote = result.get("results")
+    if not isinstance(resultados_lote, list):
+        return None
+    
+    por_id = {r.get("id"): r for r in resultados_lote if isinstance(r, dict)}
+    resultados = {}
+    for evento_id, _ in eventos:
+        r = por_id.get(evento_id)
+        if r is None:
+            resultados[evento_id] = (False, True, "Sin respuesta en el lote")
+        elif r.get("result") == "success":
+            resultados[evento_id] = (True, False, "")
+        else:
+            resultados[evento_id] = (False, False, r.get("error", "Unknown error"))
+    return resultados
+
+# =========================
+# OUTBOX LOCAL (SQLITE WAL)
+# =========================
+class OutboxAsistencia:
+    """Cola persistente de eventos pendientes de enviar a Google Sheets.
+    
+    Cada evento se guarda en SQLite (modo WAL) antes de contestar al usuario;
+    los workers en segundo plano lo envían al webhook y lo borran al confirmarse.
+    Si el proceso se cae, los eventos pendientes se reenvían al volver a iniciar.
+    
+    Con SHEETS_LOTE_MAX > 1 los workers agrupan los eventos que llegan dentro de una
+    ventana corta (o hasta llenar el lote) y los mandan en un único POST con el
+    contrato de lotes; por defecto envían un evento por POST.
+    
+    Orden por usuario: solo se toma el evento pendiente más antiguo de cada user_id,
+    así un evento posterior nunca llega a Sheets antes que uno anterior que está
+    en vuelo o esperando su reintento. Usuarios distintos siguen en paralelo.
+    """
+
+    def __init__(self, ruta: str, workers: int, max_intentos: int, reintento_s: float,
+                 reintento_max_s: float, lote_max: int, ventana_s: float):
+        self.ruta = ruta
+        self.workers = workers
+        self.max_intentos = max_intentos
+        self.reintento_s = reintento_s
+        self.reintento_max_s = reintento_max_s
+        self.lote_max = max(1, lote_max)
+        self.ventana_s = ventana_s
+        self._conn: Optional[sqlite3.Connection] = None
+        self._hay_eventos = asyncio.Event()
+        self._en_vuelo = set()
+        self._confirmaciones = {}
+        self._tareas = []
+        self.stats = {"encolados": 0, "enviados": 0, "reintentos": 0, "fallidos": 0, "lotes": 0}
+        # Conteos por estado en memoria: se cuentan al abrir la base y después los
+        # mantiene el propio outbox (único que escribe la tabla), sin COUNT(*) por consulta
+        self._en_estado = {"pendiente": 0, "fallido": 0}
+
+    def _conexion(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.ruta, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " payload TEXT NOT NULL,"
+                " creado REAL NOT NULL,"
+                " intentos INTEGER NOT NULL DEFAULT 0,"
+                " proximo_intento REAL NOT NULL,"
+                " estado TEXT NOT NULL DEFAULT 'pendiente',"
+                " ultimo_error TEXT)"
+            )
+            columnas = {fila[1] for fila in conn.execute("PRAGMA table_info(outbox)")}
+            if "user_id" not in columnas:
+                # Bases creadas antes del orden por usuario
+                conn.execute("ALTER TABLE outbox ADD COLUMN user_id INTEGER")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_estado ON outbox (estado, proximo_intento)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_usuario ON outbox (user_id, estado, id)")
+            for estado, cantidad in conn.execute("SELECT estado, COUNT(*) FROM outbox GROUP BY estado"):
+                self._en_estado[estado] = cantidad
+            self._conn = conn
+        return self._conn
+
+    def agregar(self, data: dict, confirmar: bool = False, user_id: Optional[int] = None) -> int:
+        """Guarda el evento localmente (commit inmediato) y despierta a los workers.
+        
+        Con confirmar=True se puede esperar el resultado con esperar_confirmacion().
+        Los eventos con el mismo user_id se entregan en el orden en que se agregaron.
+        """
+        ahora = time.time()
+        cur = self._conexion().execute(
+            "INSERT INTO outbox (payload, creado, proximo_intento, user_id) VALUES (?, ?, ?, ?)",
+            (json.dumps(data, ensure_ascii=False), ahora, ahora, user_id)
+        )
+        evento_id = cur.lastrowid
+        if confirmar:
+            self._confirmaciones[evento_id] = asyncio.get_running_loop().create_future()
+        self.stats["encolados"] += 1
+        self._en_estado["pendiente"] += 1
+        self._hay_eventos.set()
+        return evento_id
+
+    def agregar_lote(self, eventos: list) -> int:
+        """Guarda [(data, user_id), ...] en una sola transacción (sin confirmación). Devuelve cuántos"""
+        ahora = time.time()
+        conn = self._conexion()
+        conn.execute("BEGIN")
         try:
-            cantidad_str = self.cantidad_modelos.value.strip()
-            
-            if cantidad_str not in ['1', '2', '3']:
-                await interaction.response.send_message(
-                    "❌ **Error**: Debes escribir 1, 2 o 3 (máximo 3 modelos)",
-                    ephemeral=True
+            conn.executemany(
+                "INSERT INTO outbox (payload, creado, proximo_intento, user_id) VALUES (?, ?, ?, ?)",
+                [(json.dumps(data, ensure_ascii=False), ahora, ahora, user_id) for data, user_id in eventos]
+            )
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        self.stats["encolados"] += len(eventos)
+        self._en_estado["pendiente"] += len(eventos)
+        self._hay_eventos.set()
+        return len(eventos)
+
+    async def esperar_confirmacion(self, evento_id: int, timeout: float) -> Optional[tuple]:
+        """Espera (ok, error) del envío a Sheets; None si no llega a tiempo"""
+        futuro = self._confirmaciones.get(evento_id)
+        if futuro is None:
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.shield(futuro), timeout=timeout)
+        except asyncio.TimeoutError:
+            self._confirmaciones.pop(evento_id, None)
+            return None
+
+    def _resolver(self, evento_id: int, ok: bool, error: str):
+        futuro = self._confirmaciones.pop(evento_id, None)
+        if futuro is not None and not futuro.done():
+            futuro.set_result((ok, error))
+
+    def pendientes(self) -> int:
+        """Cantidad de eventos que aún no llegaron a Google Sheets"""
+        self._conexion()
+        return self._en_estado["pendiente"]
+
+    def fallidos(self) -> int:
+        """Eventos rechazados por Apps Script tras agotar los reintentos"""
+        self._conexion()
+        return self._en_estado["fallido"]
+
+    # Solo el primer pendiente de cada usuario: los siguientes esperan a que se confirme
+    _ES_PRIMERO_DEL_USUARIO = (
+        " AND NOT EXISTS (SELECT 1 FROM outbox previo"
+        " WHERE previo.user_id = outbox.user_id AND previo.estado = 'pendiente' AND previo.id < outbox.id)"
+    )
+
+    def _tomar_lote(self, limite: int) -> list:
+        """Reserva hasta `limite` eventos pendientes (los más antiguos primero, uno por usuario)"""
+        en_vuelo = ",".join(str(i) for i in self._en_vuelo) or "0"
+        rows = self._conexion().execute(
+            "SELECT id, payload, intentos FROM outbox"
+            " WHERE estado = 'pendiente' AND proximo_intento <= ?"
+            f" AND id NOT IN ({en_vuelo})" + self._ES_PRIMERO_DEL_USUARIO +
+            " ORDER BY id LIMIT ?",
+            (time.time(), limite)
+        ).fetchall()
+        for row in rows:
+            self._en_vuelo.add(row[0])
+        return rows
+
+    def _proxima_espera(self) -> float:
+        """Segundos hasta el próximo reintento programado"""
+        en_vuelo = ",".join(str(i) for i in self._en_vuelo) or "0"
+        row = self._conexion().execute(
+            "SELECT MIN(proximo_intento) FROM outbox WHERE estado = 'pendiente'"
+            f" AND id NOT IN ({en_vuelo})" + self._ES_PRIMERO_DEL_USUARIO
+        ).fetchone()
+        if not row or row[0] is None:
+            return 60.0
+        return max(0.0, min(60.0, row[0] - time.time()))
+
+    def _registrar_fallo(self, evento_id: int, intentos: int, reintentable: bool, error: str):
+        intentos += 1
+        if not reintentable and intentos >= self.max_intentos:
+            self._conexion().execute(
+                "UPDATE outbox SET estado = 'fallido', intentos = ?, ultimo_error = ? WHERE id = ?",
+                (intentos, error, evento_id)
+            )
+            self.stats["fallidos"] += 1
+            self._en_estado["pendiente"] -= 1
+            self._en_estado["fallido"] += 1
+            self._resolver(evento_id, False, error)
+            log_sheets.error("Evento %d descartado por Google Sheets tras %d intentos: %s", evento_id, intentos, error, extra={"evento_id": evento_id})
+            return
+        # Backoff exponencial con jitter completo: evita que todos reintenten a la vez
+        espera = random.uniform(self.reintento_s, min(self.reintento_max_s, self.reintento_s * 2 ** intentos))
+        self._conexion().execute(
+            "UPDATE outbox SET intentos = ?, proximo_intento = ?, ultimo_error = ? WHERE id = ?",
+            (intentos, time.time() + espera, error, evento_id)
+        )
+        self.stats["reintentos"] += 1
+        log_sheets.warning("Evento %d reintentará en %.0fs (%s)", evento_id, espera, error, extra={"evento_id": evento_id})
+
+    async def _enviar(self, rows: list):
+        eventos = []
+        for evento_id, payload, intentos in rows:
+            try:
+                eventos.append((evento_id, json.loads(payload)))
+            except ValueError as e:
+                self._registrar_fallo(evento_id, self.max_intentos, False, f"Payload corrupto: {e}")
+        if not eventos:
+            return
+        
+        inicio = time.perf_counter()
+        if self.lote_max == 1:
+            evento_id, data = eventos[0]
+            resultados = {evento_id: await enviar_a_sheets(data)}
+        else:
+            resultados = await enviar_lote_a_sheets(eventos)
+            self.stats["lotes"] += 1
+            if resultados is None:
+                # El script no entiende lotes: nada quedó confirmado, se reenvía de a uno
+                log_sheets.error(
+                    "Apps Script respondió sin \"results\" a un lote: no implementa el contrato de lotes."
+                    " Se vuelve a un evento por POST (revisar SHEETS_LOTE_MAX)"
                 )
-                return
-            
-            cantidad = int(cantidad_str)
-            
-            # Crear mensaje con botón "Rellenar" - NO EFÍMERO para poder eliminarlo
-            embed = Embed(
-                title=f"📝 Logout con {cantidad} modelo{'s' if cantidad > 1 else ''}",
-                description=f"**Presiona el botón para completar los datos de {cantidad} modelo{'s' if cantidad > 1 else ''}:**",
-                color=discord.Color.blue()
+                self.lote_max = 1
+                resultados = {evento_id: (False, True, "Apps Script sin contrato de lotes") for evento_id, _ in eventos}
+        latencia_ms = round((time.perf_counter() - inicio) * 1000, 1)
+        
+        intentos_por_id = {row[0]: row[2] for row in rows}
+        enviados = []
+        for evento_id, data in eventos:
+            ok, reintentable, error = resultados[evento_id]
+            if ok:
+                enviados.append((evento_id,))
+                self._resolver(evento_id, True, "")
+            else:
+                self._registrar_fallo(evento_id, intentos_por_id[evento_id], reintentable, error)
+        if enviados:
+            self._conexion().executemany("DELETE FROM outbox WHERE id = ?", enviados)
+            self.stats["enviados"] += len(enviados)
+            self._en_estado["pendiente"] -= len(enviados)
+            log_sheets.info(
+                "Registros actualizados en Google Sheets: %d/%d del lote", len(enviados), len(eventos),
+                extra={"latencia_ms": latencia_ms}
             )
+
+    async def _worker(self):
+        while True:
+            # Con el circuito abierto no se envía: los eventos esperan en disco
+            espera = circuito_sheets.espera_restante()
+            if espera > 0:
+                await asyncio.sleep(espera)
+                continue
+            if not circuito_sheets.permitir():
+                await asyncio.sleep(0.5)
+                continue
             
-            # Vista con botón para rellenar
-            view = LogoutRellenarView(cantidad, self.validacion_msg)
+            # En semiabierto este worker lleva la única prueba. El POST la resuelve
+            # (registrar_exito / registrar_fallo); cualquier salida que no llegue a
+            # él (sin eventos, payloads corruptos, error armando el lote) la devuelve
+            prueba = circuito_sheets.estado == CircuitoSheets.SEMIABIERTO
+            rows = []
+            try:
+                rows = self._tomar_lote(self.lote_max)
+                if rows:
+                    try:
+                        # Dejar que se acumulen más clics de la misma ráfaga antes de enviar
+                        if len(rows) < self.lote_max and self.ventana_s > 0:
+                            await asyncio.sleep(self.ventana_s)
+                            rows += self._tomar_lote(self.lote_max - len(rows))
+                        await self._enviar(rows)
+                    except Exception as e:
+                        log_sheets.exception("Error en worker del outbox")
+                        for evento_id, _, intentos in rows:
+                            self._registrar_fallo(evento_id, intentos, True, str(e))
+                    finally:
+                        for evento_id, _, _ in rows:
+                            self._en_vuelo.discard(evento_id)
+                        # Los eventos que esperaban detrás de este lote ya pueden salir
+                        self._hay_eventos.set()
+            finally:
+                # Si hubo POST el circuito ya salió del semiabierto (cerrado, o abierto
+                # con enfriamiento): devolver el turno no libera la prueba de otro worker
+                if prueba:
+                    circuito_sheets.liberar_prueba()
             
-            # CAMBIO: Quitar ephemeral=True para poder eliminar el mensaje después
-            await interaction.response.send_message(
-                embed=embed,
-                view=view
-                # Sin ephemeral=True - ahora es visible para todos pero se eliminará
-            )
+            if not rows:
+                self._hay_eventos.clear()
+                try:
+                    await asyncio.wait_for(self._hay_eventos.wait(), timeout=self._proxima_espera())
+                except asyncio.TimeoutError:
+                    pass
+
+    async def iniciar(self):
+        """Abre la base local y lanza los workers que vacían el outbox"""
+        self._conexion()
+        if not GOOGLE_SHEETS_WEBHOOK_URL:
+            return
+        for _ in range(self.workers):
+            self._tareas.append(asyncio.create_task(self._worker()))
+        self._hay_eventos.set()
+
+    async def detener(self):
+        for tarea in self._tareas:
+            tarea.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        self._tareas = []
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+outbox = OutboxAsistencia(
+    ASISTENCIA_DB_PATH,
+    OUTBOX_WORKERS,
+    OUTBOX_MAX_INTENTOS,
+    OUTBOX_REINTENTO_S,
+    OUTBOX_REINTENTO_MAX_S,
+    SHEETS_LOTE_MAX,
+    SHEETS_LOTE_VENTANA_S
+)
+
+# =========================
+# HISTORIAL LOCAL DE EVENTOS
+# =========================
+# Marcas de validación → categoría de los resúmenes (un evento puede tener varias)
+CATEGORIAS_VALIDACION = (
+    ("FUERA DE HORARIO", "fuera_de_horario"),
+    ("MUY TEMPRANO", "muy_temprano"),
+    ("TARDE", "tarde"),
+    ("NO MARCO INICIO", "sin_login"),
+    ("FUERA DE TIEMPO", "fuera_de_tiempo"),
+    ("BREAK EXCEDIDO", "break_excedido"),
+    ("BREAK CERRADO AUTOMÁTICAMENTE", "break_automatico"),
+    ("FUERA DE ORDEN", "fuera_de_orden"),
+)
+
+def categorias_validacion(validacion: str) -> list:
+    """Categorías de un texto de validación ("ok" si no tiene ninguna marca)"""
+    categorias = [categoria for marca, categoria in CATEGORIAS_VALIDACION if marca in validacion]
+    return categorias or ["ok"]
+
+def normalizar_modelo(nombre: str) -> str:
+    """Clave del modelo en los resúmenes ("ana  perez" y "Ana Perez" suman juntos)"""
+    return " ".join(nombre.split()).title()
+
+class AlmacenEventos:
+    """Copia local de cada evento registrado (el sistema de registro; Sheets es una vista).
+    
+    Los handlers solo encolan; una única tarea escribe lo acumulado en una sola
+    transacción dentro de un hilo (asyncio.to_thread), así el loop nunca espera
+    al disco. fecha_jornada se guarda como AAAA-MM-DD para poder filtrar por rango.
+    """
+
+    def __init__(self, ruta: str, lote_max: int):
+        self.ruta = ruta
+        self.lote_max = max(1, lote_max)
+        self._cola: asyncio.Queue = asyncio.Queue()
+        self._tarea: Optional[asyncio.Task] = None
+        self._conn_escritura: Optional[sqlite3.Connection] = None
+        self._conn_lectura: Optional[sqlite3.Connection] = None
+        # La conexión de escritura la usa un solo hilo a la vez (escritor o reconstrucción)
+        self._escribiendo = asyncio.Lock()
+        self.stats = {"escritos": 0, "lotes": 0, "errores": 0}
+
+    def _abrir(self) -> sqlite3.Connection:
+        # Cada conexión se usa desde un solo hilo a la vez (la tarea escritora o una consulta)
+        conn = sqlite3.connect(self.ruta, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def _crear_esquema(self, conn: sqlite3.Connection):
+        conn.executescript(
+            "CREATE TABLE IF NOT EXISTS eventos ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " evento_id INTEGER,"
+            " epoch REAL NOT NULL,"
+            " timestamp TEXT NOT NULL,"
+            " user_id INTEGER,"
+            " usuario TEXT NOT NULL,"
+            " team TEXT NOT NULL,"
+            " action TEXT NOT NULL,"
+            " fecha_jornada TEXT NOT NULL,"
+            " validacion TEXT NOT NULL,"
+            " payload TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS ventas ("
+            " evento INTEGER NOT NULL REFERENCES eventos (id),"
+            " numero INTEGER NOT NULL,"
+            " modelo TEXT NOT NULL,"
+            " monto_bruto REAL NOT NULL,"
+            " monto_neto REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_eventos_usuario ON eventos (user_id, fecha_jornada);"
+            "CREATE INDEX IF NOT EXISTS idx_eventos_team ON eventos (team, fecha_jornada);"
+            "CREATE INDEX IF NOT EXISTS idx_eventos_epoch ON eventos (epoch);"
+            "CREATE INDEX IF NOT EXISTS idx_ventas_evento ON ventas (evento);"
+            # Resúmenes materializados: se actualizan en la misma transacción que el evento
+            "CREATE TABLE IF NOT EXISTS resumen_validaciones ("
+            " team TEXT NOT NULL, fecha_jornada TEXT NOT NULL, action TEXT NOT NULL,"
+            " categoria TEXT NOT NULL, cantidad INTEGER NOT NULL,"
+            " PRIMARY KEY (team, fecha_jornada, action, categoria));"
+            "CREATE TABLE IF NOT EXISTS resumen_ventas ("
+            " team TEXT NOT NULL, fecha_jornada TEXT NOT NULL, modelo TEXT NOT NULL,"
+            " cantidad INTEGER NOT NULL, monto_bruto REAL NOT NULL, monto_neto REAL NOT NULL,"
+            " PRIMARY KEY (team, fecha_jornada, modelo));"
+            "CREATE INDEX IF NOT EXISTS idx_resumen_validaciones_fecha ON resumen_validaciones (fecha_jornada);"
+            "CREATE INDEX IF NOT EXISTS idx_resumen_ventas_fecha ON resumen_ventas (fecha_jornada);"
+        )
+
+    def registrar(self, data: dict, user_id: Optional[int] = None, evento_id: Optional[int] = None):
+        """Encola el evento para la tarea escritora (no bloquea)"""
+        self._cola.put_nowait((data, user_id, evento_id))
+
+    @staticmethod
+    def _fila(data: dict, user_id: Optional[int], evento_id: Optional[int]) -> tuple:
+        momento = datetime.fromisoformat(data["timestamp"])
+        fecha = datetime.strptime(data["fecha_jornada"], "%d/%m/%Y").date().isoformat()
+        return (
+            evento_id, momento.timestamp(), data["timestamp"], user_id, data["usuario"], data["team"],
+            data["action"], fecha, data.get("validacion", ""), json.dumps(data, ensure_ascii=False)
+        )
+
+    @staticmethod
+    def _acumular(conn: sqlite3.Connection, team: str, fecha: str, action: str, validacion: str, modelos, signo: int = 1):
+        """Suma (signo=1) o resta (signo=-1) un evento a los resúmenes.
         
-        except Exception as e:
-            print(f"❌ Error en selector: {e}")
-            await interaction.response.send_message(
-                "❌ Error procesando selección. Inténtalo nuevamente.",
-                ephemeral=True
+        Mismo código para el alta, la reconstrucción y las correcciones del reproceso.
+        """
+        conn.executemany(
+            "INSERT INTO resumen_validaciones (team, fecha_jornada, action, categoria, cantidad)"
+            " VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (team, fecha_jornada, action, categoria) DO UPDATE SET cantidad = cantidad + excluded.cantidad",
+            [(team, fecha, action, categoria, signo) for categoria in categorias_validacion(validacion)]
+        )
+        if modelos:
+            conn.executemany(
+                "INSERT INTO resumen_ventas (team, fecha_jornada, modelo, cantidad, monto_bruto, monto_neto)"
+                " VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (team, fecha_jornada, modelo) DO UPDATE SET cantidad = cantidad + excluded.cantidad,"
+                " monto_bruto = monto_bruto + excluded.monto_bruto, monto_neto = monto_neto + excluded.monto_neto",
+                [(team, fecha, normalizar_modelo(modelo), signo, bruto * signo, neto * signo) for modelo, bruto, neto in modelos]
             )
+        if signo < 0:
+            conn.execute("DELETE FROM resumen_validaciones WHERE cantidad <= 0")
+            conn.execute("DELETE FROM resumen_ventas WHERE cantidad <= 0")
+
+    def _escribir(self, lote: list):
+        """Escribe el lote y actualiza los resúmenes en una transacción (corre en un hilo)"""
+        conn = self._conn_escritura
+        with conn:
+            for data, user_id, evento_id in lote:
+                fila = self._fila(data, user_id, evento_id)
+                cur = conn.execute(
+                    "INSERT INTO eventos (evento_id, epoch, timestamp, user_id, usuario, team, action,"
+                    " fecha_jornada, validacion, payload) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    fila
+                )
+                modelos = [(m["nombre"], m["monto_bruto"], m["monto_neto"]) for m in data.get("modelos_data") or ()]
+                if modelos:
+                    conn.executemany(
+                        "INSERT INTO ventas (evento, numero, modelo, monto_bruto, monto_neto) VALUES (?, ?, ?, ?, ?)",
+                        [(cur.lastrowid, numero, *modelo) for numero, modelo in enumerate(modelos, 1)]
+                    )
+                _, _, _, _, _, team, action, fecha, validacion, _ = fila
+                self._acumular(conn, team, fecha, action, validacion, modelos)
+
+    def _reconstruir(self) -> int:
+        """Recalcula los resúmenes desde los eventos crudos (corre en un hilo)"""
+        conn = self._conn_escritura
+        ventas = {}
+        for evento, modelo, bruto, neto in conn.execute("SELECT evento, modelo, monto_bruto, monto_neto FROM ventas ORDER BY evento, numero"):
+            ventas.setdefault(evento, []).append((modelo, bruto, neto))
+        cantidad = 0
+        with conn:
+            conn.execute("DELETE FROM resumen_validaciones")
+            conn.execute("DELETE FROM resumen_ventas")
+            for evento, team, action, fecha, validacion in conn.execute(
+                "SELECT id, team, action, fecha_jornada, validacion FROM eventos"
+            ).fetchall():
+                self._acumular(conn, team, fecha, action, validacion, ventas.get(evento))
+                cantidad += 1
+        return cantidad
+
+    async def reconstruir_resumenes(self) -> int:
+        """Rehace los resúmenes (comando de administración). Devuelve los eventos recorridos"""
+        async with self._escribiendo:
+            return await asyncio.to_thread(self._reconstruir)
+
+    async def reporte(self, fecha: str, team: Optional[str] = None) -> tuple:
+        """(validaciones, ventas) de los resúmenes para una fecha de jornada AAAA-MM-DD"""
+        filtro, parametros = ("fecha_jornada = ?", (fecha,)) if team is None else ("team = ? AND fecha_jornada = ?", (team, fecha))
+        validaciones = await self.consultar(
+            f"SELECT team, action, categoria, cantidad FROM resumen_validaciones WHERE {filtro}", parametros
+        )
+        ventas = await self.consultar(
+            f"SELECT team, modelo, cantidad, monto_bruto, monto_neto FROM resumen_ventas WHERE {filtro}"
+            " ORDER BY team, monto_bruto DESC", parametros
+        )
+        return validaciones, ventas
+
+    async def _escritor(self):
+        while True:
+            lote = [await self._cola.get()]
+            # Todo lo que se acumuló mientras se escribía el lote anterior va junto
+            while len(lote) < self.lote_max and not self._cola.empty():
+                lote.append(self._cola.get_nowait())
+            # None es la marca de cierre que encola detener()
+            fin = None in lote
+            lote = [evento for evento in lote if evento is not None]
+            if lote:
+                try:
+                    async with self._escribiendo:
+                        await asyncio.to_thread(self._escribir, lote)
+                    self.stats["escritos"] += len(lote)
+                    self.stats["lotes"] += 1
+                except Exception:
+                    self.stats["errores"] += 1
+                    log.exception("No se pudo escribir %d eventos en el historial local", len(lote))
+            if fin and self._cola.empty():
+                return
+
+    async def ejecutar(self, funcion, *args, escritura: bool = False):
+        """Corre funcion(conn, *args) en un hilo, con la conexión de lectura o la de escritura (exclusiva)"""
+        if escritura:
+            async with self._escribiendo:
+                return await asyncio.to_thread(funcion, self._conn_escritura, *args)
+        return await asyncio.to_thread(funcion, self._conn_lectura, *args)
+
+    async def consultar(self, sql: str, parametros: tuple = ()) -> list:
+        """Consulta de solo lectura sobre el historial (en un hilo)"""
+        return await asyncio.to_thread(lambda: self._conn_lectura.execute(sql, parametros).fetchall())
+
+    async def iniciar(self):
+        self._conn_escritura = self._abrir()
+        self._crear_esquema(self._conn_escritura)
+        self._conn_lectura = self._abrir()
+        self._tarea = asyncio.create_task(self._escritor())
+
+    async def detener(self):
+        """Escribe lo que quede en la cola y cierra las conexiones"""
+        if self._tarea:
+            self._cola.put_nowait(None)
+            await self._tarea
+            self._tarea = None
+        for conn in (self._conn_escritura, self._conn_lectura):
+            if conn is not None:
+                conn.close()
+        self._conn_escritura = self._conn_lectura = None
+
+almacen = AlmacenEventos(EVENTOS_DB_PATH, EVENTOS_LOTE_MAX)
 
 # =========================
-# VISTA CON BOTÓN "RELLENAR" (MEJORADA)
+# NÓMINA: ANÁLISIS VECTORIZADO DEL HISTORIAL (NUMPY)
 # =========================
-class LogoutRellenarView(ui.View):
-    def __init__(self, cantidad_modelos: int, validacion_msg: str = ""):
-        super().__init__(timeout=300)
-        self.cantidad_modelos = cantidad_modelos
-        self.validacion_msg = validacion_msg
-        self.mensaje_rellenar = None  # Guardar referencia del mensaje
+# Un mes de eventos se carga como arreglos paralelos (usuario, acción, epoch,
+# jornada, montos) y todo se calcula con operaciones de NumPy: sin bucles por
+# evento. Las jornadas son las que ya calculó calcular_fecha_jornada al registrar;
+# los eventos sintéticos del benchmark las calculan con las mismas tablas.
+ACCIONES = ("login", "break", "logout_break", "logout")
+ACC_LOGIN, ACC_BREAK, ACC_LOGOUT_BREAK, ACC_LOGOUT = range(len(ACCIONES))
+CODIGO_ACCION = {accion: codigo for codigo, accion in enumerate(ACCIONES)}
 
-    @ui.button(
-        label=f"📝 Rellenar Datos",
-        style=ButtonStyle.primary,
-        emoji="📝"
-    )
-    async def btn_rellenar(self, interaction: discord.Interaction, button: ui.Button):
-        try:
-            # Guardar referencia del mensaje que contiene este botón
-            self.mensaje_rellenar = interaction.message
-            
-            # Abrir modal según cantidad
-            if self.cantidad_modelos == 1:
-                modal = LogoutModal1Modelo(self.validacion_msg, self.mensaje_rellenar)
-            elif self.cantidad_modelos == 2:
-                modal = LogoutModal2Modelos(self.validacion_msg, self.mensaje_rellenar)
-            else:
-                modal = LogoutModal3Modelos(self.validacion_msg, self.mensaje_rellenar)
-            
-            await interaction.response.send_modal(modal)
-            
-        except Exception as e:
-            print(f"❌ Error abriendo modal rellenar: {e}")
-            await interaction.response.send_message(
-                "❌ Error abriendo formulario. Inténtalo nuevamente.",
-                ephemeral=True
-            )
+def codigos_accion(acciones) -> "np.ndarray":
+    """Nombres de acción → códigos ACC_* (-1 si no se conoce)"""
+    if not len(acciones):
+        return np.zeros(0, dtype=np.int8)
+    tipos, inverso = np.unique(np.array(acciones, dtype=object), return_inverse=True)
+    return np.array([CODIGO_ACCION.get(a, -1) for a in tipos], dtype=np.int8)[inverso]
+
+def _offset_argentina_s() -> int:
+    # Sin horario de verano: un único desplazamiento sirve para todo el historial
+    return int(datetime.now(TZ_ARGENTINA).utcoffset().total_seconds())
+
+def matriz_tablas(pares: list, campo: str):
+    """Tablas de veredictos de varios horarios apiladas en una matriz (horarios × 1440)"""
+    tipo = {"login": np.int16, "jornada": np.int8, "logout": np.uint8}[campo]
+    return np.stack([np.frombuffer(getattr(tablas_horario(inicio, fin), campo), dtype=tipo) for inicio, fin in pares])
+
+def jornadas_vectorizadas(epoch, indice_par, pares: list):
+    """Día de jornada (días desde 1970) de cada evento, con las reglas de calcular_fecha_jornada"""
+    local = epoch.astype(np.int64) + _offset_argentina_s()
+    dia = local // 86400
+    if not pares:
+        return dia
+    minuto = (local % 86400) // 60
+    desplazamiento = matriz_tablas(pares, "jornada")[np.maximum(indice_par, 0), minuto]
+    return dia + np.where(indice_par >= 0, desplazamiento, 0)
+
+def _pares_de_eventos(nombres, usuario, epoch, usar_palabras: bool = True) -> tuple:
+    """Índice del horario (inicio, fin) de cada evento según el roster actual (-1 sin horario).
+    
+    Devuelve (par, pares, jornadas_calendario); la última es {posición: día} con la
+    jornada que fijó el calendario para los usuarios que lo tienen.
+    usar_palabras=False resuelve el alias como calcular_fecha_jornada.
+    """
+    roster = roster_actual()
+    pares, indice_pares = [], {}
+    jornadas_calendario = {}
+    claves = [roster.indice.buscar(str(nombre), usar_palabras=usar_palabras) for nombre in nombres]
+    
+    def indice_de(horario):
+        if not horario:
+            return -1
+        par = (horario["inicio"], horario["fin"])
+        if par not in indice_pares:
+            indice_pares[par] = len(pares)
+            pares.append(par)
+        return indice_pares[par]
+    
+    par_usuario = np.array([indice_de(roster.horarios[c]) if c else -1 for c in claves], dtype=np.int64)
+    par = par_usuario[usuario] if len(usuario) else np.zeros(0, dtype=np.int64)
+    # Con calendario el horario depende del día: se resuelve evento por evento (solo esos usuarios)
+    con_calendario = np.array([c in roster.calendarios for c in claves], dtype=bool)
+    for i in np.flatnonzero(con_calendario[usuario]) if len(usuario) else ():
+        momento = datetime.fromtimestamp(float(epoch[i]), TZ_ARGENTINA)
+        horario = roster.horario_en(claves[usuario[i]], momento)
+        par[i] = indice_de(horario)
+        if horario:
+            jornadas_calendario[int(i)] = (datetime.strptime(horario["fecha_jornada"], "%d/%m/%Y").date() - date(1970, 1, 1)).days
+    return par, pares, jornadas_calendario
+
+def preparar_eventos(filas: list) -> dict:
+    """Filas (usuario, team, action, epoch, fecha_jornada, bruto, neto) → arreglos de NumPy"""
+    if filas:
+        usuarios, teams, acciones, epochs, fechas, brutos, netos = zip(*filas)
+    else:
+        usuarios = teams = acciones = epochs = fechas = brutos = netos = ()
+    nombres, usuario = np.unique(np.array(usuarios, dtype=object), return_inverse=True)
+    accion = codigos_accion(acciones)
+    epoch = np.array(epochs, dtype=np.float64)
+    _, primera = np.unique(usuario, return_index=True)
+    par, pares, _ = _pares_de_eventos(nombres, usuario, epoch)
+    return {
+        "nombres": list(nombres),
+        "teams": [teams[i] for i in primera],
+        "usuario": usuario.astype(np.int64),
+        "accion": accion,
+        "epoch": epoch,
+        "jornada": np.array(fechas, dtype="datetime64[D]").astype(np.int64),
+        "bruto": np.array(brutos, dtype=np.float64),
+        "neto": np.array(netos, dtype=np.float64),
+        "par": par,
+        "pares": pares,
+    }
+
+def calcular_nomina(ev: dict) -> dict:
+    """Horas, breaks, tardanzas y ventas por usuario. Devuelve columnas (arreglos por usuario)"""
+    n = len(ev["nombres"])
+    orden = np.lexsort((ev["epoch"], ev["jornada"], ev["usuario"]))
+    usuario, accion, epoch = ev["usuario"][orden], ev["accion"][orden], ev["epoch"][orden]
+    jornada, par = ev["jornada"][orden], ev["par"][orden]
+    cero = np.zeros(n)
+    if not len(orden):
+        return {"horas": cero, "horas_netas": cero, "jornadas": cero, "incompletas": cero, "minutos_break": cero,
+                "breaks_excedidos": cero, "minutos_exceso_break": cero, "logins_tarde": cero, "minutos_tarde": cero,
+                "bruto": cero, "neto": cero}
+    
+    # Grupos contiguos (usuario, jornada) tras ordenar
+    cambio = np.ones(len(orden), dtype=bool)
+    cambio[1:] = (np.diff(usuario) != 0) | (np.diff(jornada) != 0)
+    inicios = np.flatnonzero(cambio)
+    grupo = np.cumsum(cambio) - 1
+    usuario_grupo = usuario[inicios]
+    
+    # Horas: primer login → último logout de cada jornada
+    primer_login = np.minimum.reduceat(np.where(accion == ACC_LOGIN, epoch, np.inf), inicios)
+    ultimo_logout = np.maximum.reduceat(np.where(accion == ACC_LOGOUT, epoch, -np.inf), inicios)
+    completa = np.isfinite(primer_login) & np.isfinite(ultimo_logout) & (ultimo_logout > primer_login)
+    segundos = np.where(completa, ultimo_logout - primer_login, 0.0)
+    horas = np.bincount(usuario_grupo, weights=segundos, minlength=n) / 3600
+    jornadas = np.bincount(usuario_grupo, weights=completa, minlength=n)
+    incompletas = np.bincount(usuario_grupo, weights=~completa, minlength=n)
+    
+    # Breaks: cada Logout Break (o Logout) cierra el primer Break posterior al cierre
+    # anterior de la misma jornada, igual que la sesión (un segundo Break no reinicia)
+    pos_break = np.flatnonzero(accion == ACC_BREAK)
+    pos_cierre = np.flatnonzero((accion == ACC_LOGOUT_BREAK) | (accion == ACC_LOGOUT))
+    minutos_break = breaks_excedidos = minutos_exceso = cero
+    if len(pos_break) and len(pos_cierre):
+        cierre_anterior = np.empty_like(pos_cierre)
+        cierre_anterior[0] = -1
+        cierre_anterior[1:] = pos_cierre[:-1]
+        desde = np.maximum(cierre_anterior, inicios[grupo[pos_cierre]] - 1)
+        k = np.searchsorted(pos_break, desde, side="right")
+        valido = k < len(pos_break)
+        inicio_break = pos_break[np.minimum(k, len(pos_break) - 1)]
+        valido &= inicio_break < pos_cierre
+        duracion = (epoch[pos_cierre] - epoch[inicio_break]) / 60
+        usuario_break = usuario[pos_cierre][valido]
+        duracion = duracion[valido]
+        exceso = np.maximum(duracion - BREAK_MAX_MIN, 0)
+        minutos_break = np.bincount(usuario_break, weights=duracion, minlength=n)
+        breaks_excedidos = np.bincount(usuario_break, weights=exceso > 0, minlength=n)
+        minutos_exceso = np.bincount(usuario_break, weights=exceso, minlength=n)
+    
+    # Tardanza: primer login de cada jornada contra la tabla de login de su horario
+    pos_login = np.flatnonzero(accion == ACC_LOGIN)
+    logins_tarde = minutos_tarde = cero
+    if len(pos_login) and ev["pares"]:
+        primero = np.ones(len(pos_login), dtype=bool)
+        primero[1:] = grupo[pos_login][1:] != grupo[pos_login][:-1]
+        pos_login = pos_login[primero & (par[pos_login] >= 0)]
+        minuto = ((epoch[pos_login].astype(np.int64) + _offset_argentina_s()) % 86400) // 60
+        diferencia = matriz_tablas(ev["pares"], "login")[par[pos_login], minuto].astype(np.int64)
+        tarde = (diferencia != FUERA_DE_HORARIO) & (diferencia > TOLERANCIA_LOGIN_MIN)
+        logins_tarde = np.bincount(usuario[pos_login][tarde], minlength=n)
+        minutos_tarde = np.bincount(usuario[pos_login][tarde], weights=diferencia[tarde], minlength=n)
+    
+    return {
+        "horas": horas,
+        "horas_netas": horas - minutos_break / 60,
+        "jornadas": jornadas,
+        "incompletas": incompletas,
+        "minutos_break": minutos_break,
+        "breaks_excedidos": breaks_excedidos,
+        "minutos_exceso_break": minutos_exceso,
+        "logins_tarde": logins_tarde,
+        "minutos_tarde": minutos_tarde,
+        "bruto": np.bincount(ev["usuario"], weights=ev["bruto"], minlength=n),
+        "neto": np.bincount(ev["usuario"], weights=ev["neto"], minlength=n),
+    }
+
+COLUMNAS_NOMINA = (
+    "usuario", "team", "jornadas", "incompletas", "horas", "horas_netas", "minutos_break",
+    "breaks_excedidos", "minutos_exceso_break", "logins_tarde", "minutos_tarde", "bruto", "neto"
+)
+
+def nomina_csv(ev: dict, resultado: dict) -> str:
+    salida = io.StringIO()
+    escritor = csv.writer(salida)
+    escritor.writerow(COLUMNAS_NOMINA)
+    for i, nombre in enumerate(ev["nombres"]):
+        escritor.writerow(
+            [nombre, ev["teams"][i]] + [round(float(resultado[columna][i]), 2) for columna in COLUMNAS_NOMINA[2:]]
+        )
+    return salida.getvalue()
+
+def cargar_eventos_mes(ruta: str, mes: str) -> dict:
+    """Eventos de un mes de jornadas ('AAAA-MM') desde el historial local (bloqueante)"""
+    anio, numero_mes = map(int, mes.split("-"))
+    desde = date(anio, numero_mes, 1)
+    hasta = date(anio + numero_mes // 12, numero_mes % 12 + 1, 1)
+    conn = sqlite3.connect(f"file:{ruta}?mode=ro", uri=True)
+    try:
+        filas = conn.execute(
+            "SELECT e.usuario, e.team, e.action, e.epoch, e.fecha_jornada,"
+            " COALESCE(v.bruto, 0), COALESCE(v.neto, 0)"
+            " FROM eventos e LEFT JOIN ("
+            "  SELECT evento, SUM(monto_bruto) AS bruto, SUM(monto_neto) AS neto FROM ventas GROUP BY evento"
+            " ) v ON v.evento = e.id"
+            " WHERE e.fecha_jornada >= ? AND e.fecha_jornada < ?",
+            (desde.isoformat(), hasta.isoformat())
+        ).fetchall()
+    finally:
+        conn.close()
+    return preparar_eventos(filas)
+
+def eventos_sinteticos(cantidad: int, usuarios: int = 200, semilla: int = 7) -> dict:
+    """Jornadas falsas (login, break, vuelta, logout) con los horarios del roster, para medir"""
+    rng = np.random.default_rng(semilla)
+    roster = roster_actual()
+    pares = sorted({(info["inicio"], info["fin"]) for info in roster.horarios.values()})
+    # Una jornada por usuario y día, tantos días como hagan falta para llegar a la cantidad
+    jornadas = max(1, cantidad // 4)
+    usuario_j = np.arange(jornadas) % usuarios
+    dia_j = np.arange(jornadas) // usuarios
+    par_usuario = np.arange(usuarios) % len(pares)
+    inicio_min = np.array([hora_a_minutos(i) for i, _ in pares])[par_usuario[usuario_j]]
+    duracion_min = np.array([calcular_horas_jornada(i, f) * 60 for i, f in pares])[par_usuario[usuario_j]]
+    base = datetime(2026, 10, 1, tzinfo=timezone.utc).timestamp() - _offset_argentina_s()
+    login = base + dia_j * 86400 + (inicio_min + rng.normal(0, 8, jornadas)) * 60
+    salida_break = login + duracion_min * 30
+    vuelta = salida_break + rng.uniform(20, 55, jornadas) * 60
+    logout = base + dia_j * 86400 + (inicio_min + duracion_min - rng.uniform(0, 10, jornadas)) * 60
+    epoch = np.concatenate([login, salida_break, vuelta, logout])
+    usuario = np.tile(usuario_j, 4)
+    par = par_usuario[usuario]
+    bruto = np.concatenate([np.zeros(3 * jornadas), rng.gamma(2, 150, jornadas)])
+    return {
+        "nombres": [f"operador {i}" for i in range(usuarios)],
+        "teams": [f"T{i % 3 + 1}" for i in range(usuarios)],
+        "usuario": usuario,
+        "accion": np.repeat(np.array([ACC_LOGIN, ACC_BREAK, ACC_LOGOUT_BREAK, ACC_LOGOUT], dtype=np.int8), jornadas),
+        "epoch": epoch,
+        "jornada": jornadas_vectorizadas(epoch, par, pares),
+        "bruto": bruto,
+        "neto": bruto * 0.80,
+        "par": par,
+        "pares": pares,
+    }
+
+def benchmark_nomina(cantidad: int = 100_000) -> tuple:
+    """(eventos, segundos de calcular_nomina) sobre eventos sintéticos"""
+    ev = eventos_sinteticos(cantidad)
+    inicio = time.perf_counter()
+    calcular_nomina(ev)
+    return len(ev["epoch"]), time.perf_counter() - inicio
+
+def ejecutar_cli_nomina(args: list) -> int:
+    """python bot.py nomina AAAA-MM  |  python bot.py nomina-benchmark [eventos]"""
+    if args[0] == "nomina-benchmark":
+        cantidad = int(args[1]) if len(args) > 1 else 100_000
+        eventos, segundos = benchmark_nomina(cantidad)
+        print(f"{eventos} eventos procesados en {segundos * 1000:.1f} ms")
+        return 0
+    if len(args) < 2:
+        print("Uso: python bot.py nomina AAAA-MM", file=sys.stderr)
+        return 2
+    if not re.fullmatch(r"\d{4}-(0[1-9]|1[0-2])", args[1]):
+        print(f"Formato de mes inválido: '{args[1]}'. Uso: python bot.py nomina AAAA-MM", file=sys.stderr)
+        return 2
+    try:
+        ev = cargar_eventos_mes(EVENTOS_DB_PATH, args[1])
+    except sqlite3.Error as e:
+        print(f"No se pudo leer el historial {EVENTOS_DB_PATH}: {e}", file=sys.stderr)
+        return 1
+    sys.stdout.write(nomina_csv(ev, calcular_nomina(ev)))
+    return 0
 
 # =========================
-# PANEL DE ASISTENCIA PERMANENTE
+# REPROCESO DEL HISTORIAL (JORNADA Y VALIDACIÓN CON EL ROSTER ACTUAL)
 # =========================
-class PanelAsistenciaPermanente(ui.View):
-    def __init__(self):
-        super().__init__(timeout=None)
+# Si un horario se corrige después de los hechos, los eventos ya guardados (y
+# enviados a Sheets) conservan la jornada y la validación del horario viejo. El
+# reproceso recorre un rango de días en tandas: cada tanda se recalcula con NumPy
+# sobre las mismas tablas por minuto que usan los botones, se compara con lo
+# guardado y solo las filas que cambian se corrigen en el historial (y en sus
+# resúmenes); el CSV de diferencias sirve para corregir la planilla. Solo con
+# REPROCESO_ENVIAR_SHEETS=1 se reenvían además a Sheets por el outbox.
+# La corrección de cada tanda se confirma junto con el checkpoint del reproceso:
+# si se interrumpe, `!reprocesar continuar` sigue desde el primer día sin terminar
+# y reenvía las correcciones que no llegaron a encolarse en el outbox.
+#
+# Solo se recalcula la parte de la validación que depende del horario (TARDE, MUY
+# TEMPRANO, FUERA DE HORARIO, FUERA DE TIEMPO, NO MARCO INICIO); las marcas de la
+# sesión (FUERA DE ORDEN, BREAK EXCEDIDO...) se conservan tal cual. El logout se
+# valida al tocar el botón, no al enviar el formulario: su marca se recalcula con
+# la hora guardada en "hora_validacion". Los logouts guardados sin ese dato
+# conservan la marca que tenían (con la hora del envío saldrían diferencias falsas).
+_MARCA_HORARIO = re.compile(
+    r"^- (?:FUERA DE HORARIO|MUY TEMPRANO|TARDE \(-?[\d.]+h\)|FUERA DE TIEMPO|NO MARCO INICIO)(?: |$)"
+)
 
-    async def _handle_simple_event(self, interaction: discord.Interaction, action: str, emoji: str, event_name: str):
-        """Maneja eventos simples con validaciones de horario"""
-        user = interaction.user
-        channel = interaction.channel
+def logins_abiertos(usuario, accion, epoch, validado, par, pares: list) -> "np.ndarray":
+    """Si cada evento tiene un login abierto, repasando las sesiones como SesionesAsistencia.
+    
+    La sesión nace con el primer evento que la abre y vence al fin de su turno más
+    SESION_GRACIA_H (como mucho SESION_MAX_H después); el logout mira la sesión a la
+    hora del clic (validado) y la cierra a la del envío.
+    """
+    n = len(epoch)
+    abierto = np.zeros(n, dtype=bool)
+    if not n:
+        return abierto
+    minuto = ((epoch.astype(np.int64) + _offset_argentina_s()) % 86400) // 60
+    fines = np.array([hora_a_minutos(fin) for _, fin in pares] or [0], dtype=np.int64)
+    vida = np.full(n, SESION_MAX_H * 3600.0)
+    con_horario = par >= 0
+    hasta_fin = ((fines[np.maximum(par, 0)] - minuto) % MINUTOS_DIA) * 60 + SESION_GRACIA_H * 3600
+    vida[con_horario] = np.minimum(vida[con_horario], hasta_fin[con_horario])
+    
+    actual, estado, expira, con_login = None, SIN_TURNO, 0.0, False
+    for i in np.lexsort((epoch, usuario)).tolist():
+        if usuario[i] != actual:
+            actual, estado, con_login = usuario[i], SIN_TURNO, False
+        codigo = accion[i]
+        if codigo < 0:
+            continue
+        if codigo == ACC_LOGOUT:
+            abierto[i] = estado != SIN_TURNO and con_login and validado[i] < expira
+        if estado != SIN_TURNO and expira <= epoch[i]:
+            estado, con_login = SIN_TURNO, False
+        anterior = estado
+        estado = TRANSICIONES[(estado, ACCIONES[codigo])][0]
+        if anterior == SIN_TURNO and estado != SIN_TURNO:
+            expira = epoch[i] + vida[i]
+        if codigo == ACC_LOGIN and estado != SIN_TURNO:
+            con_login = True
+        elif estado == SIN_TURNO:
+            con_login = False
+    return abierto
+
+def marcas_horario(accion, epoch, par, pares: list, tiene_login) -> "np.ndarray":
+    """Marca de horario de cada evento, igual que validar_login / validar_logout ("" si no hay)"""
+    marcas = np.full(len(epoch), "", dtype=object)
+    if not pares:
+        return marcas
+    minuto = ((epoch.astype(np.int64) + _offset_argentina_s()) % 86400) // 60
+    fila = np.maximum(par, 0)
+    
+    es_login = (accion == ACC_LOGIN) & (par >= 0)
+    diferencia = matriz_tablas(pares, "login")[fila, minuto].astype(np.int64)
+    marcas[es_login & (diferencia == FUERA_DE_HORARIO)] = "- FUERA DE HORARIO"
+    marcas[es_login & (diferencia != FUERA_DE_HORARIO) & (diferencia < -TOLERANCIA_LOGIN_MIN)] = "- MUY TEMPRANO"
+    tarde = np.flatnonzero(es_login & (diferencia > TOLERANCIA_LOGIN_MIN))
+    marcas[tarde] = [f"- TARDE ({d / 60:.1f}h)" for d in diferencia[tarde]]
+    
+    es_logout = (accion == ACC_LOGOUT) & (par >= 0)
+    codigo = matriz_tablas(pares, "logout")[fila, minuto]
+    marcas[es_logout & (codigo == LOGOUT_MUY_TEMPRANO)] = "- MUY TEMPRANO"
+    marcas[es_logout & (codigo == LOGOUT_FUERA_DE_TIEMPO)] = "- FUERA DE TIEMPO"
+    marcas[es_logout & ~tiene_login] = "- NO MARCO INICIO"
+    return marcas
+
+def _dia_a_epoch(dia: date) -> float:
+    """Medianoche (hora Argentina) de un día, en segundos epoch"""
+    return (dia - date(1970, 1, 1)).days * 86400 - _offset_argentina_s()
+
+class ReprocesoHistorial:
+    """Recalcula fecha_jornada y validación de un rango de días del historial, en tandas con checkpoint"""
+
+    COLUMNAS_DIFERENCIA = (
+        "evento", "timestamp", "usuario", "action",
+        "fecha_antes", "fecha_despues", "validacion_antes", "validacion_despues"
+    )
+
+    def __init__(self, almacen: AlmacenEventos, outbox: OutboxAsistencia, dias_tanda: int, enviar_sheets: bool = False):
+        self.almacen = almacen
+        self.outbox = outbox
+        self.dias_tanda = max(1, dias_tanda)
+        self.enviar_sheets = enviar_sheets
+        self.activo = False
+
+    @staticmethod
+    def _crear_esquema(conn: sqlite3.Connection):
+        conn.executescript(
+            "CREATE TABLE IF NOT EXISTS reprocesos ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " desde TEXT NOT NULL, hasta TEXT NOT NULL,"
+            " siguiente TEXT NOT NULL,"
+            " roster TEXT NOT NULL,"
+            " estado TEXT NOT NULL DEFAULT 'en_curso',"
+            " revisados INTEGER NOT NULL DEFAULT 0,"
+            " cambios INTEGER NOT NULL DEFAULT 0,"
+            " creado REAL NOT NULL, actualizado REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS reproceso_cambios ("
+            " reproceso INTEGER NOT NULL,"
+            " evento INTEGER NOT NULL,"
+            " user_id INTEGER,"
+            " timestamp TEXT NOT NULL, usuario TEXT NOT NULL, action TEXT NOT NULL,"
+            " fecha_antes TEXT NOT NULL, fecha_despues TEXT NOT NULL,"
+            " validacion_antes TEXT NOT NULL, validacion_despues TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " enviado INTEGER NOT NULL DEFAULT 0);"
+            "CREATE INDEX IF NOT EXISTS idx_reproceso_cambios ON reproceso_cambios (reproceso, enviado);"
+        )
+
+    @staticmethod
+    def recalcular(filas: list, desde_epoch: float) -> list:
+        """Filas del historial → cambios [(fila, fecha_nueva_iso, validacion_nueva)] de las que empiezan en desde_epoch.
         
-        try:
-            await interaction.response.send_message(
-                f"{emoji} **{event_name}** procesando...",
-                ephemeral=True,
-                delete_after=3
+        filas: (id, evento_id, user_id, usuario, team, action, epoch, timestamp, fecha_jornada, validacion, payload),
+        incluidas las de las horas previas (solo aportan el login abierto de cada usuario).
+        """
+        if not filas:
+            return []
+        columnas = list(zip(*filas))
+        nombres, usuario = np.unique(np.array(columnas[3], dtype=object), return_inverse=True)
+        usuario = usuario.astype(np.int64)
+        accion = codigos_accion(columnas[5])
+        epoch = np.array(columnas[6], dtype=np.float64)
+        
+        # Jornada: mismo alias (sin palabras sueltas) y reglas que calcular_fecha_jornada
+        par, pares, jornadas_calendario = _pares_de_eventos(nombres, usuario, epoch, usar_palabras=False)
+        jornada = jornadas_vectorizadas(epoch, par, pares)
+        for posicion, dia in jornadas_calendario.items():
+            jornada[posicion] = dia
+        guardada = np.array(columnas[8], dtype="datetime64[D]").astype(np.int64)
+        
+        en_rango = epoch >= desde_epoch
+        # Hora con la que se validó cada evento (la del botón en los logouts)
+        validado = epoch.copy()
+        sin_hora = np.zeros(len(epoch), dtype=bool)
+        for i in np.flatnonzero(en_rango & (accion == ACC_LOGOUT)):
+            hora = json.loads(columnas[10][i]).get("hora_validacion")
+            if hora:
+                validado[i] = datetime.fromisoformat(hora).timestamp()
+            else:
+                sin_hora[i] = True
+        
+        # Validación: alias como lo resuelve la identidad del miembro
+        par, pares, _ = _pares_de_eventos(nombres, usuario, validado)
+        marcas = marcas_horario(accion, validado, par, pares, logins_abiertos(usuario, accion, epoch, validado, par, pares))
+        
+        validaciones = columnas[9]
+        nuevas = {}
+        # Solo Login y Logout llevan marca de horario: el texto se arma fila por fila únicamente para ellas
+        for i in np.flatnonzero(en_rango & ((accion == ACC_LOGIN) | (accion == ACC_LOGOUT)) & ~sin_hora):
+            resto = _MARCA_HORARIO.sub("", validaciones[i], count=1)
+            nueva = " ".join(m for m in (marcas[i], resto) if m)
+            if nueva != validaciones[i]:
+                nuevas[int(i)] = nueva
+        
+        cambios = []
+        for i in sorted(set(np.flatnonzero(en_rango & (jornada != guardada)).tolist()) | set(nuevas)):
+            fecha = np.datetime64(int(jornada[i]), "D").astype(object).isoformat()
+            cambios.append((filas[i], fecha, nuevas.get(i, validaciones[i])))
+        return cambios
+
+    def _tanda(self, conn: sqlite3.Connection, reproceso_id: Optional[int], dia: date, hasta: date, aplicar: bool) -> tuple:
+        """Recalcula los días [dia, hasta) (corre en un hilo). Devuelve (revisados, cambios)"""
+        desde_epoch, hasta_epoch = _dia_a_epoch(dia), _dia_a_epoch(hasta)
+        filas = conn.execute(
+            "SELECT id, evento_id, user_id, usuario, team, action, epoch, timestamp, fecha_jornada, validacion, payload"
+            " FROM eventos WHERE epoch >= ? AND epoch < ? ORDER BY epoch, id",
+            (desde_epoch - SESION_MAX_H * 3600, hasta_epoch)
+        ).fetchall()
+        revisados = sum(1 for fila in filas if fila[6] >= desde_epoch)
+        cambios = self.recalcular(filas, desde_epoch)
+        if not aplicar:
+            return revisados, cambios
+        
+        with conn:
+            for fila, fecha, validacion in cambios:
+                evento, evento_id, user_id, usuario, team, action, _, timestamp, fecha_antes, validacion_antes, payload = fila
+                data = json.loads(payload)
+                data["fecha_jornada"] = date.fromisoformat(fecha).strftime("%d/%m/%Y")
+                data["validacion"] = validacion
+                conn.execute(
+                    "UPDATE eventos SET fecha_jornada = ?, validacion = ?, payload = ? WHERE id = ?",
+                    (fecha, validacion, json.dumps(data, ensure_ascii=False), evento)
+                )
+                modelos = conn.execute(
+                    "SELECT modelo, monto_bruto, monto_neto FROM ventas WHERE evento = ? ORDER BY numero", (evento,)
+                ).fetchall()
+                AlmacenEventos._acumular(conn, team, fecha_antes, action, validacion_antes, modelos, signo=-1)
+                AlmacenEventos._acumular(conn, team, fecha, action, validacion, modelos)
+                correccion = dict(data, reemplaza=evento_id)
+                conn.execute(
+                    "INSERT INTO reproceso_cambios (reproceso, evento, user_id, timestamp, usuario, action,"
+                    " fecha_antes, fecha_despues, validacion_antes, validacion_despues, payload)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (reproceso_id, evento, user_id, timestamp, usuario, action, fecha_antes, fecha,
+                     validacion_antes, validacion, json.dumps(correccion, ensure_ascii=False))
+                )
+            # Checkpoint en la misma transacción que las correcciones de la tanda
+            estado = "terminado" if hasta_epoch >= self._fin_epoch(conn, reproceso_id) else "en_curso"
+            conn.execute(
+                "UPDATE reprocesos SET siguiente = ?, estado = ?, revisados = revisados + ?, cambios = cambios + ?,"
+                " actualizado = ? WHERE id = ?",
+                (hasta.isoformat(), estado, revisados, len(cambios), time.time(), reproceso_id)
             )
-            
-            # Obtener nombre del usuario
-            usuario_nombre = obtener_nombre_usuario(user) if hasattr(user, 'nick') else str(user)
-            hora_actual = datetime.now(TZ_ARGENTINA)
-            validacion_msg = ""
-            
-            # Validar según el tipo de evento
-            if action == "login":
-                _, validacion_msg = validar_login(usuario_nombre, hora_actual)
-            elif action == "break":
-                # Registrar inicio de break
-                breaks_activos[user.id] = hora_actual
-                print(f"📝 Break iniciado para {usuario_nombre} a las {hora_actual.strftime('%H:%M')}")
-            elif action == "logout_break":
-                # Validar tiempo de break si existe
-                if user.id in breaks_activos:
-                    hora_break = breaks_activos[user.id]
-                    _, validacion_msg = validar_break_tiempo(hora_break, hora_actual)
-                    del breaks_activos[user.id]  # Limpiar break
-                    print(f"📝 Break finalizado para {usuario_nombre}. {validacion_msg}")
-            
-            # Actualizar registro
-            success = await actualizar_registro_usuario(
-                user, action, interaction.guild, channel, validacion_msg=validacion_msg
+        return revisados, cambios
+
+    @staticmethod
+    def _fin_epoch(conn: sqlite3.Connection, reproceso_id: int) -> float:
+        hasta = conn.execute("SELECT hasta FROM reprocesos WHERE id = ?", (reproceso_id,)).fetchone()[0]
+        return _dia_a_epoch(date.fromisoformat(hasta) + timedelta(days=1))
+
+    def _crear(self, conn: sqlite3.Connection, desde: date, hasta: date) -> int:
+        self._crear_esquema(conn)
+        ahora = time.time()
+        with conn:
+            cur = conn.execute(
+                "INSERT INTO reprocesos (desde, hasta, siguiente, roster, creado, actualizado) VALUES (?, ?, ?, ?, ?, ?)",
+                (desde.isoformat(), hasta.isoformat(), desde.isoformat(), roster_actual().version, ahora, ahora)
             )
-            
-            # Crear embed
-            embed = build_embed(user, event_name, channel, validacion_msg)
-            
-            # Preparar mensaje
-            if success:
-                dm_message = f"{emoji} **{event_name}** registrado exitosamente."
+        return cur.lastrowid
+
+    def _pendiente(self, conn: sqlite3.Connection) -> Optional[tuple]:
+        """(id, desde, hasta, siguiente, roster) del último reproceso sin terminar"""
+        self._crear_esquema(conn)
+        return conn.execute(
+            "SELECT id, desde, hasta, siguiente, roster FROM reprocesos WHERE estado = 'en_curso' ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+
+    def _sin_enviar(self, conn: sqlite3.Connection, reproceso_id: int) -> list:
+        return conn.execute(
+            "SELECT rowid, payload, user_id FROM reproceso_cambios WHERE reproceso = ? AND enviado = 0 ORDER BY rowid",
+            (reproceso_id,)
+        ).fetchall()
+
+    @staticmethod
+    def _marcar_enviados(conn: sqlite3.Connection, filas: list):
+        with conn:
+            conn.executemany("UPDATE reproceso_cambios SET enviado = 1 WHERE rowid = ?", [(fila[0],) for fila in filas])
+
+    async def _enviar_correcciones(self, reproceso_id: int) -> int:
+        """Encola en el outbox las correcciones aún no enviadas (en un solo commit)"""
+        if not self.enviar_sheets:
+            return 0
+        filas = await self.almacen.ejecutar(self._sin_enviar, reproceso_id, escritura=True)
+        if not filas:
+            return 0
+        # Si se corta entre estos dos pasos, la corrección se reenvía: Apps Script
+        # reescribe la misma fila ("reemplaza"), así que repetirla no duplica nada
+        self.outbox.agregar_lote([(json.loads(payload), user_id) for _, payload, user_id in filas])
+        await self.almacen.ejecutar(self._marcar_enviados, filas, escritura=True)
+        return len(filas)
+
+    async def simular(self, desde: date, hasta: date) -> tuple:
+        """(revisados, cambios) sin escribir nada: para revisar la diferencia antes de aplicar"""
+        revisados, cambios = 0, []
+        dia = desde
+        while dia <= hasta:
+            fin = min(dia + timedelta(days=self.dias_tanda), hasta + timedelta(days=1))
+            r, c = await self.almacen.ejecutar(self._tanda, None, dia, fin, False)
+            revisados += r
+            cambios.extend(c)
+            dia = fin
+        return revisados, cambios
+
+    async def ejecutar(self, desde: Optional[date] = None, hasta: Optional[date] = None, avance=None) -> dict:
+        """Aplica un reproceso nuevo (desde/hasta) o continúa el pendiente (sin fechas).
+        
+        avance(dia, revisados, cambios) se llama tras cada tanda confirmada.
+        """
+        if self.activo:
+            raise RuntimeError("Ya hay un reproceso en curso")
+        self.activo = True
+        try:
+            if desde is None:
+                pendiente = await self.almacen.ejecutar(self._pendiente, escritura=True)
+                if pendiente is None:
+                    raise LookupError("No hay ningún reproceso pendiente")
+                reproceso_id, desde_iso, hasta_iso, siguiente, version = pendiente
+                hasta = date.fromisoformat(hasta_iso)
+                dia = date.fromisoformat(siguiente)
+                if version != roster_actual().version:
+                    log.warning("El reproceso %d empezó con el roster %s y sigue con %s", reproceso_id, version, roster_actual().version)
             else:
-                dm_message = f"{emoji} **{event_name}** registrado localmente. ⚠️ Error con Google Sheets."
-            
-            if validacion_msg:
-                dm_message += f" {validacion_msg}"
+                reproceso_id = await self.almacen.ejecutar(self._crear, desde, hasta, escritura=True)
+                dia = desde
             
-            # Enviar confirmación por DM
-            try:
-                await user.send(content=dm_message, embed=embed)
-            except discord.Forbidden:
-                await interaction.followup.send(
-                    f"{emoji} {user.mention} **{event_name}** registrado.\n"
-                    f"💡 Activa los DMs para confirmaciones privadas.",
-                    ephemeral=True,
-                    delete_after=8
+            totales = {"id": reproceso_id, "revisados": 0, "cambios": 0, "enviados": 0}
+            # Correcciones de una ejecución anterior que no llegaron al outbox
+            totales["enviados"] += await self._enviar_correcciones(reproceso_id)
+            while dia <= hasta:
+                fin = min(dia + timedelta(days=self.dias_tanda), hasta + timedelta(days=1))
+                inicio = time.perf_counter()
+                revisados, cambios = await self.almacen.ejecutar(self._tanda, reproceso_id, dia, fin, True, escritura=True)
+                totales["revisados"] += revisados
+                totales["cambios"] += len(cambios)
+                totales["enviados"] += await self._enviar_correcciones(reproceso_id)
+                log.info(
+                    "Reproceso %d: %s → %s, %d eventos revisados, %d corregidos (%.0f ms)",
+                    reproceso_id, dia, fin, revisados, len(cambios), (time.perf_counter() - inicio) * 1000
                 )
-            
-            # Log al canal
-            if LOG_CHANNEL_ID and success:
-                try:
-                    log_channel = interaction.client.get_channel(LOG_CHANNEL_ID)
-                    if log_channel and log_channel != channel:
-                        await log_channel.send(embed=embed)
-                except Exception as e:
-                    print(f"❌ Error enviando a canal de logs: {e}")
+                dia = fin
+                if avance:
+                    await avance(dia, totales["revisados"], totales["cambios"])
+            return totales
+        finally:
+            self.activo = False
+
+    def _diferencia(self, conn: sqlite3.Connection, reproceso_id: int) -> list:
+        return conn.execute(
+            f"SELECT {', '.join(self.COLUMNAS_DIFERENCIA)} FROM reproceso_cambios WHERE reproceso = ? ORDER BY rowid",
+            (reproceso_id,)
+        ).fetchall()
+
+    async def diferencia(self, reproceso_id: int) -> list:
+        """Filas corregidas por un reproceso (para el CSV de diferencias)"""
+        return await self.almacen.ejecutar(self._diferencia, reproceso_id)
+
+    def diferencia_csv(self, filas: list) -> str:
+        salida = io.StringIO()
+        escritor = csv.writer(salida)
+        escritor.writerow(self.COLUMNAS_DIFERENCIA)
+        escritor.writerows(filas)
+        return salida.getvalue()
+
+    @staticmethod
+    def filas_simuladas(cambios: list) -> list:
+        """Cambios de simular() con las mismas columnas que diferencia()"""
+        return [(fila[0], fila[7], fila[3], fila[5], fila[8], fecha, fila[9], validacion) for fila, fecha, validacion in cambios]
+
+reproceso = ReprocesoHistorial(almacen, outbox, REPROCESO_DIAS_TANDA, REPROCESO_ENVIAR_SHEETS)
+
+async def actualizar_registro_usuario(
+    user: discord.abc.User,
+    action: str,
+    guild: Optional[discord.Guild],
+    channel: Optional[discord.abc.GuildChannel],
+    modelos_data: Optional[list] = None,
+    validacion_msg: Optional[str] = None,
+    identidad: Optional[IdentidadUsuario] = None,
+    momento: Optional[datetime] = None,
+    hora_validacion: Optional[datetime] = None
+):
+    """Registra el evento en el outbox local y devuelve su id (None si no se pudo guardar).
+    
+    momento: hora del evento (por defecto, ahora). hora_validacion: hora con la que se
+    validó el horario si no es la del evento (el logout se valida al tocar el botón).
+    Los workers lo envían a Google Sheets; el resultado se obtiene con esperar_registro_sheets().
+    """
+    if not GOOGLE_SHEETS_WEBHOOK_URL:
+        log_sheets.warning("Google Sheets URL no configurada: el evento queda solo en el outbox local")
+    
+    try:
+        # Obtener timestamp en zona horaria Argentina
+        timestamp_argentina = momento or datetime.now(TZ_ARGENTINA)
+        
+        # Nombre y equipo ya resueltos para este miembro (misma versión del roster
+        # con la que empezó la interacción, si se recibe)
+        identidad = identidad or cache_identidad.resolver(user)
+        usuario_nombre = identidad.nombre
+        team = identidad.team
+        
+        # Calcular fecha de jornada laboral para turnos nocturnos
+        fecha_jornada = calcular_fecha_jornada(usuario_nombre, timestamp_argentina, identidad.horario_jornada_en(timestamp_argentina))
+        
+        data = {
+            "timestamp": timestamp_argentina.isoformat(),
+            "usuario": usuario_nombre,
+            "action": action,
+            "team": team,
+            "fecha_jornada": fecha_jornada,
+            "validacion": validacion_msg or ""
+        }
+        if hora_validacion is not None:
+            data["hora_validacion"] = hora_validacion.isoformat()
+        
+        # Agregar datos de modelos si es logout
+        if action == "logout" and modelos_data:
+            data.update({
+                "modelos_data": modelos_data,
+                "cantidad_modelos": len(modelos_data)
+            })
+        
+        log_sheets.debug(
+            "Actualizando registro (%d modelos)", len(modelos_data or ()),
+            extra={"user_id": getattr(user, "id", None), "usuario": usuario_nombre, "action": action, "team": team}
+        )
+        
+        # Commit local inmediato; el envío a Sheets ocurre en segundo plano
+        user_id = getattr(user, "id", None)
+        evento_id = outbox.agregar(data, confirmar=True, user_id=user_id)
+        almacen.registrar(data, user_id, evento_id)
+        return evento_id
                     
-        except Exception as e:
-            print(f"❌ Error en botón {event_name}: {e}")
-            if not interaction.response.is_done():
-                await interaction.response.send_message(
-                    f"❌ Error procesando **{event_name}**. Inténtalo nuevamente.",
-                    ephemeral=True,
-                    delete_after=5
-                )
+    except Exception:
+        log_sheets.exception("Error guardando evento en el outbox")
+        return None
 
-    @ui.button(
-        label="🟢 Login", 
-        style=ButtonStyle.success, 
-        custom_id="attendance_login",
-        row=0
+async def esperar_registro_sheets(evento_id: Optional[int]) -> tuple:
+    """Espera el resultado del envío del evento. Devuelve (estado, error).
+    
+    estado: "ok" (en Sheets), "error" (rechazado), "pendiente" (guardado, se reintentará)
+    o "sin_guardar" (no llegó ni al outbox local).
+    """
+    if evento_id is None:
+        return "sin_guardar", ""
+    if circuito_sheets.abierto():
+        # Sheets está caído: no tiene sentido esperar, el evento ya está en disco
+        return "pendiente", ""
+    resultado = await outbox.esperar_confirmacion(evento_id, SHEETS_CONFIRMACION_S)
+    if resultado is None:
+        return "pendiente", ""
+    ok, error = resultado
+    return ("ok", "") if ok else ("error", error)
+
+def texto_estado_sheets(estado: str, error: str = "") -> str:
+    """Texto corto para el usuario según el resultado del envío a Google Sheets"""
+    if estado == "ok":
+        return "registrado exitosamente."
+    if estado == "pendiente":
+        return "registrado localmente. ⏳ Se enviará a Google Sheets en cuanto responda."
+    if estado == "error":
+        return f"registrado localmente. ⚠️ Google Sheets lo rechazó: {error}"
+    return "no pudo guardarse. ⚠️ Avisa a un supervisor."
+
+def build_embed(user: discord.abc.User, event: str, where: Optional[discord.abc.GuildChannel], validacion_msg: str = "") -> Embed:
+    """Construye un embed para mostrar el evento registrado"""
+    ts = datetime.now(TZ_ARGENTINA).strftime("%d/%m/%Y %H:%M:%S")
+    
+    # Colores según validación
+    if validacion_msg:
+        if "TARDE" in validacion_msg:
+            color = discord.Color.orange()
+        elif "TEMPRANO" in validacion_msg:
+            color = discord.Color.yellow()
+        elif "NO MARCO" in validacion_msg:
+            color = discord.Color.purple()
+        elif "FUERA DE TIEMPO" in validacion_msg:
+            color = discord.Color.red()
+        elif "EXCEDIDO" in validacion_msg:
+            color = discord.Color.yellow()
+        else:
+            color = discord.Color.red()
+    else:
+        event_config = {
+            "Login": {"color": discord.Color.green()},
+            "Break": {"color": discord.Color.blue()},
+            "Logout Break": {"color": discord.Color.purple()}, 
+            "Logout": {"color": discord.Color.red()}
+        }
+        config = event_config.get(event, {"color": discord.Color.default()})
+        color = config["color"]
+    
+    embed = Embed(
+        title=f"📝 {event} Registrado {validacion_msg}",
+        description=f"**Horario Argentina** 🇦🇷",
+        color=color,
+        timestamp=datetime.now(timezone.utc)
+    )
+    
+    # Obtener nombre del usuario
+    usuario_display = obtener_nombre_usuario(user) if hasattr(user, 'nick') else str(user)
+    
+    embed.add_field(
+        name="👤 Usuario", 
+        value=f"{user.mention} (`{usuario_display}`)", 
+        inline=False
     )
-    async def btn_login(self, interaction: discord.Interaction, button: ui.Button):
-        await self._handle_simple_event(interaction, "login", "🟢", "Login")
-
-    @ui.button(
-        label="⏸️ Break", 
-        style=ButtonStyle.primary, 
-        custom_id="attendance_break",
-        row=0
+    
+    embed.add_field(
+        name="⏰ Fecha/Hora (Argentina)", 
+        value=f"`{ts}`", 
+        inline=False
     )
-    async def btn_break(self, interaction: discord.Interaction, button: ui.Button):
-        await self._handle_simple_event(interaction, "break", "⏸️", "Break")
+    
+    if validacion_msg:
+        embed.add_field(
+            name="⚠️ Observación",
+            value=f"`{validacion_msg}`",
+            inline=False
+        )
+    
+    if where and isinstance(where, discord.abc.GuildChannel):
+        embed.add_field(
+            name="📍 Ubicación", 
+            value=f"**{where.guild.name}** - #{where.name}", 
+            inline=False
+        )
+    
+    embed.set_footer(text="✅ Registro guardado - se sincroniza con Google Sheets")
+    return embed
 
-    @ui.button(
-        label="▶️ Logout Break", 
-        style=ButtonStyle.secondary, 
-        custom_id="attendance_logout_break",
-        row=0
+def marcar_sin_guardar(embed: Embed) -> Embed:
+    """Aviso en el embed cuando el evento no llegó al outbox (el canal de logs queda como única constancia)"""
+    embed.color = discord.Color.red()
+    embed.add_field(
+        name="❌ Sin guardar",
+        value="El evento **no** se pudo guardar localmente ni se enviará a Google Sheets. Cargarlo a mano.",
+        inline=False
     )
-    async def btn_logout_break(self, interaction: discord.Interaction, button: ui.Button):
-        await self._handle_simple_event(interaction, "logout_break", "▶️", "Logout Break")
+    embed.set_footer(text="⚠️ Registro NO guardado")
+    return embed
 
-    @ui.button(
-        label="🔴 Logout", 
-        style=ButtonStyle.danger, 
-        custom_id="attendance_logout",
-        row=0
-    )
-    async def btn_logout(self, interaction: discord.Interaction, button: ui.Button):
-        """Logout con modal selector"""
+# =========================
+# LIMPIEZA DIFERIDA DE MENSAJES
+# =========================
+class ProgramadorLimpieza:
+    """Acciones diferidas en una única tarea (heap ordenado por vencimiento).
+    
+    Reemplaza los asyncio.sleep() dentro de los handlers: el handler programa
+    el borrado y sigue, sin retener la interacción ni las llamadas posteriores.
+    También la usan los recordatorios, con su propia instancia.
+    """
+
+    def __init__(self, nombre: str = "limpieza"):
+        self.nombre = nombre
+        self._heap = []
+        self._secuencia = itertools.count()
+        self._cambio = asyncio.Event()
+        self._tarea: Optional[asyncio.Task] = None
+        # El loop solo guarda referencias débiles a las tareas: sin este set una
+        # acción en curso podría ser recolectada antes de terminar
+        self._en_curso = set()
+
+    def programar(self, retraso_s: float, accion, descripcion: str = ""):
+        """Agenda `accion()` (función que devuelve un awaitable) para dentro de retraso_s"""
+        vence = time.monotonic() + retraso_s
+        heapq.heappush(self._heap, (vence, next(self._secuencia), accion, descripcion))
+        if self._heap[0][0] == vence:
+            self._cambio.set()
+
+    def pendientes(self) -> int:
+        return len(self._heap)
+
+    def _terminada(self, tarea: asyncio.Task):
+        self._en_curso.discard(tarea)
+        if not tarea.cancelled() and tarea.exception() is not None:
+            log.error("Error no manejado en %s", self.nombre, exc_info=tarea.exception())
+
+    async def _ejecutar(self, accion, descripcion: str):
         try:
-            # Validar logout
-            usuario_nombre = obtener_nombre_usuario(interaction.user) if hasattr(interaction.user, 'nick') else str(interaction.user)
-            hora_actual = datetime.now(TZ_ARGENTINA)
-            
-            _, validacion_msg = validar_logout(usuario_nombre, hora_actual, True)
-            
-            # Abrir modal selector
-            modal = LogoutSelectorModal(validacion_msg)
-            await interaction.response.send_modal(modal)
-            
+            await accion()
+            log.debug("%s ejecutada: %s", self.nombre, descripcion)
+        except discord.NotFound:
+            log.debug("%s omitida, el mensaje ya no existe: %s", self.nombre, descripcion)
         except Exception as e:
-            print(f"❌ Error en botón logout: {e}")
-            if not interaction.response.is_done():
-                await interaction.response.send_message(
-                    "❌ Error abriendo formulario de logout. Inténtalo nuevamente.",
-                    ephemeral=True,
-                    delete_after=5
-                )
+            log.warning("No se pudo ejecutar %s (%s): %s", self.nombre, descripcion, e)
+
+    async def _bucle(self):
+        while True:
+            self._cambio.clear()
+            if not self._heap:
+                await self._cambio.wait()
+                continue
+            espera = self._heap[0][0] - time.monotonic()
+            if espera > 0:
+                try:
+                    await asyncio.wait_for(self._cambio.wait(), timeout=espera)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, accion, descripcion = heapq.heappop(self._heap)
+            # Cada borrado corre aparte para que uno lento no retrase a los siguientes
+            tarea = asyncio.create_task(self._ejecutar(accion, descripcion))
+            self._en_curso.add(tarea)
+            tarea.add_done_callback(self._terminada)
+
+    def iniciar(self):
+        if self._tarea is None or self._tarea.done():
+            self._tarea = asyncio.create_task(self._bucle())
+
+    async def detener(self):
+        if self._tarea:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+        # Las acciones ya lanzadas terminan antes de cerrar la sesión HTTP (con tope)
+        if self._en_curso:
+            await asyncio.wait(list(self._en_curso), timeout=DISCORD_TIMEOUT_S)
+
+limpieza = ProgramadorLimpieza()
 
 # =========================
-# MODAL PARA 1 MODELO
+# RECORDATORIOS PROACTIVOS
 # =========================
-class LogoutModal1Modelo(ui.Modal):
-    def __init__(self, validacion_msg: str = "", mensaje_rellenar=None):
-        super().__init__(title="LOGOUT - 1 MODELO", timeout=300)
-        self.validacion_msg = validacion_msg
-        self.mensaje_rellenar = mensaje_rellenar  # Referencia del mensaje a eliminar
+# Todos los vencimientos (login faltante, break largo, fin de turno) viven en el
+# heap de un único ProgramadorLimpieza: una tarea para miles de operadores. Nada
+# se cancela; cada recordatorio vuelve a mirar la sesión al vencer y se descarta
+# solo si ya no aplica.
+class Recordatorios:
+    """Avisos por DM (o al canal de logs) cuando vence un plazo de asistencia"""
 
-    modelo_1 = ui.TextInput(
-        label="Modelo",
-        placeholder="Nombre del modelo...",
-        required=True,
-        max_length=100
-    )
-    
-    monto_1 = ui.TextInput(
-        label="Monto Bruto",
-        placeholder="$",
-        required=True,
-        max_length=20
-    )
+    def __init__(self, programador: ProgramadorLimpieza):
+        self.programador = programador
+        self.client: Optional[discord.Client] = None
+        self._planificados = set()
+        self._miembros: Optional[dict] = None
+        self.stats = {"login": 0, "break": 0, "logout": 0, "breaks_cerrados": 0, "logouts_interrumpidos": 0}
 
-    async def on_submit(self, interaction: discord.Interaction):
-        await self._procesar_logout(interaction, [
-            {
-                "numero": 1,
-                "nombre": self.modelo_1.value.strip(),
-                "monto_str": self.monto_1.value
-            }
-        ])
-
-    async def _procesar_logout(self, interaction: discord.Interaction, modelos_raw: list):
-        try:
-            await interaction.response.send_message(
-                "🔴 **Procesando logout y reporte de ventas...** ⏳",
-                ephemeral=True
-            )
-            
-            # Procesar y validar modelos
-            modelos_data = []
-            monto_total_bruto = 0
-            
-            for modelo_raw in modelos_raw:
-                if not modelo_raw["nombre"]:
-                    await interaction.followup.send(
-                        f"❌ **Error**: El nombre del Modelo {modelo_raw['numero']} es obligatorio",
-                        ephemeral=True
+    # --- Miembros del servidor agrupados por persona del roster ---
+    @staticmethod
+    def _persona(clave: str, team: str) -> tuple:
+        # Mismo criterio que !horarios: "mauricio t1" y "mauricio blackteam" son la misma persona
+        return clave.split()[0], team
+
+    def invalidar_miembros(self):
+        self._miembros = None
+
+    def _miembros_de(self, persona: tuple) -> list:
+        if self._miembros is None:
+            self._miembros = {}
+            for guild in self.client.guilds:
+                for miembro in guild.members:
+                    if miembro.bot:
+                        continue
+                    identidad = cache_identidad.resolver(miembro)
+                    if identidad.clave:
+                        self._miembros.setdefault(self._persona(identidad.clave, identidad.team), []).append(miembro)
+        return self._miembros.get(persona, [])
+
+    # --- Planificación ---
+    @staticmethod
+    def _momento_local(fecha: date, hora: str) -> datetime:
+        # Argentina no tiene horario de verano: el desplazamiento de ahora vale para cualquier fecha
+        hora_h, minuto = map(int, hora.split(":"))
+        return datetime.now(TZ_ARGENTINA).replace(
+            year=fecha.year, month=fecha.month, day=fecha.day, hour=hora_h, minute=minuto, second=0, microsecond=0
+        )
+
+    def _programar(self, momento: datetime, accion, descripcion: str):
+        self.programador.programar(max(0.0, momento.timestamp() - time.time()), accion, descripcion)
+
+    def planificar_dia(self, fecha: date):
+        """Arma los plazos de login y de fin de turno de los turnos que empiezan ese día"""
+        roster = roster_actual()
+        ahora = datetime.now(TZ_ARGENTINA)
+        personas = {}
+        for clave in sorted(roster.horarios):
+            personas.setdefault(self._persona(clave, roster.horarios[clave]["team"]), clave)
+        
+        armados = 0
+        for persona, clave in personas.items():
+            for inicio, fin in roster.turnos_del_dia(clave, fecha):
+                llave = (persona, fecha, inicio)
+                if llave in self._planificados:
+                    continue
+                self._planificados.add(llave)
+                comienzo = self._momento_local(fecha, inicio)
+                final = comienzo + timedelta(minutes=_duracion_turno(hora_a_minutos(inicio), fin))
+                plazo_login = comienzo + timedelta(minutes=TOLERANCIA_LOGIN_MIN)
+                plazo_logout = final + timedelta(minutes=TOLERANCIA_LOGOUT_MIN)
+                if plazo_login > ahora:
+                    self._programar(
+                        plazo_login,
+                        lambda p=persona, c=clave, d=fecha, i=inicio: self._revisar_login(p, c, d, i),
+                        f"login {clave}"
                     )
-                    return
-                
-                try:
-                    monto_bruto = float(modelo_raw["monto_str"].replace("$", "").replace(",", "").strip())
-                except ValueError:
-                    await interaction.followup.send(
-                        f"❌ **Error**: El monto del Modelo {modelo_raw['numero']} debe ser un número válido",
-                        ephemeral=True
+                    armados += 1
+                if plazo_logout > ahora:
+                    self._programar(
+                        plazo_logout,
+                        lambda p=persona, c=clave, d=fecha, i=inicio, f=fin: self._revisar_fin_turno(p, c, d, i, f),
+                        f"fin de turno {clave}"
                     )
-                    return
-                
-                monto_neto = monto_bruto * 0.80
-                monto_total_bruto += monto_bruto
-                
-                modelos_data.append({
-                    "numero": modelo_raw["numero"],
-                    "nombre": modelo_raw["nombre"],
-                    "monto_bruto": monto_bruto,
-                    "monto_neto": monto_neto
-                })
-            
-            # Obtener información del usuario
-            usuario_apodo = obtener_nombre_usuario(interaction.user) if hasattr(interaction.user, 'nick') else str(interaction.user)
-            info_usuario = obtener_info_usuario(usuario_apodo)
-            team = info_usuario["team"] if info_usuario else "SIN_EQUIPO"
-            
-            # Actualizar registro
-            success = await actualizar_registro_usuario(
-                interaction.user,
-                "logout",
-                interaction.guild,
-                interaction.channel,
-                modelos_data=modelos_data,
-                validacion_msg=self.validacion_msg
-            )
-            
-            # Crear embed
-            embed = self._crear_embed_confirmacion(
-                interaction, modelos_data, monto_total_bruto, team
-            )
-            
-            # Actualizar mensaje del modal (este)
-            await interaction.edit_original_response(
-                content="✅ **Logout registrado exitosamente** - Revisa tu mensaje privado para más detalles.",
-                embed=None,
-                view=None
-            )
-            
-            # NUEVO: Eliminar mensaje del botón "Rellenar" usando referencia directa
-            if self.mensaje_rellenar:
-                try:
-                    # Pequeño delay para asegurar que el mensaje existe
-                    await asyncio.sleep(0.5)
-                    await self.mensaje_rellenar.delete()
-                    print(f"🗑️ Eliminado mensaje del botón Rellenar (referencia directa)")
-                except discord.NotFound:
-                    print(f"⚠️ Mensaje del botón ya fue eliminado")
-                except Exception as e:
-                    print(f"⚠️ No se pudo eliminar mensaje del botón: {e}")
-            
-            # Enviar DM
-            await self._enviar_dm(interaction, embed, modelos_data, monto_total_bruto, team)
-            
-            # Eliminar mensaje del modal después de 3 segundos
-            await asyncio.sleep(3)
-            try:
-                await interaction.delete_original_response()
-                print(f"🗑️ Eliminado mensaje del modal")
-            except Exception as e:
-                print(f"⚠️ No se pudo eliminar mensaje del modal: {e}")
-            
-            # Log al canal
-            if LOG_CHANNEL_ID:
-                try:
-                    log_channel = interaction.client.get_channel(LOG_CHANNEL_ID)
-                    if log_channel and log_channel != interaction.channel:
-                        await log_channel.send(embed=embed)
-                except Exception as e:
-                    print(f"❌ Error enviando a canal de logs: {e}")
-        
-        except Exception as e:
-            print(f"❌ Error procesando logout: {e}")
-            if not interaction.response.is_done():
-                await interaction.response.send_message(
-                    "❌ Error procesando logout. Inténtalo nuevamente.",
-                    ephemeral=True
-                )
+                    armados += 1
+        log.info("Recordatorios armados para %s: %d", fecha.strftime("%d/%m/%Y"), armados)
 
-    def _crear_embed_confirmacion(self, interaction, modelos_data, monto_total_bruto, team):
-        cantidad = len(modelos_data)
-        monto_total_neto = monto_total_bruto * 0.80
+    def _programar_medianoche(self):
+        manana = datetime.now(TZ_ARGENTINA).date() + timedelta(days=1)
+        self._programar(self._momento_local(manana, "00:00"), self._nuevo_dia, "planificación diaria")
+
+    async def _nuevo_dia(self):
+        hoy = datetime.now(TZ_ARGENTINA).date()
+        # Las llaves de días viejos ya no pueden repetirse
+        self._planificados = {llave for llave in self._planificados if llave[1] >= hoy - timedelta(days=1)}
+        self.invalidar_miembros()
+        self.planificar_dia(hoy)
+        self._programar_medianoche()
+
+    def iniciar(self, client: discord.Client):
+        """Primera planificación (una sola vez aunque on_ready se repita)"""
+        if self.client is not None or not RECORDATORIOS_ACTIVOS:
+            return
+        self.client = client
+        hoy = datetime.now(TZ_ARGENTINA).date()
+        # Los turnos nocturnos de ayer pueden terminar hoy
+        self.planificar_dia(hoy - timedelta(days=1))
+        self.planificar_dia(hoy)
+        self._programar_medianoche()
+        for user_id, sesion in sesiones.abiertas():
+            if sesion.estado == EN_BREAK:
+                self.armar_break(user_id)
+
+    def replanificar(self):
+        """Tras recargar el roster: agrega los turnos nuevos (los viejos se revalidan al vencer)"""
+        if self.client is None:
+            return
+        self.invalidar_miembros()
+        hoy = datetime.now(TZ_ARGENTINA).date()
+        self.planificar_dia(hoy - timedelta(days=1))
+        self.planificar_dia(hoy)
+
+    def armar_break(self, user_id: int, iniciado: Optional[datetime] = None):
+        """Programa el aviso de break largo para el break abierto del usuario.
         
-        embed = Embed(
-            title=f"🔴 Logout y Ventas Registrados {self.validacion_msg}",
-            description=f"**Jornada finalizada - Equipo {team}** ({cantidad} modelo{'s' if cantidad > 1 else ''})",
-            color=discord.Color.orange() if self.validacion_msg else discord.Color.red(),
-            timestamp=datetime.now(timezone.utc)
+        Con `iniciado` solo se arma si el break empezó en ese momento (un segundo
+        clic en Break no reinicia el break ni duplica el aviso).
+        """
+        if self.client is None:
+            return
+        sesion = sesiones.obtener(user_id)
+        if sesion is None or sesion.inicio_break is None:
+            return
+        if iniciado is not None and sesion.inicio_break != iniciado:
+            return
+        inicio_break = sesion.inicio_break
+        self._programar(
+            inicio_break + timedelta(minutes=BREAK_MAX_MIN),
+            lambda: self._revisar_break(user_id, inicio_break),
+            f"break {user_id}"
         )
-        
-        usuario_apodo = obtener_nombre_usuario(interaction.user) if hasattr(interaction.user, 'nick') else str(interaction.user)
-        
-        embed.add_field(name="👤 Usuario", value=interaction.user.mention, inline=True)
-        embed.add_field(name="🏆 Equipo", value=f"`{team}`", inline=True)
-        embed.add_field(name="📱 Cuenta/Usuario", value=f"`{usuario_apodo}`", inline=True)
-        
-        # Agregar información de cada modelo
-        for modelo in modelos_data:
-            embed.add_field(
-                name=f"👩‍💼 Modelo {modelo['numero']}",
-                value=f"`{modelo['nombre']}`\n💵 Bruto: `${modelo['monto_bruto']:,.2f}`\n💰 Neto: `${modelo['monto_neto']:,.2f}`",
-                inline=True
+
+    # --- Avisos ---
+    async def _avisar(self, miembro, texto: str, titulo: str, client: Optional[discord.Client] = None):
+        """DM al miembro; si no se puede (o no hay miembro), al canal de logs"""
+        if miembro is not None:
+            try:
+                await asyncio.wait_for(miembro.send(texto), timeout=DISCORD_TIMEOUT_S)
+                return
+            except (discord.HTTPException, asyncio.TimeoutError) as e:
+                contar_dm_fallido("forbidden" if isinstance(e, discord.Forbidden) else "error")
+                log.debug("No se pudo enviar recordatorio por DM a %s: %r", miembro, e)
+        embed = Embed(title=titulo, description=texto, color=discord.Color.orange(), timestamp=datetime.now(TZ_ARGENTINA))
+        await enviar_a_canal_logs(client or self.client, embed, None)
+
+    @staticmethod
+    def _sigue_vigente(clave: str, fecha: date, inicio: str) -> bool:
+        """El turno planificado sigue en el roster actual (pudo recargarse desde entonces)"""
+        roster = roster_actual()
+        return clave in roster.horarios and any(i == inicio for i, _ in roster.turnos_del_dia(clave, fecha))
+
+    async def _revisar_login(self, persona: tuple, clave: str, fecha: date, inicio: str):
+        if not self._sigue_vigente(clave, fecha, inicio):
+            return
+        miembros = self._miembros_de(persona)
+        if not miembros:
+            self.stats["login"] += 1
+            await self._avisar(
+                None,
+                f"**{clave.title()}** debía entrar a las `{inicio}` y no hay ningún miembro del servidor con ese apodo.",
+                "⏰ Login faltante"
             )
-        
-        # Totales
-        embed.add_field(
-            name="📊 TOTALES",
-            value=f"💵 **Total Bruto**: `${monto_total_bruto:,.2f}`\n💰 **Total Neto**: `${monto_total_neto:,.2f}`",
-            inline=False
+            return
+        for miembro in miembros:
+            if not sesiones.tiene_login(miembro.id):
+                self.stats["login"] += 1
+                await self._avisar(
+                    miembro,
+                    f"⏰ Tu turno empezó a las `{inicio}` y todavía no marcaste **Login**.",
+                    f"⏰ Login faltante - {miembro.display_name}"
+                )
+
+    async def _revisar_break(self, user_id: int, inicio_break: datetime):
+        sesion = sesiones.obtener(user_id)
+        if sesion is None or sesion.estado != EN_BREAK or sesion.inicio_break != inicio_break:
+            return  # Ya volvió del break (o empezó otro)
+        self.stats["break"] += 1
+        miembro = self.client.get_user(user_id)
+        await self._avisar(
+            miembro,
+            f"⏸️ Tu break empezó a las `{inicio_break.strftime('%H:%M')}` y ya superó los {BREAK_MAX_MIN} minutos. "
+            "Marca **Logout Break** al volver.",
+            f"⏸️ Break largo - {getattr(miembro, 'display_name', user_id)}"
         )
-        
-        embed.add_field(name="⏰ Fecha/Hora (Argentina)", value=f"`{datetime.now(TZ_ARGENTINA).strftime('%d/%m/%Y %H:%M:%S')}`", inline=False)
-        
-        if self.validacion_msg:
-            embed.add_field(name="⚠️ Observación", value=f"`{self.validacion_msg}`", inline=False)
-        
-        embed.set_footer(text=f"✅ Logout registrado en Hoja {team}")
-        return embed
 
-    async def _enviar_dm(self, interaction, embed, modelos_data, monto_total_bruto, team):
-        cantidad = len(modelos_data)
-        try:
-            dm_message = f"🔴 **Logout registrado exitosamente - Equipo {team}** ({cantidad} modelo{'s' if cantidad > 1 else ''})"
-            await interaction.user.send(content=dm_message, embed=embed)
-        except discord.Forbidden:
-            resumen = f"🔴 **Logout registrado exitosamente**\n🏆 **Equipo**: {team}\n"
-            for modelo in modelos_data:
-                resumen += f"👩‍💼 **Modelo {modelo['numero']}**: {modelo['nombre']} (${modelo['monto_bruto']:,.2f})\n"
-            resumen += f"💵 **Total**: ${monto_total_bruto:,.2f}\n💡 **Tip**: Activa los mensajes directos para recibir reportes completos."
-            
-            await interaction.followup.send(
-                content=resumen,
-                ephemeral=True
+    async def _revisar_fin_turno(self, persona: tuple, clave: str, fecha: date, inicio: str, fin: str):
+        if not self._sigue_vigente(clave, fecha, inicio):
+            return
+        for miembro in self._miembros_de(persona):
+            sesion = sesiones.obtener(miembro.id)
+            if sesion is None:
+                continue
+            if sesion.estado == EN_BREAK:
+                await self._cerrar_break(miembro)
+            self.stats["logout"] += 1
+            await self._avisar(
+                miembro,
+                f"🔴 Tu turno terminó a las `{fin}` y no marcaste **Logout**. Recuerda cargar tus ventas.",
+                f"🔴 Logout faltante - {miembro.display_name}"
+            )
+
+    async def avisar_logouts_interrumpidos(self, client: discord.Client):
+        """Tras un reinicio: avisa a quien tenía el logout a medio cargar (aunque los recordatorios estén apagados)"""
+        for user_id, momento in sesiones.tomar_logouts_pendientes():
+            self.stats["logouts_interrumpidos"] += 1
+            miembro = client.get_user(user_id)
+            log.warning("Logout interrumpido por un reinicio (selector abierto a las %s)", momento.strftime("%H:%M"), extra={"user_id": user_id, "action": "logout"})
+            await self._avisar(
+                miembro,
+                f"🔴 El bot se reinició mientras cargabas tu **Logout** (abierto a las `{momento.strftime('%H:%M')}`). "
+                "No quedó registrado: vuelve a tocar **Logout** en el panel.",
+                f"🔴 Logout interrumpido - {getattr(miembro, 'display_name', user_id)}",
+                client
+            )
+
+    async def _cerrar_break(self, miembro: discord.Member):
+        """Cierra un break abandonado al terminar el turno y lo registra como Logout Break"""
+        async with carriles.reservar(miembro.id):
+            identidad = cache_identidad.resolver(miembro)
+            hora_actual = datetime.now(TZ_ARGENTINA)
+            marcas = sesiones.transicion(miembro.id, "logout_break", hora_actual, identidad.horario_en(hora_actual))
+            validacion_msg = " ".join(m for m in ("- BREAK CERRADO AUTOMÁTICAMENTE", marcas) if m)
+            await actualizar_registro_usuario(
+                miembro, "logout_break", miembro.guild, None, validacion_msg=validacion_msg, identidad=identidad
             )
+        self.stats["breaks_cerrados"] += 1
+        log.info("Break abandonado cerrado al fin del turno", extra={"user_id": miembro.id, "action": "logout_break"})
+
+agenda = ProgramadorLimpieza("recordatorio")
+recordatorios = Recordatorios(agenda)
 
 # =========================
-# MODAL PARA 2 MODELOS
+# CARRILES POR USUARIO
 # =========================
-class LogoutModal2Modelos(LogoutModal1Modelo):
-    def __init__(self, validacion_msg: str = "", mensaje_rellenar=None):
-        super().__init__(validacion_msg, mensaje_rellenar)
-        self.title = "LOGOUT - 2 MODELOS"
-
-    # Campos adicionales para modelo 2
-    modelo_2 = ui.TextInput(
-        label="Modelo 2",
-        placeholder="Nombre del modelo 2...",
-        required=True,
-        max_length=100
-    )
+class TurnoCarril:
+    """Lugar reservado en el carril de un usuario"""
+    __slots__ = ("carriles", "user_id", "anterior", "propio", "abortado")
+
+    def __init__(self, carriles: "CarrilesUsuario", user_id: int, anterior: Optional[asyncio.Future], propio: asyncio.Future):
+        self.carriles = carriles
+        self.user_id = user_id
+        self.anterior = anterior
+        self.propio = propio
+        self.abortado = False
+
+    async def __aenter__(self):
+        if self.anterior is not None and not self.anterior.done():
+            self.carriles.stats["esperas"] += 1
+            with tramo("carril"):
+                try:
+                    await asyncio.wait_for(asyncio.shield(self.anterior), timeout=DISCORD_TIMEOUT_S)
+                except asyncio.TimeoutError:
+                    # Procesarlo igual lo adelantaría a un evento anterior (un logout antes
+                    # que su login): se aborta y el usuario lo reintenta
+                    self.abortado = True
+                    self.carriles.stats["abortados"] += 1
+                    log.error("Carril del usuario %s trabado: evento abortado para no romper el orden", self.user_id, extra={"user_id": self.user_id})
+                    raise RuntimeError("Carril trabado por un evento anterior") from None
+        return self
+
+    async def __aexit__(self, *exc):
+        self.liberar()
+
+    def liberar(self):
+        """Deja pasar al siguiente evento del usuario (se puede llamar más de una vez).
+        
+        Un turno abortado no adelanta a nadie: libera su lugar cuando termina el anterior.
+        """
+        if self.abortado and not self.anterior.done():
+            self.anterior.add_done_callback(lambda _: self._completar())
+        else:
+            self._completar()
+
+    def _completar(self):
+        if not self.propio.done():
+            self.propio.set_result(None)
+        if self.carriles._ultimo.get(self.user_id) is self.propio:
+            # Nadie espera detrás: el carril queda inactivo y se descarta
+            del self.carriles._ultimo[self.user_id]
+
+class CarrilesUsuario:
+    """Ejecuta los eventos de cada usuario en orden de llegada; usuarios distintos van en paralelo.
     
-    monto_2 = ui.TextInput(
-        label="Monto Bruto 2",
-        placeholder="$",
-        required=True,
-        max_length=20
-    )
+    Un carril es solo una cadena de futuros por user.id: se crea con el primer clic
+    y desaparece cuando el último evento lo libera, sin tareas ni colas fijas.
+    """
 
-    async def on_submit(self, interaction: discord.Interaction):
-        await self._procesar_logout(interaction, [
-            {
-                "numero": 1,
-                "nombre": self.modelo_1.value.strip(),
-                "monto_str": self.monto_1.value
-            },
-            {
-                "numero": 2,
-                "nombre": self.modelo_2.value.strip(),
-                "monto_str": self.monto_2.value
-            }
-        ])
+    def __init__(self):
+        self._ultimo = {}
+        self.stats = {"esperas": 0, "abortados": 0}
+
+    def reservar(self, user_id: int) -> TurnoCarril:
+        """Toma el lugar en el carril en el momento del clic (sin await, conserva el orden)"""
+        anterior = self._ultimo.get(user_id)
+        propio = asyncio.get_running_loop().create_future()
+        self._ultimo[user_id] = propio
+        return TurnoCarril(self, user_id, anterior, propio)
+
+    def activos(self) -> int:
+        return len(self._ultimo)
+
+carriles = CarrilesUsuario()
 
 # =========================
-# MODAL PARA 3 MODELOS - CAMPOS SEPARADOS (OPTIMIZADO)
+# EFECTOS SECUNDARIOS EN PARALELO
 # =========================
-class LogoutModal3Modelos(ui.Modal):
-    def __init__(self, validacion_msg: str = "", mensaje_rellenar=None):
-        super().__init__(title="LOGOUT - 3 MODELOS", timeout=300)
-        self.validacion_msg = validacion_msg
-        self.mensaje_rellenar = mensaje_rellenar
-
-    # Modelo 1
-    modelo_1 = ui.TextInput(
-        label="Modelo 1",
-        placeholder="Nombre del modelo 1...",
-        required=True,
-        max_length=100
-    )
-    
-    # Modelo 2
-    modelo_2 = ui.TextInput(
-        label="Modelo 2",
-        placeholder="Nombre del modelo 2...",
-        required=True,
-        max_length=100
-    )
+async def ejecutar_aislado(coro, timeout: float, etapa: str) -> tuple:
+    """Ejecuta un efecto secundario con su propio timeout. Devuelve (ok, resultado_o_error) sin propagar"""
+    try:
+        with tramo(etapa):
+            return True, await asyncio.wait_for(coro, timeout=timeout)
+    except Exception as e:
+        if etapa == "dm":
+            contar_dm_fallido("forbidden" if isinstance(e, discord.Forbidden) else "error")
+        if not isinstance(e, discord.Forbidden):
+            log.warning("Falló la etapa %s: %r", etapa, e)
+        return False, e
+
+async def enviar_a_canal_logs(client: discord.Client, embed: Embed, canal_origen) -> bool:
+    """Publica el embed en el canal de logs (si está configurado y no es el canal de origen)"""
+    if not LOG_CHANNEL_ID:
+        return False
+    log_channel = client.get_channel(LOG_CHANNEL_ID)
+    if not log_channel or log_channel == canal_origen:
+        return False
+    await log_channel.send(embed=embed)
+    return True
+
+# =========================
+# LOGOUT: SELECTOR + FORMULARIO ÚNICO
+# =========================
+# Llamadas REST a Discord por logout (flujo completo, sin errores):
+#   1. Botón Logout      → respuesta efímera con el selector de cantidad
+#   2. Selector          → abre el formulario con N modelos
+#   3. Envío formulario  → edita el mensaje efímero a "procesando"
+#   4. DM al usuario     (+1 la primera vez, para abrir el canal privado)
+#   5. Canal de logs
+#   6. Edición final del mensaje efímero con el resultado
+#   7. Borrado diferido del mensaje efímero (en segundo plano)
+# El flujo anterior (selector → mensaje público "Rellenar" → formulario) hacía 9-10.
+LOGOUT_MAX_MODELOS = 3
+MAX_CAMPOS_MODAL = 5  # Límite de Discord por formulario
+
+def parsear_monto(texto: str) -> float:
+    """Convierte "$1,500.50" en 1500.5 (lanza ValueError si no es un número)"""
+    return float(texto.replace("$", "").replace(",", "").strip())
+
+def parsear_modelos(nombres: list, montos: list) -> tuple:
+    """Valida nombres y montos de N modelos. Devuelve (modelos_data, monto_total_bruto).
     
-    # Modelo 3
-    modelo_3 = ui.TextInput(
-        label="Modelo 3",
-        placeholder="Nombre del modelo 3...",
-        required=True,
-        max_length=100
-    )
+    Lanza ValueError con el mensaje a mostrar al usuario.
+    """
+    if len(montos) != len(nombres):
+        raise ValueError(
+            f"Debes proporcionar exactamente {len(nombres)} montos separados por comas\n"
+            "**Ejemplo**: 500, 300, 400"
+        )
     
-    # Montos de los 3 modelos en un solo campo (separados por comas)
-    montos_todos = ui.TextInput(
-        label="Montos (separados por comas)",
-        placeholder="Ejemplo: 500, 300, 400",
-        required=True,
-        max_length=100
+    modelos_data = []
+    monto_total_bruto = 0
+    for numero, (nombre, monto_str) in enumerate(zip(nombres, montos), start=1):
+        nombre = nombre.strip()
+        if not nombre:
+            raise ValueError(f"El nombre del Modelo {numero} es obligatorio")
+        try:
+            monto_bruto = parsear_monto(monto_str)
+        except ValueError:
+            raise ValueError(
+                f"El monto del Modelo {numero} debe ser un número válido\n"
+                f"Valor recibido: '{monto_str.strip()}'"
+            )
+        
+        monto_total_bruto += monto_bruto
+        modelos_data.append({
+            "numero": numero,
+            "nombre": nombre,
+            "monto_bruto": monto_bruto,
+            "monto_neto": monto_bruto * 0.80
+        })
+    return modelos_data, monto_total_bruto
+
+class LogoutCantidadView(ui.View):
+    """Mensaje efímero con el selector de cantidad de modelos (abre el formulario directo)"""
+
+    def __init__(self, validacion_msg: str = "", identidad: Optional[IdentidadUsuario] = None, hora_validacion: Optional[datetime] = None):
+        super().__init__(timeout=300)
+        self.validacion_msg = validacion_msg
+        self.identidad = identidad
+        self.hora_validacion = hora_validacion
+
+    @ui.select(
+        placeholder="¿Cuántos modelos trabajaste?",
+        options=[
+            discord.SelectOption(label=f"{n} modelo{'s' if n > 1 else ''}", value=str(n), emoji="👩‍💼")
+            for n in range(1, LOGOUT_MAX_MODELOS + 1)
+        ]
     )
+    async def seleccionar_cantidad(self, interaction: discord.Interaction, select: ui.Select):
+        inicio = time.perf_counter()
+        try:
+            cantidad = int(select.values[0])
+            with Traza("boton.logout_cantidad", user_id=interaction.user.id, action="logout", modelos=cantidad):
+                with tramo("ack"):
+                    await interaction.response.send_modal(LogoutModal(cantidad, self.validacion_msg, self.identidad, self.hora_validacion))
+            metricas.ack.observar(time.perf_counter() - inicio, "logout_cantidad")
+        except Exception:
+            log.exception("Error abriendo formulario de logout")
+            if not interaction.response.is_done():
+                await interaction.response.send_message(
+                    "❌ Error abriendo formulario. Inténtalo nuevamente.",
+                    ephemeral=True
+                )
+
+class LogoutModal(ui.Modal):
+    """Formulario de logout para N modelos.
     
+    Si los campos de nombre y monto entran en el formulario (máx. 5) se pide un
+    monto por modelo; si no, un único campo con los montos separados por comas.
+    """
 
-    async def on_submit(self, interaction: discord.Interaction):
-        await self._procesar_logout(interaction)
+    def __init__(
+        self, cantidad: int, validacion_msg: str = "", identidad: Optional[IdentidadUsuario] = None,
+        hora_validacion: Optional[datetime] = None
+    ):
+        plural = "S" if cantidad > 1 else ""
+        super().__init__(title=f"LOGOUT - {cantidad} MODELO{plural}", timeout=300)
+        self.cantidad = cantidad
+        self.validacion_msg = validacion_msg
+        # Identidad y hora de la validación del botón: el logout usa esa versión del
+        # roster y el reproceso recalcula la marca de horario con esa hora
+        self.identidad = identidad
+        self.hora_validacion = hora_validacion
+        
+        self.campos_nombre = []
+        for i in range(1, cantidad + 1):
+            campo = ui.TextInput(
+                label="Modelo" if cantidad == 1 else f"Modelo {i}",
+                placeholder="Nombre del modelo..." if cantidad == 1 else f"Nombre del modelo {i}...",
+                required=True,
+                max_length=100
+            )
+            self.campos_nombre.append(campo)
+            self.add_item(campo)
+        
+        self.campos_monto = []
+        self.campo_montos_juntos = None
+        if cantidad * 2 <= MAX_CAMPOS_MODAL:
+            for i in range(1, cantidad + 1):
+                campo = ui.TextInput(
+                    label="Monto Bruto" if cantidad == 1 else f"Monto Bruto {i}",
+                    placeholder="$",
+                    required=True,
+                    max_length=20
+                )
+                self.campos_monto.append(campo)
+                self.add_item(campo)
+        else:
+            self.campo_montos_juntos = ui.TextInput(
+                label="Montos (separados por comas)",
+                placeholder="Ejemplo: " + ", ".join(str(500 - 100 * i) for i in range(cantidad)),
+                required=True,
+                max_length=100
+            )
+            self.add_item(self.campo_montos_juntos)
+
+    def _montos(self) -> list:
+        if self.campo_montos_juntos is not None:
+            return self.campo_montos_juntos.value.split(",")
+        return [campo.value for campo in self.campos_monto]
 
-    async def _procesar_logout(self, interaction: discord.Interaction):
+    async def on_submit(self, interaction: discord.Interaction):
+        inicio = time.perf_counter()
+        turno = carriles.reservar(interaction.user.id)
+        traza = Traza("boton.logout_formulario", user_id=interaction.user.id, action="logout", modelos=self.cantidad).iniciar()
         try:
-            await interaction.response.send_message(
-                "🔴 **Procesando logout y reporte de ventas...** ⏳",
-                ephemeral=True
-            )
-            
-            # Obtener nombres de modelos
-            nombres = [
-                self.modelo_1.value.strip(),
-                self.modelo_2.value.strip(), 
-                self.modelo_3.value.strip()
-            ]
-            
-            # Validar que todos los nombres estén completos
-            for i, nombre in enumerate(nombres):
-                if not nombre:
-                    await interaction.followup.send(
-                        f"❌ **Error**: El nombre del Modelo {i+1} es obligatorio",
-                        ephemeral=True
-                    )
-                    return
-            
-            # Parsear montos separados por comas
-            montos_str = self.montos_todos.value.strip()
+            nombres = [campo.value for campo in self.campos_nombre]
             try:
-                montos_partes = [monto.strip().replace("$", "").replace(",", "") for monto in montos_str.split(",")]
-                
-                if len(montos_partes) != 3:
-                    await interaction.followup.send(
-                        "❌ **Error**: Debes proporcionar exactamente 3 montos separados por comas\n"
-                        "**Ejemplo**: 500, 300, 400",
-                        ephemeral=True
-                    )
-                    return
-                
-                montos = []
-                for i, monto_str in enumerate(montos_partes):
-                    try:
-                        monto = float(monto_str)
-                        montos.append(monto)
-                    except ValueError:
-                        await interaction.followup.send(
-                            f"❌ **Error**: El monto {i+1} debe ser un número válido\n"
-                            f"Valor recibido: '{monto_str}'",
-                            ephemeral=True
-                        )
-                        return
-                        
-            except Exception as e:
-                await interaction.followup.send(
-                    "❌ **Error**: Formato de montos incorrecto\n"
-                    "**Formato esperado**: monto1, monto2, monto3\n"
-                    "**Ejemplo**: 500, 300, 400",
-                    ephemeral=True
+                modelos_data, monto_total_bruto = parsear_modelos(nombres, self._montos())
+            except ValueError as e:
+                # Mostrar el error en el mismo mensaje y permitir elegir de nuevo
+                await interaction.response.edit_message(
+                    content=f"❌ **Error**: {e}",
+                    view=LogoutCantidadView(self.validacion_msg, self.identidad, self.hora_validacion)
                 )
                 return
             
-            # Procesar y validar modelos
-            modelos_data = []
-            monto_total_bruto = 0
-            
-            for i in range(3):
-                nombre = nombres[i]
-                monto_bruto = montos[i]
-                monto_neto = monto_bruto * 0.80
-                monto_total_bruto += monto_bruto
-                
-                modelos_data.append({
-                    "numero": i + 1,
-                    "nombre": nombre,
-                    "monto_bruto": monto_bruto,
-                    "monto_neto": monto_neto
-                })
-            
-            # Obtener información del usuario
-            usuario_apodo = obtener_nombre_usuario(interaction.user) if hasattr(interaction.user, 'nick') else str(interaction.user)
-            info_usuario = obtener_info_usuario(usuario_apodo)
-            team = info_usuario["team"] if info_usuario else "SIN_EQUIPO"
-            
-            # Actualizar registro
-            success = await actualizar_registro_usuario(
-                interaction.user,
-                "logout",
-                interaction.guild,
-                interaction.channel,
-                modelos_data=modelos_data,
-                validacion_msg=self.validacion_msg
-            )
+            with tramo("ack"):
+                await interaction.response.edit_message(
+                    content="🔴 **Procesando logout y reporte de ventas...** ⏳",
+                    view=None
+                )
+            metricas.ack.observar(time.perf_counter() - inicio, "logout_formulario")
             
-            # Crear embed
-            embed = self._crear_embed_confirmacion(
-                interaction, modelos_data, monto_total_bruto, team
-            )
+            identidad = self.identidad or cache_identidad.resolver(interaction.user)
+            team = identidad.team
             
-            # Actualizar mensaje del modal
-            await interaction.edit_original_response(
-                content="✅ **Logout registrado exitosamente** - Revisa tu mensaje privado para más detalles.",
-                embed=None,
-                view=None
-            )
+            async with turno:
+                with tramo("validacion"):
+                    hora_actual = datetime.now(TZ_ARGENTINA)
+                    marcas = sesiones.transicion(interaction.user.id, "logout", hora_actual, identidad.horario_en(hora_actual))
+                    if marcas:
+                        self.validacion_msg = " ".join(m for m in (self.validacion_msg, marcas) if m)
+                with tramo("outbox"):
+                    evento_id = await actualizar_registro_usuario(
+                        interaction.user,
+                        "logout",
+                        interaction.guild,
+                        interaction.channel,
+                        modelos_data=modelos_data,
+                        validacion_msg=self.validacion_msg,
+                        identidad=identidad,
+                        momento=hora_actual,
+                        hora_validacion=self.hora_validacion
+                    )
             
-            # Eliminar mensaje del botón "Rellenar" si existe
-            if self.mensaje_rellenar:
-                try:
-                    await asyncio.sleep(0.5)
-                    await self.mensaje_rellenar.delete()
-                    print(f"🗑️ Eliminado mensaje del botón Rellenar")
-                except discord.NotFound:
-                    print(f"⚠️ Mensaje del botón ya fue eliminado")
-                except Exception as e:
-                    print(f"⚠️ No se pudo eliminar mensaje del botón: {e}")
+            embed = self._crear_embed_confirmacion(interaction, modelos_data, monto_total_bruto, team)
+            if evento_id is None:
+                marcar_sin_guardar(embed)
+            cantidad = len(modelos_data)
+            dm_message = f"🔴 **Logout registrado - Equipo {team}** ({cantidad} modelo{'s' if cantidad > 1 else ''})"
             
-            # Enviar DM
-            await self._enviar_dm(interaction, embed, modelos_data, monto_total_bruto, team)
+            # Sheets, DM y canal de logs en paralelo
+            # El canal de logs se publica aunque el evento no se haya guardado: es su única constancia
+            (sheets_ok, resultado_sheets), (dm_ok, _), _ = await asyncio.gather(
+                ejecutar_aislado(esperar_registro_sheets(evento_id), SHEETS_CONFIRMACION_S + 1, "sheets"),
+                ejecutar_aislado(interaction.user.send(content=dm_message, embed=embed), DISCORD_TIMEOUT_S, "dm"),
+                ejecutar_aislado(
+                    enviar_a_canal_logs(interaction.client, embed, interaction.channel),
+                    DISCORD_TIMEOUT_S, "canal_logs"
+                ),
+            )
+            estado, error = resultado_sheets if sheets_ok else ("pendiente", "")
             
-            # Eliminar mensaje del modal después de 3 segundos
-            await asyncio.sleep(3)
-            try:
-                await interaction.delete_original_response()
-                print(f"🗑️ Eliminado mensaje del modal")
-            except Exception as e:
-                print(f"⚠️ No se pudo eliminar mensaje del modal: {e}")
+            respuesta = f"🔴 **Logout** {texto_estado_sheets(estado, error)}"
+            if dm_ok:
+                respuesta += " Revisa tu mensaje privado para más detalles."
+            else:
+                respuesta += "\n" + self._resumen_texto(modelos_data, monto_total_bruto, team)
+            with tramo("respuesta"):
+                await interaction.edit_original_response(content=respuesta)
+            limpieza.programar(LIMPIEZA_RESPUESTA_S, interaction.delete_original_response, "respuesta de logout")
+            traza.raiz.atributos.update(sheets=estado, validacion=self.validacion_msg)
             
-            # Log al canal
-            if LOG_CHANNEL_ID:
-                try:
-                    log_channel = interaction.client.get_channel(LOG_CHANNEL_ID)
-                    if log_channel and log_channel != interaction.channel:
-                        await log_channel.send(embed=embed)
-                except Exception as e:
-                    print(f"❌ Error enviando a canal de logs: {e}")
+            log.info(
+                "Logout registrado (%s) %s", estado, self.validacion_msg,
+                extra={
+                    "user_id": interaction.user.id,
+                    "usuario": identidad.nombre,
+                    "action": "logout",
+                    "team": team,
+                    "latencia_ms": round((time.perf_counter() - inicio) * 1000, 1)
+                }
+            )
         
         except Exception as e:
-            print(f"❌ Error procesando logout: {e}")
-            if not interaction.response.is_done():
-                await interaction.response.send_message(
-                    "❌ Error procesando logout. Inténtalo nuevamente.",
-                    ephemeral=True
-                )
+            log.exception("Error procesando logout", extra={"user_id": interaction.user.id, "action": "logout"})
+            traza.raiz.atributos["error"] = repr(e)
+            try:
+                if not interaction.response.is_done():
+                    await interaction.response.send_message(
+                        "❌ Error procesando logout. Inténtalo nuevamente.",
+                        ephemeral=True
+                    )
+                else:
+                    await interaction.edit_original_response(content="❌ Error procesando logout. Inténtalo nuevamente.")
+            except discord.HTTPException:
+                pass
+        finally:
+            turno.liberar()
+            traza.cerrar()
 
     def _crear_embed_confirmacion(self, interaction, modelos_data, monto_total_bruto, team):
         cantidad = len(modelos_data)
@@ -1137,12 +3883,12 @@ class LogoutModal3Modelos(ui.Modal):
         
         embed = Embed(
             title=f"🔴 Logout y Ventas Registrados {self.validacion_msg}",
-            description=f"**Jornada finalizada - Equipo {team}** ({cantidad} modelos)",
+            description=f"**Jornada finalizada - Equipo {team}** ({cantidad} modelo{'s' if cantidad > 1 else ''})",
             color=discord.Color.orange() if self.validacion_msg else discord.Color.red(),
             timestamp=datetime.now(timezone.utc)
         )
         
-        usuario_apodo = obtener_nombre_usuario(interaction.user) if hasattr(interaction.user, 'nick') else str(interaction.user)
+        usuario_apodo = cache_identidad.resolver(interaction.user).nombre
         
         embed.add_field(name="👤 Usuario", value=interaction.user.mention, inline=True)
         embed.add_field(name="🏆 Equipo", value=f"`{team}`", inline=True)
@@ -1171,22 +3917,439 @@ class LogoutModal3Modelos(ui.Modal):
         embed.set_footer(text=f"✅ Logout registrado en Hoja {team}")
         return embed
 
-    async def _enviar_dm(self, interaction, embed, modelos_data, monto_total_bruto, team):
-        cantidad = len(modelos_data)
+    def _resumen_texto(self, modelos_data, monto_total_bruto, team) -> str:
+        """Resumen en texto cuando el usuario tiene los DMs cerrados"""
+        resumen = f"🏆 **Equipo**: {team}\n"
+        for modelo in modelos_data:
+            resumen += f"👩‍💼 **Modelo {modelo['numero']}**: {modelo['nombre']} (${modelo['monto_bruto']:,.2f})\n"
+        resumen += f"💵 **Total**: ${monto_total_bruto:,.2f}\n💡 **Tip**: Activa los mensajes directos para recibir reportes completos."
+        return resumen
+
+# =========================
+# PANEL DE ASISTENCIA PERMANENTE
+# =========================
+class PanelAsistenciaPermanente(ui.View):
+    def __init__(self):
+        super().__init__(timeout=None)
+
+    async def _handle_simple_event(self, interaction: discord.Interaction, action: str, emoji: str, event_name: str):
+        """Maneja eventos simples con validaciones de horario"""
+        user = interaction.user
+        channel = interaction.channel
+        inicio = time.perf_counter()
+        # El orden del carril es el orden de los clics, no el de los acuses
+        turno = carriles.reservar(user.id)
+        traza = Traza(f"boton.{action}", user_id=user.id, action=action).iniciar()
+        
+        try:
+            # 1) Acuse inmediato: todo lo demás se informa editando este mensaje
+            with tramo("ack"):
+                await interaction.response.send_message(
+                    f"{emoji} **{event_name}** procesando...",
+                    ephemeral=True
+                )
+            metricas.ack.observar(time.perf_counter() - inicio, action)
+            
+            # 2) Estado local y commit en el outbox, en orden respecto a los clics anteriores
+            async with turno:
+                with tramo("validacion"):
+                    # Obtener nombre del usuario
+                    identidad = cache_identidad.resolver(user)
+                    usuario_nombre = identidad.nombre
+                    hora_actual = datetime.now(TZ_ARGENTINA)
+                    validacion_msg = ""
+                    
+                    horario = identidad.horario_en(hora_actual)
+                    
+                    # Validar según el tipo de evento
+                    if action == "login":
+                        _, validacion_msg = validar_login(usuario_nombre, hora_actual, horario)
+                    
+                    # Estado de la sesión: orden de los clics y duración del break
+                    marcas = sesiones.transicion(user.id, action, hora_actual, horario)
+                    validacion_msg = " ".join(m for m in (validacion_msg, marcas) if m)
+                    if action == "break":
+                        recordatorios.armar_break(user.id, hora_actual)
+                
+                with tramo("outbox"):
+                    evento_id = await actualizar_registro_usuario(
+                        user, action, interaction.guild, channel, validacion_msg=validacion_msg, identidad=identidad,
+                        momento=hora_actual
+                    )
+            
+            embed = build_embed(user, event_name, channel, validacion_msg)
+            if evento_id is None:
+                marcar_sin_guardar(embed)
+            dm_message = f"{emoji} **{event_name}** registrado."
+            if validacion_msg:
+                dm_message += f" {validacion_msg}"
+            
+            # 3) Sheets, DM y canal de logs en paralelo, cada uno con su timeout
+            # El canal de logs se publica aunque el evento no se haya guardado: es su única constancia
+            (sheets_ok, resultado_sheets), (dm_ok, resultado_dm), _ = await asyncio.gather(
+                ejecutar_aislado(esperar_registro_sheets(evento_id), SHEETS_CONFIRMACION_S + 1, "sheets"),
+                ejecutar_aislado(user.send(content=dm_message, embed=embed), DISCORD_TIMEOUT_S, "dm"),
+                ejecutar_aislado(enviar_a_canal_logs(interaction.client, embed, channel), DISCORD_TIMEOUT_S, "canal_logs"),
+            )
+            estado, error = resultado_sheets if sheets_ok else ("pendiente", "")
+            
+            # 4) Resultado final en el mensaje efímero original
+            respuesta = f"{emoji} **{event_name}** {texto_estado_sheets(estado, error)}"
+            if validacion_msg:
+                respuesta += f" {validacion_msg}"
+            if not dm_ok:
+                if isinstance(resultado_dm, discord.Forbidden):
+                    respuesta += "\n💡 Activa los DMs para confirmaciones privadas."
+                else:
+                    respuesta += "\n⚠️ No se pudo enviar la confirmación por DM."
+            with tramo("respuesta"):
+                await interaction.edit_original_response(content=respuesta)
+            limpieza.programar(LIMPIEZA_RESPUESTA_S, interaction.delete_original_response, f"respuesta {event_name}")
+            traza.raiz.atributos.update(sheets=estado, validacion=validacion_msg)
+            
+            log.info(
+                "%s registrado (%s) %s", event_name, estado, validacion_msg,
+                extra={
+                    "user_id": user.id,
+                    "usuario": usuario_nombre,
+                    "action": action,
+                    "team": identidad.team,
+                    "latencia_ms": round((time.perf_counter() - inicio) * 1000, 1)
+                }
+            )
+                    
+        except Exception as e:
+            log.exception("Error en botón %s", event_name, extra={"user_id": user.id, "action": action})
+            traza.raiz.atributos["error"] = repr(e)
+            error_msg = f"❌ Error procesando **{event_name}**. Inténtalo nuevamente."
+            try:
+                if not interaction.response.is_done():
+                    await interaction.response.send_message(error_msg, ephemeral=True, delete_after=5)
+                else:
+                    await interaction.edit_original_response(content=error_msg)
+            except discord.HTTPException:
+                pass
+        finally:
+            turno.liberar()
+            traza.cerrar()
+
+    @ui.button(
+        label="🟢 Login", 
+        style=ButtonStyle.success, 
+        custom_id="attendance_login",
+        row=0
+    )
+    async def btn_login(self, interaction: discord.Interaction, button: ui.Button):
+        await self._handle_simple_event(interaction, "login", "🟢", "Login")
+
+    @ui.button(
+        label="⏸️ Break", 
+        style=ButtonStyle.primary, 
+        custom_id="attendance_break",
+        row=0
+    )
+    async def btn_break(self, interaction: discord.Interaction, button: ui.Button):
+        await self._handle_simple_event(interaction, "break", "⏸️", "Break")
+
+    @ui.button(
+        label="▶️ Logout Break", 
+        style=ButtonStyle.secondary, 
+        custom_id="attendance_logout_break",
+        row=0
+    )
+    async def btn_logout_break(self, interaction: discord.Interaction, button: ui.Button):
+        await self._handle_simple_event(interaction, "logout_break", "▶️", "Logout Break")
+
+    @ui.button(
+        label="🔴 Logout", 
+        style=ButtonStyle.danger, 
+        custom_id="attendance_logout",
+        row=0
+    )
+    async def btn_logout(self, interaction: discord.Interaction, button: ui.Button):
+        """Logout: selector de cantidad efímero que abre directamente el formulario"""
+        inicio = time.perf_counter()
+        # La sesión se lee en el carril: un login clicado justo antes ya quedó aplicado
+        turno = carriles.reservar(interaction.user.id)
         try:
-            dm_message = f"🔴 **Logout registrado exitosamente - Equipo {team}** ({cantidad} modelos)"
-            await interaction.user.send(content=dm_message, embed=embed)
-        except discord.Forbidden:
-            resumen = f"🔴 **Logout registrado exitosamente**\n🏆 **Equipo**: {team}\n"
-            for modelo in modelos_data:
-                resumen += f"👩‍💼 **Modelo {modelo['numero']}**: {modelo['nombre']} (${modelo['monto_bruto']:,.2f})\n"
-            resumen += f"💵 **Total**: ${monto_total_bruto:,.2f}\n💡 **Tip**: Activa los mensajes directos para recibir reportes completos."
+            with Traza("boton.logout", user_id=interaction.user.id, action="logout"):
+                async with turno:
+                    with tramo("validacion"):
+                        identidad = cache_identidad.resolver(interaction.user)
+                        hora_actual = datetime.now(TZ_ARGENTINA)
+                        
+                        _, validacion_msg = validar_logout(
+                            identidad.nombre, hora_actual, sesiones.tiene_login(interaction.user.id), identidad.horario_en(hora_actual)
+                        )
+                        sesiones.marcar_logout_pendiente(interaction.user.id, hora_actual)
+                
+                with tramo("ack"):
+                    await interaction.response.send_message(
+                        "🔴 **Logout** - Selecciona cuántos modelos trabajaste:",
+                        view=LogoutCantidadView(validacion_msg, identidad, hora_actual),
+                        ephemeral=True
+                    )
+            metricas.ack.observar(time.perf_counter() - inicio, "logout")
             
-            await interaction.followup.send(
-                content=resumen,
-                ephemeral=True
+        except Exception:
+            log.exception("Error en botón logout", extra={"user_id": interaction.user.id, "action": "logout"})
+            if not interaction.response.is_done():
+                await interaction.response.send_message(
+                    "❌ Error abriendo formulario de logout. Inténtalo nuevamente.",
+                    ephemeral=True,
+                    delete_after=5
+                )
+        finally:
+            turno.liberar()
+
+# =========================
+# SERVIDOR DE MÉTRICAS (PORT)
+# =========================
+class MonitorLoop:
+    """Retraso del event loop y detector de llamadas bloqueantes.
+    
+    Una tarea duerme intervalos cortos y mide cuánto se pasa de cada uno (retraso).
+    Un hilo aparte vigila que esa tarea siga latiendo: si el loop no vuelve en más
+    de umbral_s es que algo lo bloquea en ese momento, y el hilo vuelca al log la
+    pila del hilo del loop (sys._current_frames), es decir, la llamada culpable.
+    Se vuelca una vez por bloqueo.
+    """
+
+    def __init__(self, intervalo_s: float = 0.5, umbral_s: float = 0.5, ventana_s: float = 60.0):
+        self.intervalo_s = intervalo_s
+        self.umbral_s = umbral_s
+        self.ventana_s = ventana_s
+        self.ultimo_s = 0.0
+        # (momento, retraso) con retrasos decrecientes: el primero es el máximo de la ventana
+        self._maximos = deque()
+        self.bloqueos = 0
+        self.volcados = 0
+        self._latido = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._hilo_loop: Optional[int] = None
+        self._tarea: Optional[asyncio.Task] = None
+        self._vigia: Optional[threading.Thread] = None
+        self._parar = threading.Event()
+
+    async def _medir(self):
+        while True:
+            inicio = self._latido = time.monotonic()
+            await asyncio.sleep(self.intervalo_s)
+            self._latido = time.monotonic()
+            self.ultimo_s = max(0.0, self._latido - inicio - self.intervalo_s)
+            while self._maximos and self._maximos[-1][1] <= self.ultimo_s:
+                self._maximos.pop()
+            self._maximos.append((self._latido, self.ultimo_s))
+            self._podar()
+            metricas.loop.observar(self.ultimo_s)
+            if self.ultimo_s > self.umbral_s:
+                self.bloqueos += 1
+                log.warning("Event loop retrasado %.3fs (umbral %.3fs)", self.ultimo_s, self.umbral_s)
+
+    def _vigilar(self):
+        """Hilo de muestreo: vuelca la pila del loop cuando deja de latir"""
+        volcado = None  # Latido del bloqueo ya volcado
+        while not self._parar.wait(max(0.05, self.umbral_s / 4)):
+            latido = self._latido
+            atraso = time.monotonic() - latido - self.intervalo_s
+            if atraso <= self.umbral_s or volcado == latido:
+                continue
+            volcado = latido
+            frame = sys._current_frames().get(self._hilo_loop)
+            if frame is None:
+                continue
+            tarea = asyncio.current_task(self._loop)
+            pila = "".join(traceback.format_stack(frame))
+            self.volcados += 1
+            log.warning(
+                "Event loop bloqueado hace %.2fs en la tarea %s; pila del hilo del loop:\n%s",
+                atraso, tarea.get_name() if tarea else "-", pila
             )
 
+    def iniciar(self):
+        if self._tarea is None:
+            self._loop = asyncio.get_running_loop()
+            self._hilo_loop = threading.get_ident()
+            self._latido = time.monotonic()
+            self._tarea = asyncio.create_task(self._medir())
+            self._parar.clear()
+            self._vigia = threading.Thread(target=self._vigilar, name="vigia-loop", daemon=True)
+            self._vigia.start()
+
+    def _podar(self):
+        limite = time.monotonic() - self.ventana_s
+        while self._maximos and self._maximos[0][0] < limite:
+            self._maximos.popleft()
+
+    def maximo(self) -> float:
+        """Retraso máximo de los últimos ventana_s: leerlo no lo reinicia (varios scrapers ven lo mismo)"""
+        self._podar()
+        return self._maximos[0][1] if self._maximos else 0.0
+
+    async def detener(self):
+        if self._tarea:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+        if self._vigia:
+            self._parar.set()
+            self._vigia.join(timeout=1)
+            self._vigia = None
+
+def activar_debug_loop(loop: asyncio.AbstractEventLoop, lento_s: float):
+    """Modo debug de asyncio: avisa (logger "asyncio") de cada callback que tarde más de lento_s"""
+    loop.set_debug(True)
+    loop.slow_callback_duration = lento_s
+    logging.getLogger("asyncio").setLevel(logging.WARNING)
+    log.warning("Modo debug de asyncio activo: callbacks de más de %.3fs se reportan en el log", lento_s)
+
+monitor_loop = MonitorLoop(umbral_s=LOOP_UMBRAL_S, ventana_s=LOOP_VENTANA_MAX_S)
+
+@metricas.recolector
+def _metricas_outbox() -> list:
+    return [
+        ("asistencia_outbox_pendientes", "gauge", "Eventos en el outbox esperando llegar a Sheets", outbox.pendientes()),
+        ("asistencia_outbox_fallidos", "gauge", "Eventos rechazados tras agotar los reintentos", outbox.fallidos()),
+        ("asistencia_outbox_encolados_total", "counter", "Eventos guardados en el outbox", outbox.stats["encolados"]),
+        ("asistencia_outbox_enviados_total", "counter", "Eventos confirmados por Sheets", outbox.stats["enviados"]),
+        ("asistencia_outbox_reintentos_total", "counter", "Reintentos programados", outbox.stats["reintentos"]),
+        ("asistencia_outbox_lotes_total", "counter", "POSTs de lote al webhook", outbox.stats["lotes"]),
+        ("asistencia_circuito_estado", "gauge", "Circuito de Sheets: 0 cerrado, 1 semiabierto, 2 abierto",
+         {CircuitoSheets.CERRADO: 0, CircuitoSheets.SEMIABIERTO: 1, CircuitoSheets.ABIERTO: 2}[circuito_sheets.estado]),
+    ]
+
+@metricas.recolector
+def _metricas_proceso() -> list:
+    series = [
+        ("asistencia_loop_retraso_segundos", "gauge", "Retraso de la última medición del event loop", f"{monitor_loop.ultimo_s:.6f}"),
+        ("asistencia_loop_retraso_max_segundos", "gauge", "Retraso máximo del event loop en los últimos LOOP_VENTANA_MAX_S", f"{monitor_loop.maximo():.6f}"),
+        ("asistencia_loop_bloqueos_total", "counter", "Mediciones con retraso sobre LOOP_UMBRAL_S", monitor_loop.bloqueos),
+        ("asistencia_loop_volcados_total", "counter", "Pilas volcadas por el vigía del event loop", monitor_loop.volcados),
+        ("asistencia_sesiones_abiertas", "gauge", "Usuarios con un turno o un break abierto", sesiones.activas()),
+        ("asistencia_carriles_activos", "gauge", "Usuarios con eventos en proceso", carriles.activos()),
+        ("asistencia_carriles_abortados_total", "counter", "Eventos abortados por un carril trabado", carriles.stats["abortados"]),
+    ]
+    # Sin conexión al gateway discord.py devuelve inf/nan
+    if bot.is_ready() and bot.latency == bot.latency and bot.latency != float("inf"):
+        series.append(("asistencia_gateway_latencia_segundos", "gauge", "Latencia del heartbeat del gateway (bot.latency)", f"{bot.latency:.6f}"))
+    return series
+
+@metricas.recolector
+def _metricas_caches() -> list:
+    tablas = tablas_horario.cache_info()
+    caches = {"identidad": (cache_identidad.hits, cache_identidad.misses), "tablas_horario": (tablas.hits, tablas.misses)}
+    return [
+        ("asistencia_cache_aciertos_total", "counter", "Aciertos por caché", {(("cache", c),): a for c, (a, _) in caches.items()}),
+        ("asistencia_cache_fallos_total", "counter", "Fallos por caché", {(("cache", c),): f for c, (_, f) in caches.items()}),
+        ("asistencia_cache_tasa_aciertos", "gauge", "Aciertos / consultas por caché",
+         {(("cache", c),): f"{a / (a + f):.4f}" if a + f else 0 for c, (a, f) in caches.items()}),
+    ]
+
+class SaludBot:
+    """Estado del gateway según los eventos de conexión, y los chequeos de /healthz y /readyz.
+    
+    Vivo (/healthz): el proceso responde y el gateway no lleva demasiado tiempo caído
+    (discord.py reconecta solo; si no lo logra, reiniciar es lo que lo arregla).
+    Listo (/readyz): puede atender clics y guardarlos; si no, el orquestador deja de
+    mandarle tráfico pero no lo reinicia (un Sheets caído no se arregla reiniciando).
+    """
+
+    def __init__(self):
+        self.conectado = False
+        self.desconectado_desde = time.monotonic()
+
+    def conexion(self, conectado: bool):
+        if conectado:
+            self.conectado = True
+            self.desconectado_desde = None
+        elif self.conectado or self.desconectado_desde is None:
+            self.conectado = False
+            self.desconectado_desde = time.monotonic()
+
+    def segundos_desconectado(self) -> float:
+        return 0.0 if self.desconectado_desde is None else time.monotonic() - self.desconectado_desde
+
+    def vivo(self) -> tuple:
+        """(ok, chequeos) para /healthz"""
+        caido_s = self.segundos_desconectado()
+        chequeos = {"gateway_caido_s": round(caido_s, 1), "loop_retraso_s": round(monitor_loop.ultimo_s, 3)}
+        return caido_s < SALUD_GATEWAY_MAX_MIN * 60, chequeos
+
+    def listo(self) -> tuple:
+        """(ok, chequeos) para /readyz: cada chequeo es {"ok": bool, ...detalle}"""
+        pendientes = outbox.pendientes()
+        abierto_s = circuito_sheets.segundos_abierto()
+        chequeos = {
+            "gateway": {"ok": self.conectado and bot.is_ready()},
+            "panel": {"ok": any(isinstance(vista, PanelAsistenciaPermanente) for vista in bot.persistent_views)},
+            "outbox": {"ok": pendientes < SALUD_OUTBOX_MAX, "pendientes": pendientes, "maximo": SALUD_OUTBOX_MAX},
+            "circuito": {
+                "ok": abierto_s < SALUD_CIRCUITO_MAX_MIN * 60,
+                "estado": circuito_sheets.estado,
+                "abierto_s": round(abierto_s, 1)
+            },
+        }
+        return all(chequeo["ok"] for chequeo in chequeos.values()), chequeos
+
+salud = SaludBot()
+
+@metricas.recolector
+def _metricas_salud() -> list:
+    listo, chequeos = salud.listo()
+    return [
+        ("asistencia_listo", "gauge", "1 si /readyz responde 200", int(listo)),
+        ("asistencia_chequeo_ok", "gauge", "Resultado de cada chequeo de /readyz",
+         {(("chequeo", nombre),): int(chequeo["ok"]) for nombre, chequeo in chequeos.items()}),
+        ("asistencia_gateway_desconectado_segundos", "gauge", "Segundos sin conexión al gateway", f"{salud.segundos_desconectado():.1f}"),
+    ]
+
+class ServidorMetricas:
+    """Servidor aiohttp en el loop del bot (mismo proceso, sin hilos): /healthz, /readyz y /metrics"""
+
+    def __init__(self, host: str, puerto: int):
+        self.host = host
+        self.puerto = puerto
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        return web.Response(
+            body=metricas.exportar().encode("utf-8"),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+
+    async def _healthz(self, request: web.Request) -> web.Response:
+        ok, chequeos = salud.vivo()
+        return web.json_response({"status": "ok" if ok else "error", **chequeos}, status=200 if ok else 503)
+
+    async def _readyz(self, request: web.Request) -> web.Response:
+        ok, chequeos = salud.listo()
+        return web.json_response({"status": "ok" if ok else "error", "chequeos": chequeos}, status=200 if ok else 503)
+
+    async def iniciar(self):
+        app = web.Application()
+        app.router.add_get("/healthz", self._healthz)
+        app.router.add_get("/readyz", self._readyz)
+        if METRICAS_ACTIVAS:
+            app.router.add_get("/metrics", self._metrics)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.host, self.puerto).start()
+        except OSError as e:
+            # Sin puerto el bot sigue funcionando; solo se pierden las métricas
+            log.error("No se pudo abrir el servidor HTTP en %s:%d: %s", self.host, self.puerto, e)
+            await runner.cleanup()
+            return
+        self._runner = runner
+        log.info("Salud y métricas en http://%s:%d (/healthz, /readyz, /metrics)", self.host, self.puerto)
+
+    async def detener(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+servidor_metricas = ServidorMetricas(METRICAS_HOST, PORT)
+
 # =========================
 # BOT SETUP
 # =========================
@@ -1194,28 +4357,101 @@ intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 
-bot = commands.Bot(
+class BotAsistencia(commands.Bot):
+    """Bot con recursos compartidos creados al iniciar y liberados al cerrar"""
+
+    async def setup_hook(self):
+        await cliente_sheets.iniciar()
+        log.info("Pool HTTP de Google Sheets listo (máx. %d conexiones)", SHEETS_MAX_CONEXIONES)
+        limpieza.iniciar()
+        agenda.iniciar()
+        await outbox.iniciar()
+        log.info("Outbox local: %s (%d eventos pendientes)", ASISTENCIA_DB_PATH, outbox.pendientes())
+        await almacen.iniciar()
+        log.info("Historial local de eventos: %s", EVENTOS_DB_PATH)
+        instrumentar_rest(self.http)
+        if TRAZAS_ACTIVAS:
+            exportador_trazas.iniciar()
+            log.info("Trazas por interacción en %s%s", TRAZAS_PATH, f" y OTLP {TRAZAS_OTLP_URL}" if TRAZAS_OTLP_URL else "")
+        log.info("Roster activo: %s", roster_actual().descripcion())
+        inicio = time.perf_counter()
+        restauradas = await asyncio.to_thread(sesiones.restaurar, DiarioSesiones(SESIONES_DIARIO_PATH, SESIONES_COMPACTAR_CADA))
+        log.info(
+            "Sesiones restauradas: %d", restauradas,
+            extra={"latencia_ms": round((time.perf_counter() - inicio) * 1000, 1)}
+        )
+        self.tarea_roster = asyncio.create_task(vigilar_roster())
+        if LOOP_DEBUG:
+            activar_debug_loop(asyncio.get_running_loop(), LOOP_LENTO_S)
+        monitor_loop.iniciar()
+        await servidor_metricas.iniciar()
+
+    async def close(self):
+        if getattr(self, "tarea_roster", None):
+            self.tarea_roster.cancel()
+        await servidor_metricas.detener()
+        await monitor_loop.detener()
+        await super().close()
+        await limpieza.detener()
+        await agenda.detener()
+        await outbox.detener()
+        await almacen.detener()
+        await asyncio.to_thread(sesiones.cerrar)
+        await cliente_sheets.cerrar()
+        exportador_trazas.detener()
+
+bot = BotAsistencia(
     command_prefix="!",
     intents=intents,
     help_command=None,
     case_insensitive=True
 )
 
+@bot.event
+async def on_connect():
+    salud.conexion(True)
+
+@bot.event
+async def on_resumed():
+    salud.conexion(True)
+
+@bot.event
+async def on_disconnect():
+    log.warning("Conexión con el gateway de Discord perdida (discord.py reintenta solo)")
+    salud.conexion(False)
+
 @bot.event
 async def on_ready():
-    print("="*70)
-    print(f"✅ Bot de Asistencia conectado!")
-    print(f"📝 Usuario: {bot.user}")
-    print(f"🏠 Servidores: {len(bot.guilds)}")
-    print(f"📊 Google Sheets: {'✅ Configurado' if GOOGLE_SHEETS_WEBHOOK_URL else '❌ No configurado'}")
-    print(f"🇦🇷 Zona horaria: Argentina (Buenos Aires)")
-    print(f"🎨 Soporte para nombres de colores: BlackTeam, RedTeam, BlueTeam")
+    salud.conexion(True)
+    log.info(
+        "Bot de Asistencia conectado como %s en %d servidores - Google Sheets: %s - Zona horaria: %s",
+        bot.user, len(bot.guilds),
+        "configurado" if GOOGLE_SHEETS_WEBHOOK_URL else "no configurado",
+        TZ_ARGENTINA
+    )
     if GOOGLE_SHEETS_WEBHOOK_URL:
-        print(f"🔗 URL: {GOOGLE_SHEETS_WEBHOOK_URL[:50]}...")
-    print("="*70)
+        log.info("URL: %s...", GOOGLE_SHEETS_WEBHOOK_URL[:50])
     
     bot.add_view(PanelAsistenciaPermanente())
-    print("🔧 Vista de asistencia agregada - Soporte para jornadas laborales nocturnas")
+    log.info("Vista de asistencia agregada - Soporte para jornadas laborales nocturnas")
+    
+    precargados = sum(cache_identidad.precargar(guild.members) for guild in bot.guilds)
+    log.info("Identidades precargadas en caché: %d", precargados)
+    recordatorios.iniciar(bot)
+    await recordatorios.avisar_logouts_interrumpidos(bot)
+
+@bot.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    # El horario se resuelve por apodo: si cambia, se vuelve a resolver en el próximo clic
+    if before.nick != after.nick or before.display_name != after.display_name:
+        cache_identidad.invalidar(after.id)
+        recordatorios.invalidar_miembros()
+
+@bot.event
+async def on_user_update(before: discord.User, after: discord.User):
+    # display_name cae en el nombre global cuando el miembro no tiene apodo
+    if before.display_name != after.display_name:
+        cache_identidad.invalidar(after.id)
 
 @bot.command(name="setup_attendance", aliases=["setup"])
 @commands.has_permissions(administrator=True)
@@ -1262,8 +4498,7 @@ async def setup_attendance(ctx: commands.Context):
         value=(
             "Presionarlo **al finalizar** tu turno.\n"
             "**Primero seleccionas** cuántos modelos trabajaste (1, 2 o 3)\n"
-            "**Luego presionas** el botón 'Rellenar Datos'\n"
-            "**Finalmente completas** los datos de cada modelo\n"
+            "**Luego completas** los datos de cada modelo en el formulario\n"
             "**OBLIGATORIO** completar el reporte de ventas."
         ),
         inline=False
@@ -1275,7 +4510,7 @@ async def setup_attendance(ctx: commands.Context):
             "• Los botones se deben usar en **orden lógico**: `Login → Break → Logout Break → Logout`\n"
             "• **No marcar** un Break sin luego marcar un Logout Break\n"
             "• **El Logout incluye** el reporte obligatorio de ventas\n"
-            "• **Flujo Logout**: Selector → Botón Rellenar → Formulario → Completar\n"
+            "• **Flujo Logout**: Selector de cantidad → Formulario → Completar\n"
             "• **Máximo 3 modelos** por sesión\n"
             "• **Jornadas nocturnas** se registran en la misma fila\n"
             "• Usar siempre desde el **mismo dispositivo** y cuenta de Discord asignada\n"
@@ -1317,6 +4552,54 @@ async def status_command(ctx: commands.Context):
         inline=False
     )
     
+    embed.add_field(
+        name="🔗 Conexiones Google Sheets",
+        value=cliente_sheets.resumen_stats(),
+        inline=False
+    )
+    
+    embed.add_field(
+        name="👥 Caché de Identidades",
+        value=cache_identidad.resumen_stats(),
+        inline=False
+    )
+    
+    embed.add_field(
+        name="🧭 Sesiones de Asistencia",
+        value=sesiones.resumen(),
+        inline=False
+    )
+    
+    embed.add_field(
+        name="🔔 Recordatorios",
+        value=(
+            f"Programados: `{agenda.pendientes()}` │ Login: `{recordatorios.stats['login']}` │ "
+            f"Break: `{recordatorios.stats['break']}` │ Logout: `{recordatorios.stats['logout']}` │ "
+            f"Breaks cerrados: `{recordatorios.stats['breaks_cerrados']}` │ "
+            f"Logouts interrumpidos: `{recordatorios.stats['logouts_interrumpidos']}`"
+        ),
+        inline=False
+    )
+    
+    embed.add_field(
+        name="⚡ Circuito Google Sheets",
+        value=circuito_sheets.resumen(),
+        inline=False
+    )
+    
+    embed.add_field(
+        name="📦 Outbox Local",
+        value=(
+            f"Pendientes: `{outbox.pendientes()}` │ Fallidos: `{outbox.fallidos()}`\n"
+            f"Enviados: `{outbox.stats['enviados']}` │ Reintentos: `{outbox.stats['reintentos']}`\n"
+            f"Carriles activos: `{carriles.activos()}` │ Clics en espera de uno anterior: `{carriles.stats['esperas']}`"
+            + (f" │ ⚠️ Abortados: `{carriles.stats['abortados']}`" if carriles.stats["abortados"] else "") + "\n"
+            f"Historial local: `{almacen.stats['escritos']}` eventos en `{almacen.stats['lotes']}` lotes"
+            + (f" │ ⚠️ Errores: `{almacen.stats['errores']}`" if almacen.stats["errores"] else "")
+        ),
+        inline=False
+    )
+    
     embed.add_field(
         name="⏰ Tolerancias Finales",
         value=(
@@ -1359,8 +4642,9 @@ async def horarios_command(ctx: commands.Context):
     
     # Procesar solo entradas únicas (evitar duplicados T1/BlackTeam)
     usuarios_procesados = set()
+    roster = roster_actual()
     
-    for usuario, info in HORARIOS_USUARIOS.items():
+    for usuario, info in roster.horarios.items():
         # Extraer nombre base
         nombre_base = usuario.split()[0].title()
         team = info["team"]
@@ -1369,7 +4653,10 @@ async def horarios_command(ctx: commands.Context):
         if (nombre_base, team) not in usuarios_procesados:
             horas = calcular_horas_jornada(info["inicio"], info["fin"])
             turno_tipo = "🌙 Nocturno" if info["inicio"] > info["fin"] else "☀️ Diurno"
+            if usuario in roster.calendarios:
+                turno_tipo += " 📅 Calendario"
             
+            equipos_info.setdefault(team, {"nombre": team, "color": "⚪", "miembros": []})
             equipos_info[team]["miembros"].append(
                 f"**{info['inicio']} - {info['fin']}** │ {nombre_base} ({horas}h) {turno_tipo}"
             )
@@ -1406,6 +4693,12 @@ async def horarios_command(ctx: commands.Context):
         inline=False
     )
     
+    embed.add_field(
+        name="🗂️ Versión del Roster",
+        value=roster.descripcion(),
+        inline=False
+    )
+    
     embed.set_footer(text="Cada equipo registra en su propia hoja de Google Sheets")
     
     await ctx.reply(embed=embed, mention_author=False)
@@ -1430,26 +4723,21 @@ async def test_sheets_command(ctx: commands.Context):
             "validacion": "- PRUEBA CONEXIÓN JORNADAS"
         }
         
-        timeout = aiohttp.ClientTimeout(total=30)
+        session = await cliente_sheets.sesion()
         
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.post(
-                GOOGLE_SHEETS_WEBHOOK_URL,
-                json=test_data,
-                headers={'Content-Type': 'application/json'}
-            ) as response:
-                
-                if response.status == 200:
-                    result = await response.json()
-                    if result.get("result") == "success":
-                        await ctx.reply("✅ **Google Sheets funcionando correctamente - Soporte jornadas laborales activo**")
-                    else:
-                        await ctx.reply(f"❌ **Error en Google Sheets**: {result.get('error', 'Unknown error')}")
+        async with session.post(GOOGLE_SHEETS_WEBHOOK_URL, json=test_data) as response:
+            
+            if response.status == 200:
+                result = await response.json()
+                if result.get("result") == "success":
+                    await ctx.reply("✅ **Google Sheets funcionando correctamente - Soporte jornadas laborales activo**")
                 else:
-                    await ctx.reply(f"❌ **HTTP Error {response.status}** conectando a Google Sheets")
+                    await ctx.reply(f"❌ **Error en Google Sheets**: {result.get('error', 'Unknown error')}")
+            else:
+                await ctx.reply(f"❌ **HTTP Error {response.status}** conectando a Google Sheets")
                     
     except asyncio.TimeoutError:
-        await ctx.reply("❌ **Timeout conectando a Google Sheets** (30 segundos)")
+        await ctx.reply(f"❌ **Timeout conectando a Google Sheets** ({SHEETS_TIMEOUT_S:.0f} segundos)")
     except Exception as e:
         await ctx.reply(f"❌ **Error de conexión**: {str(e)}")
 
@@ -1461,15 +4749,17 @@ async def test_horario_command(ctx: commands.Context, *, usuario: str = None):
         return
     
     hora_actual = datetime.now(TZ_ARGENTINA)
+    roster = roster_actual()
+    
+    # Obtener info del usuario
+    info_usuario = obtener_info_usuario(usuario, roster)
+    horario_usuario = roster.horario_en(info_usuario["nombre_completo"], hora_actual) if info_usuario else None
     
     # Test login
-    _, msg_login = validar_login(usuario, hora_actual)
+    _, msg_login = validar_login(usuario, hora_actual, horario_usuario)
     
     # Test logout
-    _, msg_logout = validar_logout(usuario, hora_actual, True)
-    
-    # Obtener info del usuario
-    info_usuario = obtener_info_usuario(usuario)
+    _, msg_logout = validar_logout(usuario, hora_actual, True, horario_usuario)
     
     embed = Embed(
         title=f"🧪 Test de Validaciones - {usuario}",
@@ -1505,6 +4795,16 @@ async def test_horario_command(ctx: commands.Context, *, usuario: str = None):
             inline=False
         )
         
+        if info_usuario["nombre_completo"] in roster.calendarios:
+            embed.add_field(
+                name="📅 Turno Según Calendario",
+                value=(
+                    f"`{horario_usuario['inicio']} - {horario_usuario['fin']}` (jornada {horario_usuario['fecha_jornada']})"
+                    if horario_usuario else "Franco (sin turno cerca de esta hora)"
+                ),
+                inline=False
+            )
+        
         embed.add_field(
             name="🏆 Equipo Detectado",
             value=f"`{info_usuario['team']}` - Usuario reconocido: `{info_usuario['nombre_completo']}`",
@@ -1517,28 +4817,249 @@ async def test_horario_command(ctx: commands.Context, *, usuario: str = None):
             inline=False
         )
     
+    embed.set_footer(text=f"Roster {roster.version}")
+    await ctx.reply(embed=embed, mention_author=False)
+
+@bot.command(name="recargar_horarios")
+@commands.has_permissions(administrator=True)
+async def recargar_horarios_command(ctx: commands.Context):
+    """Recarga el archivo de horarios sin reiniciar el bot (solo administradores)"""
+    try:
+        cambio = await recargar_roster(forzar=True)
+    except Exception as e:
+        log.error("Recarga manual del roster rechazada: %s", e)
+        await ctx.reply(
+            f"❌ El archivo `{ROSTER_PATH}` no es válido, se mantiene el roster {roster_actual().descripcion()}\n`{e}`",
+            mention_author=False
+        )
+        return
+    
+    if cambio:
+        await ctx.reply(f"✅ Roster recargado: {roster_actual().descripcion()}", mention_author=False)
+    elif not os.path.exists(ROSTER_PATH):
+        await ctx.reply(f"⚠️ No existe `{ROSTER_PATH}`, se mantiene {roster_actual().descripcion()}", mention_author=False)
+    else:
+        await ctx.reply(f"ℹ️ Sin cambios, roster {roster_actual().descripcion()}", mention_author=False)
+
+def parsear_fecha_reporte(texto: str) -> Optional[date]:
+    """'hoy', 'ayer', '18/10', '18/10/2026' o '2026-10-18' → fecha (None si no es una fecha)"""
+    hoy = datetime.now(TZ_ARGENTINA).date()
+    texto = texto.strip().lower()
+    if texto == "hoy":
+        return hoy
+    if texto == "ayer":
+        return hoy - timedelta(days=1)
+    for formato in ("%d/%m/%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(texto, formato).date()
+        except ValueError:
+            pass
+    try:
+        return datetime.strptime(f"{texto}/{hoy.year}", "%d/%m/%Y").date()
+    except ValueError:
+        return None
+
+NOMBRES_CATEGORIA = {
+    "ok": "✅ En orden",
+    "tarde": "⏰ Tarde",
+    "muy_temprano": "⏩ Muy temprano",
+    "fuera_de_horario": "🚫 Fuera de horario",
+    "sin_login": "❓ Sin login",
+    "fuera_de_tiempo": "⌛ Fuera de tiempo",
+    "break_excedido": "☕ Break excedido",
+    "break_automatico": "🤖 Break cerrado automático",
+    "fuera_de_orden": "🔀 Fuera de orden",
+}
+NOMBRES_ACCION = {"login": "🟢 Login", "break": "⏸️ Break", "logout_break": "▶️ Logout Break", "logout": "🔴 Logout"}
+
+@bot.command(name="reporte")
+@commands.has_permissions(administrator=True)
+async def reporte_command(ctx: commands.Context, *args: str):
+    """Resumen diario por equipo: validaciones y ventas por modelo (!reporte [team] [fecha])"""
+    team = None
+    fecha = datetime.now(TZ_ARGENTINA).date()
+    for arg in args:
+        fecha_arg = parsear_fecha_reporte(arg)
+        if fecha_arg:
+            fecha = fecha_arg
+        else:
+            team = arg.upper()
+    
+    validaciones, ventas = await almacen.reporte(fecha.isoformat(), team)
+    embed = Embed(
+        title=f"📋 Reporte {team or 'todos los equipos'} - Jornada {fecha.strftime('%d/%m/%Y')}",
+        color=discord.Color.blue()
+    )
+    if not validaciones and not ventas:
+        embed.description = "Sin eventos registrados para esa jornada."
+        await ctx.reply(embed=embed, mention_author=False)
+        return
+    
+    por_team = {}
+    for fila_team, action, categoria, cantidad in validaciones:
+        por_team.setdefault(fila_team, {"acciones": {}, "ventas": []})["acciones"].setdefault(action, []).append((categoria, cantidad))
+    for fila_team, modelo, cantidad, bruto, neto in ventas:
+        por_team.setdefault(fila_team, {"acciones": {}, "ventas": []})["ventas"].append((modelo, cantidad, bruto, neto))
+    
+    for fila_team in sorted(por_team):
+        datos = por_team[fila_team]
+        lineas = []
+        for action in ("login", "break", "logout_break", "logout"):
+            categorias = datos["acciones"].get(action)
+            if categorias:
+                detalle = " │ ".join(f"{NOMBRES_CATEGORIA.get(c, c)}: `{n}`" for c, n in sorted(categorias))
+                lineas.append(f"**{NOMBRES_ACCION[action]}** {detalle}")
+        if datos["ventas"]:
+            total_bruto = sum(v[2] for v in datos["ventas"])
+            total_neto = sum(v[3] for v in datos["ventas"])
+            lineas.append(f"**💰 Ventas** bruto `${total_bruto:,.2f}` │ neto `${total_neto:,.2f}`")
+            lineas.extend(
+                f"• {modelo} ({cantidad}): `${bruto:,.2f}` / `${neto:,.2f}`"
+                for modelo, cantidad, bruto, neto in datos["ventas"][:10]
+            )
+        embed.add_field(name=f"🏆 EQUIPO {fila_team}", value="\n".join(lineas)[:1024] or "-", inline=False)
+    
+    embed.set_footer(text="Resúmenes del historial local (se actualizan con cada evento)")
     await ctx.reply(embed=embed, mention_author=False)
 
+@bot.command(name="reconstruir_reporte")
+@commands.has_permissions(administrator=True)
+async def reconstruir_reporte_command(ctx: commands.Context):
+    """Recalcula los resúmenes de !reporte desde los eventos guardados (solo administradores)"""
+    inicio = time.perf_counter()
+    cantidad = await almacen.reconstruir_resumenes()
+    await ctx.reply(
+        f"✅ Resúmenes reconstruidos desde `{cantidad}` eventos en `{time.perf_counter() - inicio:.2f}s`",
+        mention_author=False
+    )
+
+@bot.command(name="nomina")
+@commands.has_permissions(administrator=True)
+async def nomina_command(ctx: commands.Context, mes: str = None):
+    """Horas trabajadas, breaks, tardanzas y ventas del mes por usuario, en CSV (!nomina [AAAA-MM])"""
+    mes = mes or datetime.now(TZ_ARGENTINA).strftime("%Y-%m")
+    if not re.fullmatch(r"\d{4}-(0[1-9]|1[0-2])", mes):
+        await ctx.reply("❌ Formato de mes inválido. Uso: `!nomina 2026-10`", mention_author=False)
+        return
+    
+    def calcular():
+        ev = cargar_eventos_mes(EVENTOS_DB_PATH, mes)
+        inicio = time.perf_counter()
+        return ev, calcular_nomina(ev), time.perf_counter() - inicio
+    
+    try:
+        ev, resultado, segundos = await asyncio.to_thread(calcular)
+    except sqlite3.Error as e:
+        log.error("No se pudo leer el historial para la nómina: %s", e)
+        await ctx.reply(f"❌ No se pudo leer el historial `{EVENTOS_DB_PATH}`: {e}", mention_author=False)
+        return
+    
+    embed = Embed(title=f"💵 Nómina {mes}", color=discord.Color.green())
+    if not ev["nombres"]:
+        embed.description = "Sin eventos registrados para ese mes."
+        await ctx.reply(embed=embed, mention_author=False)
+        return
+    
+    orden = np.argsort(-resultado["horas_netas"])
+    lineas = [
+        f"**{ev['nombres'][i]}** ({ev['teams'][i]}): `{resultado['horas_netas'][i]:.1f}h` netas"
+        f" │ {int(resultado['jornadas'][i])} jornadas │ {int(resultado['logins_tarde'][i])} tarde"
+        f" │ `${resultado['neto'][i]:,.2f}`"
+        for i in orden[:15]
+    ]
+    embed.description = "\n".join(lineas)[:4000]
+    embed.set_footer(text=f"{len(ev['epoch'])} eventos, {len(ev['nombres'])} usuarios, calculado en {segundos * 1000:.0f} ms")
+    archivo = discord.File(io.BytesIO(nomina_csv(ev, resultado).encode("utf-8")), filename=f"nomina_{mes}.csv")
+    await ctx.reply(embed=embed, file=archivo, mention_author=False)
+
+@bot.command(name="reprocesar")
+@commands.has_permissions(administrator=True)
+async def reprocesar_command(ctx: commands.Context, *args: str):
+    """Recalcula jornada y validación del historial con el roster actual (solo administradores).
+    
+    !reprocesar simular <desde> <hasta> │ !reprocesar <desde> <hasta> │ !reprocesar continuar
+    """
+    uso = "Uso: `!reprocesar [simular] <desde> <hasta>` o `!reprocesar continuar` (fechas como `18/10` o `2026-10-18`)"
+    if reproceso.activo:
+        await ctx.reply("⏳ Ya hay un reproceso en curso.", mention_author=False)
+        return
+    
+    simular = bool(args) and args[0].lower() == "simular"
+    continuar = bool(args) and args[0].lower() == "continuar"
+    desde = hasta = None
+    if not continuar:
+        fechas = [parsear_fecha_reporte(arg) for arg in args[1 if simular else 0:]]
+        if len(fechas) != 2 or None in fechas or fechas[0] > fechas[1]:
+            await ctx.reply(f"❌ {uso}", mention_author=False)
+            return
+        desde, hasta = fechas
+    
+    inicio = time.perf_counter()
+    if simular:
+        revisados, cambios = await reproceso.simular(desde, hasta)
+        filas = reproceso.filas_simuladas(cambios)
+        titulo = f"🔎 Simulación {desde.strftime('%d/%m/%Y')} - {hasta.strftime('%d/%m/%Y')}: `{len(filas)}` de `{revisados}` eventos cambiarían"
+        nombre_archivo = f"reproceso_simulado_{desde.isoformat()}_{hasta.isoformat()}.csv"
+    else:
+        mensaje = await ctx.reply("⏳ Reprocesando el historial...", mention_author=False)
+        
+        async def avance(dia: date, revisados: int, cambios: int):
+            await mensaje.edit(content=f"⏳ Reprocesando... hasta `{dia.strftime('%d/%m/%Y')}`: `{revisados}` revisados, `{cambios}` corregidos")
+        
+        try:
+            totales = await reproceso.ejecutar(desde, hasta, avance)
+        except LookupError as e:
+            await mensaje.edit(content=f"ℹ️ {e}")
+            return
+        except Exception as e:
+            log.exception("Reproceso del historial interrumpido")
+            await mensaje.edit(content=f"❌ Reproceso interrumpido: `{e}`. Seguir con `!reprocesar continuar`")
+            return
+        filas = await reproceso.diferencia(totales["id"])
+        if reproceso.enviar_sheets:
+            destino = f"`{totales['enviados']}` correcciones encoladas para Sheets"
+        else:
+            destino = "solo en el historial local (corregir Sheets con el CSV)"
+        titulo = (
+            f"✅ Reproceso `{totales['id']}`: `{totales['cambios']}` de `{totales['revisados']}` eventos corregidos,"
+            f" {destino}"
+        )
+        nombre_archivo = f"reproceso_{totales['id']}.csv"
+    
+    texto = f"{titulo} ({time.perf_counter() - inicio:.1f}s)"
+    if not filas:
+        await ctx.reply(texto, mention_author=False)
+        return
+    archivo = discord.File(io.BytesIO(reproceso.diferencia_csv(filas).encode("utf-8")), filename=nombre_archivo)
+    await ctx.reply(texto, file=archivo, mention_author=False)
+
 # =========================
 # EJECUCIÓN
 # =========================
 if __name__ == "__main__":
-    print("🚀 Iniciando bot de control de asistencia - VERSIÓN CON JORNADAS LABORALES")
+    if len(sys.argv) > 1 and sys.argv[1] in ("nomina", "nomina-benchmark"):
+        sys.exit(ejecutar_cli_nomina(sys.argv[1:]))
+    
+    log_listener = configurar_logging()
+    log.info("Iniciando bot de control de asistencia - VERSIÓN CON JORNADAS LABORALES")
     
     try:
         import pytz
         import discord
         import aiohttp
-        print("✅ Dependencias verificadas")
+        log.info("Dependencias verificadas")
     except ImportError as e:
-        print(f"❌ Falta instalar dependencia: {e}")
-        print("Ejecuta: pip install discord.py pytz python-dotenv aiohttp")
+        log.error("Falta instalar dependencia: %s. Ejecuta: pip install discord.py pytz python-dotenv aiohttp", e)
+        log_listener.stop()
         exit(1)
     
     try:
-        bot.run(DISCORD_TOKEN)
+        # log_handler=None: discord.py usa el logging ya configurado (cola + JSON)
+        bot.run(DISCORD_TOKEN, log_handler=None)
     except discord.LoginFailure:
-        print("❌ ERROR: Token inválido.")
-    except Exception as e:
-        print(f"❌ Error inesperado: {e}")
+        log.error("Token inválido.")
+    except Exception:
+        log.exception("Error inesperado")
+    finally:
+        log_listener.stop()
 
@@ -0,0 +1,55 @@
+"""Micro-benchmark: validaciones originales vs. tablas por minuto.
+
+Las referencias no llevan los print() de las versiones originales (ya reemplazados
+por logging), así que la diferencia medida es solo la de las tablas.
+
+Uso: python tests/benchmark_tablas.py [repeticiones]
+"""
+import os
+import sys
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+import horarios_referencia as referencia  # noqa: E402
+
+
+def main(repeticiones: int = 5):
+    horarios = [{"inicio": info["inicio"], "fin": info["fin"]} for info in bot.HORARIOS_USUARIOS.values()]
+    momentos = [datetime(2026, 10, 18, h, m) for h in range(24) for m in range(0, 60, 7)]
+    casos = [(horario, momento) for horario in horarios for momento in momentos]
+    # Los debug de la validación no se emiten en producción
+    bot.log_validacion.disabled = True
+    
+    funciones = (
+        ("validar_login",
+         lambda h, m: referencia.validar_login(h, m),
+         lambda h, m: bot.validar_login("x", m, h)),
+        ("validar_logout",
+         lambda h, m: referencia.validar_logout(h, m, True),
+         lambda h, m: bot.validar_logout("x", m, True, h)),
+        ("calcular_fecha_jornada",
+         lambda h, m: referencia.calcular_fecha_jornada(h, m),
+         lambda h, m: bot.calcular_fecha_jornada("x", m, h)),
+    )
+    
+    def medir(funcion) -> float:
+        """Mejor de `repeticiones`, en microsegundos por llamada"""
+        segundos = min(timeit.repeat(lambda: [funcion(h, m) for h, m in casos], number=1, repeat=repeticiones))
+        return segundos * 1e6 / len(casos)
+    
+    print(f"{len(casos)} llamadas por función, mejor de {repeticiones} (us por llamada)")
+    print(f"  {'función':<24}{'original':>9}{'tablas':>9}")
+    total_original = total_tablas = 0.0
+    for nombre, original, con_tablas in funciones:
+        con_tablas(*casos[0])  # compila las tablas antes de medir
+        t_original, t_tablas = medir(original), medir(con_tablas)
+        total_original += t_original
+        total_tablas += t_tablas
+        print(f"  {nombre:<24}{t_original:9.2f}{t_tablas:9.2f}  {t_original / t_tablas:.1f}x")
+    print(f"  {'por clic (las tres)':<24}{total_original:9.2f}{total_tablas:9.2f}  {total_original / total_tablas:.1f}x")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
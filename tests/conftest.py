@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+
+@pytest.fixture
+def roster_integrado():
+    """Fija el roster integrado de bot.py (independiente del horarios.json local)"""
+    anterior = bot.roster_actual()
+    roster = bot.RosterActivo(bot.HORARIOS_USUARIOS, "tests", "bot.py")
+    bot.activar_roster(roster)
+    yield roster
+    bot.activar_roster(anterior)
@@ -0,0 +1,86 @@
+"""Validaciones originales (antes de las tablas por minuto), como referencia.
+
+Mismo código que validar_login / validar_logout / calcular_fecha_jornada antes de
+TablasHorario, con el horario recibido como parámetro y sin los print().
+"""
+from datetime import datetime, timedelta
+
+
+def hora_a_minutos(hora_str: str) -> int:
+    hora, minuto = map(int, hora_str.split(':'))
+    return hora * 60 + minuto
+
+
+def calcular_fecha_jornada(horario: dict, timestamp: datetime) -> str:
+    minutos_evento = timestamp.hour * 60 + timestamp.minute
+    minutos_inicio = hora_a_minutos(horario["inicio"])
+    minutos_fin = hora_a_minutos(horario["fin"])
+    
+    # Determinar si es turno nocturno (cruza medianoche)
+    es_turno_nocturno = minutos_inicio > minutos_fin
+    
+    if es_turno_nocturno:
+        if minutos_evento >= minutos_inicio:
+            # Está en la parte nocturna del mismo día (ej: 22:30, 23:30)
+            return timestamp.strftime("%d/%m/%Y")
+        elif minutos_evento <= minutos_fin:
+            # Está en la parte matutina del día siguiente (ej: 00:47, 06:15)
+            return (timestamp - timedelta(days=1)).strftime("%d/%m/%Y")
+        else:
+            # Fuera del horario laboral
+            return timestamp.strftime("%d/%m/%Y")
+    else:
+        # Turno diurno normal - usar fecha actual
+        return timestamp.strftime("%d/%m/%Y")
+
+
+def validar_login(horario: dict, hora_actual: datetime) -> tuple:
+    hora_actual_mins = hora_actual.hour * 60 + hora_actual.minute
+    hora_inicio_mins = hora_a_minutos(horario["inicio"])
+    
+    diferencia_mins = 0
+    if hora_inicio_mins > 12 * 60:  # Turno nocturno (inicia después del mediodía)
+        if hora_actual_mins >= hora_inicio_mins:
+            diferencia_mins = hora_actual_mins - hora_inicio_mins
+        elif hora_actual_mins < 12 * 60:  # Próximo día (00:00-11:59)
+            diferencia_mins = (24 * 60 - hora_inicio_mins) + hora_actual_mins
+        else:
+            return False, "- FUERA DE HORARIO"
+    else:
+        diferencia_mins = hora_actual_mins - hora_inicio_mins
+    
+    if diferencia_mins < -10:
+        return False, "- MUY TEMPRANO"
+    elif -10 <= diferencia_mins <= 0:
+        return True, ""
+    elif 0 < diferencia_mins <= 10:
+        return True, ""
+    else:
+        horas_tarde = diferencia_mins / 60
+        return False, f"- TARDE ({horas_tarde:.1f}h)"
+
+
+def validar_logout(horario: dict, hora_actual: datetime, tiene_login: bool) -> tuple:
+    if not tiene_login:
+        return True, "- NO MARCO INICIO"
+    
+    hora_actual_mins = hora_actual.hour * 60 + hora_actual.minute
+    hora_fin_mins = hora_a_minutos(horario["fin"])
+    hora_inicio_mins = hora_a_minutos(horario["inicio"])
+    tolerancia_logout = 10
+    
+    diferencia_mins = 0
+    if hora_inicio_mins > hora_fin_mins:  # Turno nocturno
+        if hora_actual_mins <= 12 * 60:  # Parte matutina (00:00-11:59)
+            diferencia_mins = hora_actual_mins - hora_fin_mins
+        else:
+            return False, "- MUY TEMPRANO"
+    else:
+        diferencia_mins = hora_actual_mins - hora_fin_mins
+    
+    if diferencia_mins <= 0:
+        return True, ""
+    elif diferencia_mins <= tolerancia_logout:
+        return True, ""
+    else:
+        return False, "- FUERA DE TIEMPO"
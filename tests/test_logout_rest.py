@@ -0,0 +1,169 @@
+"""Presupuesto de llamadas REST a Discord de un logout completo (ver LOGOUT: SELECTOR + FORMULARIO ÚNICO)"""
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+import bot
+
+# Orden documentado en bot.py (el +1 del primer DM lo hace discord.py dentro de user.send)
+PRESUPUESTO_LOGOUT = [
+    "send_message",              # 1. Botón Logout → selector efímero
+    "send_modal",                # 2. Selector → formulario
+    "edit_message",              # 3. Envío del formulario → "procesando"
+    "dm",                        # 4. DM al usuario
+    "canal_logs",                # 5. Canal de logs
+    "edit_original_response",    # 6. Resultado final
+    "delete_original_response",  # 7. Borrado diferido
+]
+
+
+class _Llamadas(list):
+    def __init__(self):
+        super().__init__()
+        self.embeds = {}
+
+    def rest(self, nombre: str, resultado=None):
+        async def llamada(*args, **kwargs):
+            self.append(nombre)
+            if "embed" in kwargs:
+                self.embeds[nombre] = kwargs["embed"]
+            return resultado
+        return llamada
+
+
+class _Respuesta:
+    def __init__(self, llamadas: _Llamadas):
+        self._hecha = False
+        self._llamadas = llamadas
+        self.kwargs = {}
+        self.modal = None
+
+    def is_done(self) -> bool:
+        return self._hecha
+
+    async def _responder(self, nombre: str, **kwargs):
+        assert not self._hecha, "una interacción solo se responde una vez"
+        self._hecha = True
+        self.kwargs = kwargs
+        self._llamadas.append(nombre)
+
+    async def send_message(self, *args, **kwargs):
+        await self._responder("send_message", **kwargs)
+
+    async def edit_message(self, **kwargs):
+        await self._responder("edit_message", **kwargs)
+
+    async def send_modal(self, modal):
+        self.modal = modal
+        await self._responder("send_modal")
+
+
+class _Limpieza:
+    def __init__(self):
+        self.acciones = []
+
+    def programar(self, retraso_s, accion, descripcion=""):
+        self.acciones.append(accion)
+
+
+@pytest.fixture
+def entorno(monkeypatch):
+    """Outbox, historial y limpieza falsos; Sheets no confirma (queda pendiente)"""
+    outbox = SimpleNamespace(agregar=lambda data, confirmar=False, user_id=None: 1)
+
+    async def sin_confirmacion(evento_id, timeout):
+        return None
+
+    outbox.esperar_confirmacion = sin_confirmacion
+    limpieza = _Limpieza()
+    monkeypatch.setattr(bot, "outbox", outbox)
+    monkeypatch.setattr(bot, "almacen", SimpleNamespace(registrar=lambda *args: None))
+    monkeypatch.setattr(bot, "limpieza", limpieza)
+    monkeypatch.setattr(bot, "LOG_CHANNEL_ID", 999)
+    monkeypatch.setattr(bot, "sesiones", bot.SesionesAsistencia(bot.SESION_GRACIA_H, bot.SESION_MAX_H))
+    bot.cache_identidad.limpiar()
+    return limpieza
+
+
+def _interaccion(llamadas: _Llamadas):
+    canal_logs = SimpleNamespace(send=llamadas.rest("canal_logs"))
+    user = SimpleNamespace(id=42, nick="Mauricio T1", mention="<@42>", send=llamadas.rest("dm"))
+    return SimpleNamespace(
+        user=user,
+        guild=None,
+        channel=SimpleNamespace(id=1),
+        client=SimpleNamespace(get_channel=lambda canal_id: canal_logs),
+        response=_Respuesta(llamadas),
+        edit_original_response=llamadas.rest("edit_original_response"),
+        delete_original_response=llamadas.rest("delete_original_response"),
+    )
+
+
+async def _logout(cantidad: int, limpieza: _Limpieza) -> _Llamadas:
+    llamadas = _Llamadas()
+
+    # En una View los métodos decorados quedan como ítems (Button / Select): se llama a su callback
+    boton = _interaccion(llamadas)
+    await bot.PanelAsistenciaPermanente().btn_logout.callback(boton)
+    vista = boton.response.kwargs["view"]
+
+    selector = _interaccion(llamadas)
+    vista.seleccionar_cantidad._values = [str(cantidad)]
+    await vista.seleccionar_cantidad.callback(selector)
+    modal = selector.response.modal
+
+    for numero, campo in enumerate(modal.campos_nombre, start=1):
+        campo._value = f"modelo {numero}"
+    if modal.campo_montos_juntos is not None:
+        modal.campo_montos_juntos._value = ", ".join("100" for _ in range(cantidad))
+    for campo in modal.campos_monto:
+        campo._value = "100"
+    await modal.on_submit(_interaccion(llamadas))
+
+    for accion in limpieza.acciones:
+        await accion()
+    return llamadas
+
+
+@pytest.mark.parametrize("cantidad", range(1, bot.LOGOUT_MAX_MODELOS + 1))
+def test_logout_respeta_el_presupuesto_de_llamadas(entorno, cantidad):
+    llamadas = asyncio.run(_logout(cantidad, entorno))
+    assert sorted(llamadas) == sorted(PRESUPUESTO_LOGOUT)
+    # El acuse va primero y el borrado al final; DM y canal de logs corren en paralelo
+    assert llamadas[:3] == PRESUPUESTO_LOGOUT[:3]
+    assert llamadas[-2:] == PRESUPUESTO_LOGOUT[-2:]
+
+
+def test_logout_sin_guardar_queda_en_el_canal_de_logs(entorno, monkeypatch):
+    def falla(*args, **kwargs):
+        raise OSError("disco lleno")
+
+    monkeypatch.setattr(bot.outbox, "agregar", falla)
+    llamadas = asyncio.run(_logout(1, entorno))
+    # Mismo presupuesto: el canal de logs se publica igual, con el aviso de que no se guardó
+    assert sorted(llamadas) == sorted(PRESUPUESTO_LOGOUT)
+    campos = [campo.name for campo in llamadas.embeds["canal_logs"].fields]
+    assert "❌ Sin guardar" in campos
+
+
+def test_logout_guardado_sin_aviso(entorno):
+    llamadas = asyncio.run(_logout(1, entorno))
+    assert "❌ Sin guardar" not in [campo.name for campo in llamadas.embeds["canal_logs"].fields]
+
+
+def test_logout_lee_la_sesion_despues_del_login_en_curso(roster_integrado, entorno):
+    async def escenario():
+        # Login clicado antes que el logout, todavía aplicándose en su carril
+        login = bot.carriles.reservar(42)
+        boton = _interaccion(_Llamadas())
+        logout = asyncio.create_task(bot.PanelAsistenciaPermanente().btn_logout.callback(boton))
+        await asyncio.sleep(0)
+        async with login:
+            bot.sesiones.transicion(42, "login", datetime.now(bot.TZ_ARGENTINA))
+        await logout
+        return boton.response.kwargs["view"]
+
+    vista = asyncio.run(escenario())
+    assert "NO MARCO INICIO" not in vista.validacion_msg
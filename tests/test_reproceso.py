@@ -0,0 +1,183 @@
+"""Reproceso del historial: con el roster sin cambios no debe corregir nada"""
+import asyncio
+import random
+import time as reloj_sistema
+from datetime import date, datetime, time, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import bot
+
+DESDE = date(2026, 10, 5)
+DIAS = 5
+ARGENTINA = timezone(timedelta(hours=-3))
+
+
+def _hora(dia: date, hhmm: str, minutos: int = 0) -> datetime:
+    inicio = datetime.combine(dia, time.fromisoformat(hhmm), ARGENTINA)
+    return (inicio + timedelta(minutes=minutos)).astimezone(bot.TZ_ARGENTINA)
+
+
+class _OutboxFalso:
+    def __init__(self):
+        self.ultimo = 0
+
+    def agregar(self, data, confirmar=True, user_id=None):
+        self.ultimo += 1
+        return self.ultimo
+
+
+class _OutboxSinCorrecciones:
+    def agregar_lote(self, eventos):
+        raise AssertionError("sin REPROCESO_ENVIAR_SHEETS las correcciones no van a Sheets")
+
+
+class _AlmacenFalso:
+    def __init__(self):
+        self.lote = []
+
+    def registrar(self, data, user_id=None, evento_id=None):
+        self.lote.append((data, user_id, evento_id))
+
+
+class _Reloj:
+    """Módulo time de bot.py con time() en la hora simulada (vencimiento de las sesiones)"""
+
+    def __init__(self):
+        self.ahora = 0.0
+
+    def time(self) -> float:
+        return self.ahora
+
+    def __getattr__(self, nombre):
+        return getattr(reloj_sistema, nombre)
+
+
+@pytest.fixture
+def registro(monkeypatch):
+    """Eventos armados por actualizar_registro_usuario, sin outbox ni Sheets, con sesiones reales"""
+    almacen = _AlmacenFalso()
+    monkeypatch.setattr(bot, "outbox", _OutboxFalso())
+    monkeypatch.setattr(bot, "almacen", almacen)
+    monkeypatch.setattr(bot, "time", _Reloj())
+    monkeypatch.setattr(bot, "sesiones", bot.SesionesAsistencia(bot.SESION_GRACIA_H, bot.SESION_MAX_H))
+    return almacen.lote
+
+
+def _a_las(momento: datetime) -> datetime:
+    bot.time.ahora = momento.timestamp()
+    return momento
+
+
+def _login(user, identidad, clic: datetime):
+    # Igual que el botón: se valida, pasa por la sesión y se registra con la hora del clic
+    horario = identidad.horario_en(_a_las(clic))
+    _, validacion = bot.validar_login(identidad.nombre, clic, horario)
+    marcas = bot.sesiones.transicion(user.id, "login", clic, horario)
+    return bot.actualizar_registro_usuario(
+        user, "login", None, None, validacion_msg=" ".join(m for m in (validacion, marcas) if m),
+        identidad=identidad, momento=clic
+    )
+
+
+def _logout(user, identidad, clic: datetime, envio: datetime):
+    # Igual que el botón y el formulario: validación al clic, sesión y registro al enviar
+    _a_las(clic)
+    _, validacion = bot.validar_logout(identidad.nombre, clic, bot.sesiones.tiene_login(user.id), identidad.horario_en(clic))
+    marcas = bot.sesiones.transicion(user.id, "logout", _a_las(envio), identidad.horario_en(envio))
+    return bot.actualizar_registro_usuario(
+        user, "logout", None, None,
+        modelos_data=[{"numero": 1, "nombre": "modelo", "monto_bruto": 100.0, "monto_neto": 80.0}],
+        validacion_msg=" ".join(m for m in (validacion, marcas) if m), identidad=identidad,
+        momento=envio, hora_validacion=clic
+    )
+
+
+def _simular_semana(lote: list, semilla: int = 3):
+    azar = random.Random(semilla)
+    for user_id, (nombre, info) in enumerate(sorted(bot.HORARIOS_USUARIOS.items()), start=1):
+        user = SimpleNamespace(id=user_id)
+        identidad = bot.IdentidadUsuario(nombre)
+        duracion = round(bot.calcular_horas_jornada(info["inicio"], info["fin"]) * 60)
+        for numero in range(DIAS):
+            dia = DESDE + timedelta(days=numero)
+            asyncio.run(_login(user, identidad, _hora(dia, info["inicio"], azar.randint(-30, 60))))
+            clic = _hora(dia, info["inicio"], duracion + azar.randint(-60, 30))
+            if numero == 2:
+                # Logout después del margen: la sesión ya venció ("NO MARCO INICIO")
+                clic += timedelta(hours=bot.SESION_GRACIA_H, minutes=azar.randint(5, 90))
+            # El formulario se envía hasta 15 minutos después del clic (cruza la tolerancia)
+            envio = clic + timedelta(minutes=azar.randint(0, 15), seconds=azar.randint(0, 59))
+            asyncio.run(_logout(user, identidad, clic, envio))
+
+
+def _reprocesar(tmp_path, lote: list) -> list:
+    almacen = bot.AlmacenEventos(str(tmp_path / "eventos.db"), 100)
+    conn = almacen._abrir()
+    almacen._crear_esquema(conn)
+    almacen._conn_escritura = conn
+    almacen._escribir(lote)
+    try:
+        _, cambios = bot.ReprocesoHistorial(almacen, None, 2)._tanda(conn, None, DESDE, DESDE + timedelta(days=DIAS + 1), False)
+    finally:
+        conn.close()
+    return cambios
+
+
+def test_roster_sin_cambios_no_genera_diferencias(roster_integrado, registro, tmp_path):
+    _simular_semana(registro)
+    assert len(registro) == 2 * DIAS * len(bot.HORARIOS_USUARIOS)
+    assert _reprocesar(tmp_path, registro) == []
+
+
+def test_logout_se_recalcula_con_la_hora_del_clic(roster_integrado, registro, tmp_path):
+    user = SimpleNamespace(id=1)
+    identidad = bot.IdentidadUsuario("mauricio t1")  # 13:00 - 21:00
+    asyncio.run(_login(user, identidad, _hora(DESDE, "13:00")))
+    # Clic a las 21:05 (en tolerancia), formulario enviado a las 21:14
+    asyncio.run(_logout(user, identidad, _hora(DESDE, "21:05"), _hora(DESDE, "21:14")))
+    assert registro[-1][0]["validacion"] == ""
+    assert _reprocesar(tmp_path, registro) == []
+
+
+def test_logout_despues_del_margen_queda_sin_inicio(roster_integrado, registro, tmp_path):
+    user = SimpleNamespace(id=1)
+    identidad = bot.IdentidadUsuario("mauricio t1")  # 13:00 - 21:00, la sesión vence a la 01:00
+    asyncio.run(_login(user, identidad, _hora(DESDE, "13:00")))
+    clic = _hora(DESDE + timedelta(days=1), "01:30")
+    asyncio.run(_logout(user, identidad, clic, clic + timedelta(minutes=3)))
+    assert "NO MARCO INICIO" in registro[-1][0]["validacion"]
+    assert _reprocesar(tmp_path, registro) == []
+
+
+def _corregir_roster():
+    horarios = dict(bot.HORARIOS_USUARIOS)
+    horarios["mauricio t1"] = dict(horarios["mauricio t1"], inicio="15:00", fin="23:00")
+    bot.activar_roster(bot.RosterActivo(horarios, "corregido", "tests"))
+
+
+def test_roster_corregido_genera_diferencias(roster_integrado, registro, tmp_path):
+    _simular_semana(registro)
+    _corregir_roster()
+    cambios = _reprocesar(tmp_path, registro)
+    assert cambios
+    assert {fila[3] for fila, _, _ in cambios} == {"mauricio t1"}
+
+
+def test_correcciones_quedan_locales_por_defecto(roster_integrado, registro, tmp_path):
+    _simular_semana(registro)
+    _corregir_roster()
+
+    async def reprocesar():
+        almacen = bot.AlmacenEventos(str(tmp_path / "eventos.db"), 100)
+        await almacen.iniciar()
+        try:
+            almacen._escribir(registro)
+            reproceso = bot.ReprocesoHistorial(almacen, _OutboxSinCorrecciones(), 2)
+            return await reproceso.ejecutar(DESDE, DESDE + timedelta(days=DIAS))
+        finally:
+            await almacen.detener()
+
+    totales = asyncio.run(reprocesar())
+    assert totales["cambios"] and totales["enviados"] == 0
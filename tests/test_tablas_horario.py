@@ -0,0 +1,55 @@
+"""Las tablas por minuto dan el mismo veredicto que las validaciones originales"""
+from datetime import datetime
+
+import pytest
+
+import bot
+import horarios_referencia as referencia
+
+# Roster integrado más una grilla de inicios/fines (diurnos, nocturnos y bordes)
+GRILLA = [f"{h:02d}:{m:02d}" for h in range(0, 24, 3) for m in (0, 45)] + ["11:59", "12:00", "12:01", "23:59"]
+HORARIOS = sorted(
+    {(info["inicio"], info["fin"]) for info in bot.HORARIOS_USUARIOS.values()}
+    | {(inicio, fin) for inicio in GRILLA for fin in GRILLA[::3]}
+)
+MOMENTOS = [datetime(2026, 10, 18, h, m, 30) for h in range(24) for m in range(60)]
+
+
+def _horario(par):
+    return {"inicio": par[0], "fin": par[1]}
+
+
+@pytest.mark.parametrize("par", HORARIOS, ids="-".join)
+def test_login_equivalente(par):
+    horario = _horario(par)
+    distintos = [
+        momento.strftime("%H:%M") for momento in MOMENTOS
+        if bot.validar_login("x", momento, horario) != referencia.validar_login(horario, momento)
+    ]
+    assert distintos == []
+
+
+@pytest.mark.parametrize("par", HORARIOS, ids="-".join)
+def test_logout_equivalente(par):
+    horario = _horario(par)
+    distintos = [
+        (momento.strftime("%H:%M"), tiene_login) for momento in MOMENTOS for tiene_login in (True, False)
+        if bot.validar_logout("x", momento, tiene_login, horario) != referencia.validar_logout(horario, momento, tiene_login)
+    ]
+    assert distintos == []
+
+
+@pytest.mark.parametrize("par", HORARIOS, ids="-".join)
+def test_jornada_equivalente(par):
+    horario = _horario(par)
+    distintos = [
+        momento.strftime("%H:%M") for momento in MOMENTOS
+        if bot.calcular_fecha_jornada("x", momento, horario) != referencia.calcular_fecha_jornada(horario, momento)
+    ]
+    assert distintos == []
+
+
+def test_tablas_compartidas_por_horario():
+    assert bot.tablas_horario("22:30", "06:30") is bot.tablas_horario("22:30", "06:30")
+    tablas = bot.tablas_horario("22:30", "06:30")
+    assert len(tablas.login) == len(tablas.logout) == len(tablas.jornada) == bot.MINUTOS_DIA